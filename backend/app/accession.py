@@ -0,0 +1,213 @@
+"""
+Sample accession numbers.
+
+Every order gets a printable, numeric accession number for tube labels:
+
+    BB YYMMDD NNNNN C      e.g. 01 250601 00042 7 -> "01250601000427"
+
+BB is the branch code (ACCESSION_BRANCH or the order's branch), YYMMDD
+the day, NNNNN a per-branch, per-day sequence and C a Luhn check digit,
+so a mistyped or misread barcode is rejected instead of matching the
+wrong order. test_orders.accession_no has a unique index for lookups.
+
+Sequences live in `accession_sequences`, one row per (branch, day).
+Instead of locking that row inside every create_order() transaction,
+each worker reserves ACCESSION_BLOCK_SIZE numbers at a time in its own
+short autocommit statement and hands them out from memory, so order
+entry touches the counter row once per block. Numbers reserved by a
+worker that exits are never used: sequences can have gaps, never
+duplicates.
+
+Orders created before accession numbers existed:
+
+    cd backend
+    python -m app.accession backfill
+"""
+import argparse
+import re
+import threading
+import time
+from datetime import date
+from typing import Callable, Dict, Optional, Tuple
+
+from . import config
+
+SEQUENCES_DDL = """
+    CREATE TABLE IF NOT EXISTS accession_sequences (
+        branch CHAR(2) NOT NULL,
+        day DATE NOT NULL,
+        next_value INT NOT NULL,
+        PRIMARY KEY (branch, day)
+    )
+"""
+
+ACCESSION_COLUMN = "accession_no VARCHAR(20) NULL"
+ACCESSION_INDEX_DDL = "CREATE UNIQUE INDEX uq_orders_accession ON test_orders (accession_no)"
+
+SEQ_WIDTH = 5
+_BRANCH_RE = re.compile(r"^\d{2}$")
+_ACCESSION_RE = re.compile(r"^\d{%d,}$" % (2 + 6 + SEQ_WIDTH + 1))
+
+
+def luhn_digit(digits: str) -> str:
+    """Check digit that makes `digits` + digit pass the Luhn check."""
+    total = 0
+    for i, ch in enumerate(reversed(digits)):
+        d = int(ch)
+        if i % 2 == 0:
+            d *= 2
+            if d > 9:
+                d -= 9
+        total += d
+    return str((10 - total % 10) % 10)
+
+
+def format_accession(branch: str, day: date, seq: int) -> str:
+    body = f"{branch}{day:%y%m%d}{seq:0{SEQ_WIDTH}d}"
+    return body + luhn_digit(body)
+
+
+def normalize(accession: str) -> str:
+    """Strip the separators people type or labels print ("01-250601-00042-7")."""
+    return re.sub(r"[\s-]", "", accession or "")
+
+
+def is_valid(accession: str) -> bool:
+    return bool(_ACCESSION_RE.match(accession)) and luhn_digit(accession[:-1]) == accession[-1]
+
+
+def valid_branch(branch: str) -> bool:
+    return bool(_BRANCH_RE.match(branch or ""))
+
+# ============================================================
+# BLOCK ALLOCATION
+# ============================================================
+
+
+class BlockAllocator:
+    def __init__(self, connect: Callable, block_size: int):
+        self._connect = connect
+        self.block_size = block_size
+        # (branch, day) -> [next, end)
+        self._blocks: Dict[Tuple[str, date], list] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, branch: str, day: date, size: int) -> Tuple[int, int]:
+        """Reserve `size` sequence numbers in one autocommit statement."""
+        conn = self._connect()
+        try:
+            conn.autocommit = True
+            cur = conn.cursor()
+            # LAST_INSERT_ID(expr) hands back the updated value without a
+            # locking re-read. On a fresh connection it stays 0 when the
+            # (branch, day) row is new and starts at 1 instead.
+            cur.execute("""
+                INSERT INTO accession_sequences (branch, day, next_value)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE next_value = LAST_INSERT_ID(next_value + %s)
+            """, (branch, day, 1 + size, size))
+            cur.execute("SELECT LAST_INSERT_ID()")
+            end = cur.fetchone()[0] or 1 + size
+            cur.close()
+        finally:
+            conn.close()
+        return end - size, end
+
+    def next(self, branch: Optional[str] = None, day: Optional[date] = None) -> str:
+        branch = branch or config.ACCESSION_BRANCH
+        day = day or date.today()
+        with self._lock:
+            block = self._blocks.get((branch, day))
+            if block is None or block[0] >= block[1]:
+                # Yesterday's leftovers are never used again
+                self._blocks = {k: v for k, v in self._blocks.items() if k[1] >= day}
+                block = self._blocks[(branch, day)] = list(self.reserve(branch, day, self.block_size))
+            seq = block[0]
+            block[0] += 1
+        return format_accession(branch, day, seq)
+
+
+_allocator: Optional[BlockAllocator] = None
+_allocator_lock = threading.Lock()
+
+
+def init(connect: Callable):
+    """Set the connection factory used to reserve blocks (call at startup)."""
+    global _allocator
+    with _allocator_lock:
+        if _allocator is None:
+            _allocator = BlockAllocator(connect, config.ACCESSION_BLOCK_SIZE)
+
+
+def reset():
+    """Forget the allocator and its reserved blocks (the database was swapped)."""
+    global _allocator
+    with _allocator_lock:
+        _allocator = None
+
+
+def next_accession(branch: Optional[str] = None) -> str:
+    if _allocator is None:
+        raise RuntimeError("accession allocator not initialised")
+    return _allocator.next(branch)
+
+# ============================================================
+# LOOKUP / BACKFILL
+# ============================================================
+
+
+def find_order_id(cur, accession: str) -> Optional[int]:
+    """Order id for an accession number, hot or archived."""
+    cur.execute("""
+        SELECT order_id FROM test_orders WHERE accession_no = %s
+        UNION ALL
+        SELECT order_id FROM archived_orders WHERE accession_no = %s
+        LIMIT 1
+    """, (accession, accession))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def backfill(conn, allocator: BlockAllocator, branch: str, batch_size: int = 1000) -> int:
+    """Give orders without an accession number one for the day they were placed."""
+    cur = conn.cursor()
+    total = 0
+    while True:
+        cur.execute("""
+            SELECT order_id, DATE(order_date) FROM test_orders
+            WHERE accession_no IS NULL
+            ORDER BY order_date, order_id
+            LIMIT %s
+        """, (batch_size,))
+        rows = cur.fetchall()
+        if not rows:
+            break
+        cur.executemany(
+            "UPDATE test_orders SET accession_no = %s WHERE order_id = %s",
+            [(allocator.next(branch, day), order_id) for order_id, day in rows],
+        )
+        conn.commit()
+        total += len(rows)
+    cur.close()
+    return total
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Accession number maintenance")
+    ap.add_argument("command", choices=["backfill"])
+    ap.add_argument("--branch", default=config.ACCESSION_BRANCH)
+    args = ap.parse_args()
+    if not valid_branch(args.branch):
+        ap.error("branch must be two digits")
+
+    from .db import get_db_connection
+
+    conn = get_db_connection()
+    t0 = time.perf_counter()
+    total = backfill(conn, BlockAllocator(get_db_connection, 1000), args.branch)
+    conn.close()
+    print(f"✓ Assigned {total} accession numbers in {time.perf_counter() - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
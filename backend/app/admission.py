@@ -0,0 +1,191 @@
+"""
+Admission control and load shedding.
+
+Every request is assigned a route class:
+
+  critical     writes (order entry, results, patients, ...)
+  interactive  ordinary reads
+  analytics    expensive reads: SQL demo, dashboard, full order list,
+               daily invoice batch, cohort queries, change feed,
+               /api/analytics/*
+
+Each class has its own concurrency limit and a bounded FIFO wait queue.
+When the queue is full, or a request waits longer than the class timeout,
+it is rejected immediately with 503 and Retry-After instead of piling onto
+the shared threadpool and DB. Analytics load therefore cannot starve order
+creation.
+"""
+import asyncio
+import time
+from collections import deque
+
+import orjson
+
+from . import config
+from .metrics import Counter, Gauge, Histogram, register
+
+CRITICAL = "critical"
+INTERACTIVE = "interactive"
+ANALYTICS = "analytics"
+
+ADMISSION_IN_FLIGHT = register(Gauge(
+    "medlab_admission_in_flight",
+    "Requests currently admitted, by route class.",
+    ("route_class",),
+))
+ADMISSION_QUEUE_DEPTH = register(Gauge(
+    "medlab_admission_queue_depth",
+    "Requests waiting for admission, by route class.",
+    ("route_class",),
+))
+ADMISSION_WAIT = register(Histogram(
+    "medlab_admission_wait_seconds",
+    "Time spent queued before admission, by route class.",
+    ("route_class",),
+    (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+))
+ADMISSION_REJECTED = register(Counter(
+    "medlab_admission_rejected_total",
+    "Requests shed with 503, by route class and reason (queue_full/timeout).",
+    ("route_class", "reason"),
+))
+
+_SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+_BYPASS_PATHS = {"/api/health", "/metrics"}
+_ANALYTICS_EXACT = {
+    ("GET", "/api/dashboard"), ("GET", "/api/orders"), ("GET", "/api/invoices"),
+    ("GET", "/api/cohorts"), ("GET", "/api/changes"), ("POST", "/api/sql-demo"),
+}
+_ANALYTICS_PREFIXES = ("/api/analytics/",)
+
+
+def classify(method: str, path: str):
+    """Route class for a request, or None if it bypasses admission."""
+    if path in _BYPASS_PATHS or method == "OPTIONS":
+        return None
+    if (method, path) in _ANALYTICS_EXACT or path.startswith(_ANALYTICS_PREFIXES):
+        return ANALYTICS
+    if method not in _SAFE_METHODS:
+        return CRITICAL
+    return INTERACTIVE
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str):
+        self.reason = reason
+
+
+class AdmissionGate:
+    def __init__(self, name: str, limit: int, queue_size: int, timeout: float, retry_after: int):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self._waiters: deque = deque()
+
+    async def acquire(self):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            ADMISSION_IN_FLIGHT.set(self.name, value=self.active)
+            return
+        if len(self._waiters) >= self.queue_size:
+            raise Rejected("queue_full")
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        ADMISSION_QUEUE_DEPTH.set(self.name, value=len(self._waiters))
+        t0 = time.perf_counter()
+        try:
+            # release() hands its slot directly to the waiter it resolves
+            await asyncio.wait_for(asyncio.shield(fut), self.timeout)
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                # Slot was handed over just as we timed out; give it back.
+                self.release()
+            else:
+                fut.cancel()
+                self._discard(fut)
+            raise Rejected("timeout")
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()
+            else:
+                fut.cancel()
+                self._discard(fut)
+            raise
+        finally:
+            ADMISSION_WAIT.observe(time.perf_counter() - t0, self.name)
+            ADMISSION_QUEUE_DEPTH.set(self.name, value=len(self._waiters))
+
+    def _discard(self, fut):
+        try:
+            self._waiters.remove(fut)
+        except ValueError:
+            pass
+
+    def release(self):
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(True)
+                ADMISSION_QUEUE_DEPTH.set(self.name, value=len(self._waiters))
+                return
+        self.active -= 1
+        ADMISSION_IN_FLIGHT.set(self.name, value=self.active)
+
+
+def build_gates():
+    return {
+        name: AdmissionGate(name, **limits) for name, limits in config.ADMISSION_CLASSES.items()
+    }
+
+
+def total_concurrency(gates) -> int:
+    return sum(g.limit for g in gates.values())
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, gates=None, enabled=None):
+        self.app = app
+        self.gates = gates if gates is not None else build_gates()
+        self.enabled = config.ADMISSION_ENABLED if enabled is None else enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        route_class = classify(scope["method"], scope["path"])
+        gate = self.gates.get(route_class)
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await gate.acquire()
+        except Rejected as r:
+            ADMISSION_REJECTED.inc(route_class, r.reason)
+            await self._reject(send, gate)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
+
+    async def _reject(self, send, gate: AdmissionGate):
+        body = orjson.dumps({"detail": f"Server busy ({gate.name} capacity), retry later"})
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(gate.retry_after).encode()),
+                # CORS middleware sits inside this one
+                (b"access-control-allow-origin", b"*"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
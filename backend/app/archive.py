@@ -0,0 +1,246 @@
+"""
+Cold archive of old completed orders.
+
+REPORT_READY orders placed more than ARCHIVE_AFTER_DAYS ago are moved out
+of test_orders / test_order_tests into `archived_orders`: one row per
+order holding the header and all its lines as a zlib-compressed JSON
+document, plus the few columns patient history needs (patient, doctor,
+date, priority, total, accession number) under a (patient_id,
+order_date) index. The hot
+tables, and every unbounded list/dashboard query over them, then only
+hold the recent working set.
+
+Archived orders are read-only. get_order(), PDF reports and patient
+history fall back to the archive when an order is not in the hot tables;
+windowed analytics (QC, TAT, cohorts, the end-of-day batch window) only
+see hot orders, and revenue aggregates keep the archived orders'
+contributions.
+
+Orders move in batches of ARCHIVE_BATCH_SIZE, each in its own
+transaction (insert into the archive, delete from the hot table; lines
+go with the ON DELETE CASCADE), so the job can be stopped and rerun:
+
+    cd backend
+    python -m app.archive                # ARCHIVE_AFTER_DAYS
+    python -m app.archive --days 730 --dry-run
+"""
+import argparse
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import List, Optional
+
+import orjson
+
+from . import config
+
+ARCHIVE_DDL = """
+    CREATE TABLE IF NOT EXISTS archived_orders (
+        order_id INT PRIMARY KEY,
+        patient_id INT NOT NULL,
+        doctor_id INT NULL,
+        order_date DATETIME NOT NULL,
+        priority ENUM('NORMAL','URGENT') NOT NULL,
+        total_amount DECIMAL(10,2) NOT NULL,
+        accession_no VARCHAR(20) NULL,
+        archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        doc MEDIUMBLOB NOT NULL,
+        INDEX idx_archived_patient (patient_id, order_date),
+        UNIQUE INDEX uq_archived_accession (accession_no)
+    )
+"""
+
+ARCHIVE_ACCESSION_INDEX_DDL = (
+    "CREATE UNIQUE INDEX uq_archived_accession ON archived_orders (accession_no)"
+)
+
+
+def _default(v):
+    if isinstance(v, Decimal):
+        return float(v)
+    raise TypeError
+
+
+def pack(order: dict, lines: List[dict]) -> bytes:
+    body = orjson.dumps({"order": order, "lines": lines}, default=_default)
+    return zlib.compress(body, 6)
+
+
+def unpack(doc: bytes) -> dict:
+    return orjson.loads(zlib.decompress(doc))
+
+
+def _rows(cur) -> List[dict]:
+    cols = [c[0] for c in cur.description]
+    return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+# ============================================================
+# ARCHIVAL JOB
+# ============================================================
+
+
+def archive_batch(conn, cutoff: datetime, batch_size: int) -> int:
+    """Move up to `batch_size` orders placed before `cutoff`; returns the count."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT order_id FROM test_orders
+        WHERE order_date < %s AND status = 'REPORT_READY'
+        ORDER BY order_date, order_id
+        LIMIT %s
+        FOR UPDATE
+    """, (cutoff, batch_size))
+    ids = [r[0] for r in cur.fetchall()]
+    if not ids:
+        conn.rollback()
+        cur.close()
+        return 0
+
+    fmt = ",".join(["%s"] * len(ids))
+    cur.execute(f"SELECT * FROM test_orders WHERE order_id IN ({fmt})", tuple(ids))
+    orders = _rows(cur)
+    cur.execute(f"SELECT * FROM test_order_tests WHERE order_id IN ({fmt}) ORDER BY id", tuple(ids))
+    lines = {}
+    for line in _rows(cur):
+        lines.setdefault(line["order_id"], []).append(line)
+
+    cur.executemany("""
+        INSERT INTO archived_orders
+            (order_id, patient_id, doctor_id, order_date, priority, total_amount, accession_no, doc)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE doc = VALUES(doc)
+    """, [
+        (o["order_id"], o["patient_id"], o["doctor_id"], o["order_date"], o["priority"],
+         o["total_amount"], o.get("accession_no"), pack(o, lines.get(o["order_id"], [])))
+        for o in orders
+    ])
+    cur.execute(f"DELETE FROM test_orders WHERE order_id IN ({fmt})", tuple(ids))
+    conn.commit()
+    cur.close()
+    return len(ids)
+
+
+def count_eligible(cur, cutoff: datetime) -> int:
+    cur.execute("""
+        SELECT COUNT(*) FROM test_orders
+        WHERE order_date < %s AND status = 'REPORT_READY'
+    """, (cutoff,))
+    return cur.fetchone()[0]
+
+
+def run(conn, older_than_days: int, batch_size: int = None, progress=None) -> int:
+    cutoff = datetime.combine(date.today() - timedelta(days=older_than_days), datetime.min.time())
+    batch_size = batch_size or config.ARCHIVE_BATCH_SIZE
+    total = 0
+    while True:
+        n = archive_batch(conn, cutoff, batch_size)
+        total += n
+        if progress and n:
+            progress(total)
+        if n < batch_size:
+            return total
+
+# ============================================================
+# READ-THROUGH
+# ============================================================
+
+
+def get_order(cur, order_id: int) -> Optional[dict]:
+    """
+    An archived order in the shape of the hot get_order() row (order
+    columns, patient/doctor names, raw DB enums) plus patient_phone, with
+    its lines under "tests", or None.
+    """
+    cur.execute("SELECT doc, patient_id FROM archived_orders WHERE order_id = %s", (order_id,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    doc = unpack(row[0])
+    order = doc["order"]
+    # The column, not the document, is re-pointed when patients are merged
+    order["patient_id"] = row[1]
+
+    cur.execute("""
+        SELECT p.full_name, p.date_of_birth, p.gender, p.phone, d.full_name, d.specialization
+        FROM patients p
+        LEFT JOIN doctors d ON d.doctor_id = %s
+        WHERE p.patient_id = %s
+    """, (order["doctor_id"], order["patient_id"]))
+    names = cur.fetchone() or (None,) * 6
+    order.update(zip(
+        ("patient_name", "patient_dob", "patient_gender", "patient_phone",
+         "doctor_name", "doctor_specialization"),
+        names,
+    ))
+    order["tests"] = [{
+        "test_id": line["test_id"],
+        "test_name": line.get("test_name"),
+        "unit": line["unit"],
+        "normal_range_text": line["normal_range_text"],
+        "result_value": line["result_value"],
+        "result_text": line.get("result_text"),
+        "result_flag": line["result_flag"].lower() if line["result_flag"] else None,
+        "price": line.get("price"),
+        "panel_test_id": line.get("panel_test_id"),
+    } for line in doc["lines"]]
+    return order
+
+
+def patient_history(cur, patient_id: int) -> List[dict]:
+    """Hot and archived orders of one patient, newest first (raw DB enums)."""
+    cur.execute("""
+        SELECT o.order_id, o.accession_no, o.order_date, o.priority, o.status, o.total_amount,
+               d.full_name AS doctor_name, FALSE AS archived
+        FROM test_orders o
+        LEFT JOIN doctors d ON d.doctor_id = o.doctor_id
+        WHERE o.patient_id = %s
+        UNION ALL
+        SELECT a.order_id, a.accession_no, a.order_date, a.priority, 'REPORT_READY', a.total_amount,
+               d.full_name, TRUE
+        FROM archived_orders a
+        LEFT JOIN doctors d ON d.doctor_id = a.doctor_id
+        WHERE a.patient_id = %s
+        ORDER BY order_date DESC, order_id DESC
+    """, (patient_id, patient_id))
+    rows = _rows(cur)
+    for r in rows:
+        r["archived"] = bool(r["archived"])
+    return rows
+
+
+def horizon(cur) -> Optional[date]:
+    """Day of the newest archived order, or None if nothing is archived."""
+    cur.execute("SELECT DATE(MAX(order_date)) FROM archived_orders")
+    return cur.fetchone()[0]
+
+# ============================================================
+# CLI
+# ============================================================
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Archive old completed orders")
+    ap.add_argument("--days", type=int, default=config.ARCHIVE_AFTER_DAYS,
+                    help="archive REPORT_READY orders older than this many days")
+    ap.add_argument("--batch-size", type=int, default=config.ARCHIVE_BATCH_SIZE)
+    ap.add_argument("--dry-run", action="store_true", help="only count eligible orders")
+    args = ap.parse_args()
+
+    from .db import get_db_connection
+
+    conn = get_db_connection()
+    if args.dry_run:
+        cutoff = datetime.combine(date.today() - timedelta(days=args.days), datetime.min.time())
+        print(f"{count_eligible(conn.cursor(), cutoff)} orders would be archived")
+        conn.close()
+        return
+
+    t0 = time.perf_counter()
+    total = run(conn, args.days, args.batch_size,
+                progress=lambda n: print(f"\r{n} orders archived", end="", flush=True))
+    conn.close()
+    print(f"\n✓ Archived {total} orders in {time.perf_counter() - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
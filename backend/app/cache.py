@@ -0,0 +1,79 @@
+"""
+In-process caches for slow-changing reference data (catalogue, settings,
+doctors, ...).
+
+Each LocalCache declares the entities it depends on. Writers bump those
+entities through app.invalidation, which clears the matching caches in the
+writing worker immediately and in every other worker on its next poll.
+"""
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from . import metrics
+
+_CACHES: List["LocalCache"] = []
+_registry_lock = threading.Lock()
+
+
+class LocalCache:
+    """
+    With `max_entries`, storing a new key first drops expired entries and
+    then the oldest ones, so caches keyed by request parameters stay bounded.
+    """
+
+    def __init__(self, name: str, entities: Iterable[str], ttl: Optional[float] = None,
+                 max_entries: Optional[int] = None):
+        self.name = name
+        self.entities = frozenset(entities)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data: Dict = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _CACHES.append(self)
+
+    def get_or_load(self, key, loader: Callable):
+        now = time.monotonic()
+        entry = self._data.get(key)
+        if entry is not None and (entry[1] is None or entry[1] > now):
+            metrics.record_cache_hit(self.name)
+            return entry[0]
+
+        metrics.record_cache_miss(self.name)
+        generation = self._generation
+        value = loader()
+        expires = now + self.ttl if self.ttl else None
+        with self._lock:
+            # Don't store a value loaded before an invalidation landed.
+            if generation == self._generation:
+                self._data.pop(key, None)
+                if self.max_entries and len(self._data) >= self.max_entries:
+                    self._evict(now)
+                self._data[key] = (value, expires)
+        return value
+
+    def _evict(self, now: float):
+        """Called with the lock held and the cache full."""
+        for k in [k for k, (_, expires) in self._data.items() if expires is not None and expires <= now]:
+            del self._data[k]
+        while len(self._data) >= self.max_entries:
+            del self._data[next(iter(self._data))]
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+
+def invalidate_entities(entities: Iterable[str]):
+    entities = set(entities)
+    for cache in list(_CACHES):
+        if cache.entities & entities:
+            cache.invalidate()
+
+
+def invalidate_all():
+    for cache in list(_CACHES):
+        cache.invalidate()
@@ -0,0 +1,133 @@
+"""
+Incremental change feed for downstream sync (/api/changes).
+
+patients, test_orders and test_order_tests carry
+
+    updated_at TIMESTAMP(6) ... ON UPDATE CURRENT_TIMESTAMP(6)
+
+indexed on its own, which InnoDB stores as (updated_at, primary key):
+each entity's delta is a range scan ordered exactly like the feed.
+
+Changes are merged across entities in (updated_at, entity, id) order and
+paged with an opaque cursor naming the last row returned. updated_at is
+taken when a statement runs, not when its transaction commits, so the
+feed stops CHANGES_SAFETY_LAG_MS behind the clock: a transaction shorter
+than that cannot commit a row behind a cursor already handed out. Reads
+go to the primary, whose clock defines that bound. Rows are returned
+with their stored column values; deletes are not reported.
+"""
+import base64
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import orjson
+
+from . import config
+
+MAX_LIMIT = 5000
+
+UPDATED_AT_COLUMN = (
+    "updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) "
+    "ON UPDATE CURRENT_TIMESTAMP(6)"
+)
+
+# Feed order of entities sharing one timestamp: (name, table, key, columns)
+ENTITIES = (
+    ("patient", "patients", "patient_id",
+     "patient_id, full_name, date_of_birth, gender, phone, email, address, merged_into, created_at"),
+    ("order", "test_orders", "order_id",
+     "order_id, patient_id, doctor_id, order_date, priority, status, "
+     "total_amount, notes, sample_collected_at, results_entered_at, report_ready_at"),
+    ("order_test", "test_order_tests", "id",
+     "id, order_id, test_id, test_name, price, panel_test_id, unit, normal_range_text, "
+     "result_value, result_text, result_flag, result_entered_at"),
+)
+ENTITY_NAMES = tuple(e[0] for e in ENTITIES)
+TABLES = tuple(e[1] for e in ENTITIES)
+
+
+def index_ddl():
+    return [
+        f"CREATE INDEX idx_{table}_updated ON {table} (updated_at)"
+        for table in TABLES
+    ]
+
+
+def encode_cursor(ts: datetime, rank: int, key: int) -> str:
+    raw = orjson.dumps([ts.isoformat(timespec="microseconds"), rank, key])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, rank, key = orjson.loads(raw)
+        return datetime.fromisoformat(ts), int(rank), int(key)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def parse_entities(entities: Optional[str]) -> List[str]:
+    names = [e.strip() for e in (entities or "").split(",") if e.strip()] or list(ENTITY_NAMES)
+    unknown = [e for e in names if e not in ENTITY_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown entity: {', '.join(unknown)}")
+    return names
+
+
+def fetch_changes(cur, since: Optional[str], limit: int = 500, entities: Optional[List[str]] = None):
+    """
+    Up to `limit` changed rows after cursor `since` (None: from the
+    beginning). Returns (changes, next_cursor, has_more); pass next_cursor
+    back as `since` to resume.
+    """
+    limit = max(1, min(limit, MAX_LIMIT))
+    entities = entities or list(ENTITY_NAMES)
+    start = decode_cursor(since) if since else None
+
+    cur.execute("SELECT NOW(6) - INTERVAL %s MICROSECOND", (config.CHANGES_SAFETY_LAG_MS * 1000,))
+    upper = cur.fetchone()[0]
+
+    candidates = []
+    for rank, (name, table, key, columns) in enumerate(ENTITIES):
+        if name not in entities:
+            continue
+        where, params = ["updated_at < %s"], [upper]
+        if start is not None:
+            ts, c_rank, c_key = start
+            if rank > c_rank:
+                where.append("updated_at >= %s")
+                params.append(ts)
+            elif rank < c_rank:
+                where.append("updated_at > %s")
+                params.append(ts)
+            else:
+                where.append(f"updated_at >= %s AND (updated_at > %s OR {key} > %s)")
+                params += [ts, ts, c_key]
+
+        # One more than needed, to know whether another page exists
+        cur.execute(f"""
+            SELECT updated_at, {columns}
+            FROM {table}
+            WHERE {' AND '.join(where)}
+            ORDER BY updated_at, {key}
+            LIMIT %s
+        """, (*params, limit + 1))
+        cols = [c[0] for c in cur.description]
+        for row in cur.fetchall():
+            data = dict(zip(cols[1:], row[1:]))
+            candidates.append((row[0], rank, data[key], name, data))
+
+    candidates.sort(key=lambda c: c[:3])
+    page = candidates[:limit]
+    has_more = len(candidates) > limit
+
+    changes = [
+        {"entity": name, "id": key, "updated_at": ts, "data": data}
+        for ts, _, key, name, data in page
+    ]
+    if page:
+        next_cursor = encode_cursor(*page[-1][:3])
+    else:
+        next_cursor = since
+    return changes, next_cursor, has_more
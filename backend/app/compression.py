@@ -0,0 +1,282 @@
+"""
+Response compression middleware (gzip, plus brotli / zstd when installed).
+
+  * Negotiates the encoding from Accept-Encoding (q-values honoured),
+    preferring br > zstd > gzip.
+  * Responses smaller than COMPRESSION_MIN_SIZE are sent as-is.
+  * Streaming responses are compressed incrementally, flushing per chunk.
+  * Already-encoded responses and compressed media types (zip, pdf,
+    images, ...) are passed through untouched.
+  * Routes can opt out with the @no_compression decorator or via
+    COMPRESSION_EXCLUDE_PATHS.
+
+brotli and zstandard are optional; without them only gzip is offered.
+"""
+import zlib
+
+import anyio
+
+from . import config
+from .metrics import Counter, register
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+COMPRESSION_BYTES = register(Counter(
+    "medlab_http_compression_bytes_total",
+    "Response bytes before (identity) and after compression, by encoding.",
+    ("encoding", "stage"),
+))
+
+# Payloads above this size are compressed in a worker thread so the event
+# loop is not blocked by a multi-megabyte export.
+_OFFLOAD_THRESHOLD = 256 * 1024
+
+_INCOMPRESSIBLE_PREFIXES = ("image/", "video/", "audio/", "font/woff")
+_INCOMPRESSIBLE_TYPES = {
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-7z-compressed",
+    "application/x-bzip2",
+    "application/zstd",
+    "application/pdf",
+    "application/octet-stream",
+}
+
+
+def no_compression(endpoint):
+    """Mark a route endpoint so its responses are never compressed."""
+    endpoint._compression = False
+    return endpoint
+
+
+def _available_encodings():
+    encodings = []
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    encodings.append("gzip")
+    return encodings
+
+
+def _parse_accept_encoding(value: str) -> dict:
+    accepted = {}
+    for part in value.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+    return accepted
+
+
+def choose_encoding(accept_encoding: str, available=None):
+    accepted = _parse_accept_encoding(accept_encoding)
+    if not accepted:
+        return None
+    best, best_q = None, 0.0
+    for enc in available or _available_encodings():
+        q = accepted.get(enc, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = enc, q
+    return best
+
+
+def _is_compressible(content_type: str) -> bool:
+    ct = content_type.split(";", 1)[0].strip().lower()
+    if not ct:
+        return True
+    if ct in _INCOMPRESSIBLE_TYPES:
+        return False
+    if ct == "image/svg+xml":
+        return True
+    return not ct.startswith(_INCOMPRESSIBLE_PREFIXES)
+
+# ============================================================
+# STREAMING COMPRESSORS
+# ============================================================
+
+
+class _Gzip:
+    def __init__(self, level):
+        self._c = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._c.compress(data)
+
+    def flush(self):
+        return self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._c.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    def __init__(self, level):
+        self._c = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, data):
+        return self._c.process(data)
+
+    def flush(self):
+        return self._c.flush()
+
+    def finish(self):
+        return self._c.finish()
+
+
+class _Zstd:
+    def __init__(self, level):
+        self._c = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._c.compress(data)
+
+    def flush(self):
+        return self._c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._c.flush()
+
+
+_COMPRESSORS = {"gzip": _Gzip, "br": _Brotli, "zstd": _Zstd}
+
+
+def compress_bytes(encoding: str, data: bytes, level: int) -> bytes:
+    c = _COMPRESSORS[encoding](level)
+    return c.compress(data) + c.finish()
+
+# ============================================================
+# ASGI MIDDLEWARE
+# ============================================================
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size=None, level=None, exclude_paths=None):
+        self.app = app
+        self.minimum_size = config.COMPRESSION_MIN_SIZE if minimum_size is None else minimum_size
+        self.level = config.COMPRESSION_LEVEL if level is None else level
+        self.exclude_paths = set(
+            config.COMPRESSION_EXCLUDE_PATHS if exclude_paths is None else exclude_paths
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+
+        accept = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept) if accept else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressingResponder(self, scope, send, encoding)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressingResponder:
+    def __init__(self, mw: CompressionMiddleware, scope, send, encoding):
+        self.mw = mw
+        self.scope = scope
+        self.downstream = send
+        self.encoding = encoding
+        self.start_message = None
+        self.passthrough = False
+        self.compressor = None
+
+    def _route_allows(self) -> bool:
+        endpoint = self.scope.get("endpoint")
+        return getattr(endpoint, "_compression", True)
+
+    async def send(self, message):
+        t = message["type"]
+        if t == "http.response.start":
+            headers = {k.lower(): v for k, v in message.get("headers", [])}
+            if (
+                b"content-encoding" in headers
+                or b"no-transform" in headers.get(b"cache-control", b"")
+                or not _is_compressible(headers.get(b"content-type", b"").decode("latin-1"))
+                or not self._route_allows()
+            ):
+                self.passthrough = True
+                await self.downstream(message)
+            else:
+                # Defer until we see the first body chunk and know the size.
+                self.start_message = message
+            return
+
+        if t != "http.response.body" or self.passthrough:
+            await self.downstream(message)
+            return
+
+        body = message.get("body", b"")
+        more = message.get("more_body", False)
+
+        if self.compressor is None:
+            if not more:
+                await self._send_whole(body)
+                return
+            await self._start_stream()
+
+        chunk = self.compressor.compress(body)
+        chunk += self.compressor.flush() if more else self.compressor.finish()
+        COMPRESSION_BYTES.inc(self.encoding, "identity", amount=len(body))
+        COMPRESSION_BYTES.inc(self.encoding, "compressed", amount=len(chunk))
+        await self.downstream({"type": "http.response.body", "body": chunk, "more_body": more})
+
+    async def _send_whole(self, body: bytes):
+        start = self.start_message
+        if len(body) < self.mw.minimum_size:
+            await self.downstream(start)
+            await self.downstream({"type": "http.response.body", "body": body})
+            return
+
+        if len(body) > _OFFLOAD_THRESHOLD:
+            compressed = await anyio.to_thread.run_sync(
+                compress_bytes, self.encoding, body, self.mw.level
+            )
+        else:
+            compressed = compress_bytes(self.encoding, body, self.mw.level)
+        COMPRESSION_BYTES.inc(self.encoding, "identity", amount=len(body))
+        COMPRESSION_BYTES.inc(self.encoding, "compressed", amount=len(compressed))
+
+        headers = self._encoded_headers(start)
+        headers.append((b"content-length", str(len(compressed)).encode("latin-1")))
+        await self.downstream(dict(start, headers=headers))
+        await self.downstream({"type": "http.response.body", "body": compressed})
+
+    async def _start_stream(self):
+        self.compressor = _COMPRESSORS[self.encoding](self.mw.level)
+        await self.downstream(dict(self.start_message, headers=self._encoded_headers(self.start_message)))
+
+    def _encoded_headers(self, start):
+        headers = [
+            (k, v) for k, v in start.get("headers", [])
+            if k.lower() not in (b"content-length", b"vary")
+        ]
+        vary = [v for k, v in start.get("headers", []) if k.lower() == b"vary"]
+        vary_value = b", ".join(vary + [b"Accept-Encoding"]) if vary else b"Accept-Encoding"
+        headers.append((b"content-encoding", self.encoding.encode("latin-1")))
+        headers.append((b"vary", vary_value))
+        return headers
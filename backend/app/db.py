@@ -1,45 +1,28 @@
-import mysql.connector
-from mysql.connector import Error
-from . import config
-from app.config import DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
+from . import config, storage
+from .storage import Error
 # ---------- Low-level connection helpers ----------
 
 def get_server_connection():
     """
-    Connect to MySQL server WITHOUT specifying database.
-    Used for CREATE DATABASE if not exists.
+    Connect to the database server WITHOUT selecting the database
+    (MySQL). Used for CREATE DATABASE if not exists.
     """
-    return mysql.connector.connect(
-        host=config.DB_HOST,
-        port=config.DB_PORT,
-        user=config.DB_USER,
-        password=config.DB_PASSWORD,
-    )
+    return storage.get_engine().connect(include_db=False)
 
 
 def get_db_connection():
     """
-    Connect to the specific project database.
+    Connect to the specific project database through the configured
+    storage engine (DB_ENGINE).
     Assumes database already exists (init_db() should ensure that).
     """
-    return mysql.connector.connect(
-        host=config.DB_HOST,
-        port=config.DB_PORT,
-        user=config.DB_USER,
-        password=config.DB_PASSWORD,
-        database=config.DB_NAME,
-    )
+    return storage.get_engine().connect(include_db=True)
 
 # ---------- DB initialization (create DB + tables) ----------
 
 def create_database_if_not_exists():
     try:
-        conn = get_server_connection()
-        conn.autocommit = True
-        cursor = conn.cursor()
-        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{config.DB_NAME}`")
-        cursor.close()
-        conn.close()
+        storage.get_engine().create_database()
         print(f"[DB] Database `{config.DB_NAME}` is ready.")
     except Error as e:
         print(f"[DB ERROR] Failed to create database: {e}")
@@ -63,7 +46,11 @@ def create_tables_if_not_exist():
             phone           VARCHAR(20),
             email           VARCHAR(100),
             address         VARCHAR(255),
-            created_at      DATETIME DEFAULT CURRENT_TIMESTAMP
+            merged_into     INT NULL,
+            created_at      DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at      TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)
+                                ON UPDATE CURRENT_TIMESTAMP(6),
+            INDEX idx_patients_updated (updated_at)
         ) ENGINE=InnoDB;
         """,
 
@@ -125,6 +112,9 @@ def create_tables_if_not_exist():
             sample_collected_by VARCHAR(100),
             results_entered_at  DATETIME NULL,
             report_ready_at     DATETIME NULL,
+            updated_at          TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)
+                                    ON UPDATE CURRENT_TIMESTAMP(6),
+            INDEX idx_test_orders_updated (updated_at),
             CONSTRAINT fk_orders_patient
                 FOREIGN KEY (patient_id)
                 REFERENCES patients(patient_id)
@@ -144,11 +134,16 @@ def create_tables_if_not_exist():
             order_test_id       INT AUTO_INCREMENT PRIMARY KEY,
             order_id            INT NOT NULL,
             test_id             INT NOT NULL,
-            result_value        VARCHAR(50) NULL,
+            result_value        DECIMAL(10,2) NULL,
+            result_text         VARCHAR(255) NULL,
             result_flag         ENUM('LOW', 'NORMAL', 'HIGH') NULL,
             unit                VARCHAR(50),
             normal_range_text   VARCHAR(100),
             result_entered_at   DATETIME NULL,
+            updated_at          TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)
+                                    ON UPDATE CURRENT_TIMESTAMP(6),
+            INDEX idx_tot_test_entered_value (test_id, result_entered_at, result_value),
+            INDEX idx_test_order_tests_updated (updated_at),
             CONSTRAINT fk_order_tests_order
                 FOREIGN KEY (order_id)
                 REFERENCES test_orders(order_id)
@@ -0,0 +1,384 @@
+"""
+Duplicate patient detection.
+
+Each patient gets a few blocking keys in `patient_blocking_keys`, written
+by create_patient() in the same transaction:
+
+  nd:<name tokens, sorted>|<dob>       same normalized name and birth date
+  ns:<soundex of name tokens>|<year>   sounds alike, same birth year
+  p:<last 10 phone digits>
+  e:<email>
+
+Only patients sharing a key are ever compared, so:
+
+- the registration check is one indexed lookup (block_key IN (...) on the
+  primary key) followed by fuzzy scoring of the handful of candidates;
+- the batch scan splits patient ids into ranges scored in parallel worker
+  processes, each joining its range's keys against everyone else's, and
+  records pairs scoring at least DEDUP_MIN_SCORE in
+  `patient_merge_candidates` for review.
+
+Keys shared by more than DEDUP_MAX_BLOCK patients (a clinic's own phone
+number, say) carry no signal and are skipped by the scan.
+
+    cd backend
+    python -m app.dedup scan          # indexes patients without keys first
+"""
+import argparse
+import multiprocessing
+import re
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+from . import config
+
+KEYS_DDL = """
+    CREATE TABLE IF NOT EXISTS patient_blocking_keys (
+        block_key VARCHAR(128) NOT NULL,
+        patient_id INT NOT NULL,
+        PRIMARY KEY (block_key, patient_id),
+        INDEX idx_pbk_patient (patient_id),
+        FOREIGN KEY (patient_id) REFERENCES patients(patient_id) ON DELETE CASCADE
+    )
+"""
+
+CANDIDATES_DDL = """
+    CREATE TABLE IF NOT EXISTS patient_merge_candidates (
+        patient_id INT NOT NULL,
+        duplicate_id INT NOT NULL,
+        score DECIMAL(4,3) NOT NULL,
+        reasons VARCHAR(255) NULL,
+        status ENUM('PROPOSED','MERGED','REJECTED') NOT NULL DEFAULT 'PROPOSED',
+        found_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (patient_id, duplicate_id),
+        INDEX idx_pmc_status_score (status, score)
+    )
+"""
+
+_PATIENT_COLS = "patient_id, full_name, date_of_birth, gender, phone, email"
+_TITLES = {"mr", "mrs", "ms", "miss", "dr", "prof", "sri", "smt"}
+MAX_ONLINE_CANDIDATES = 50
+
+# ============================================================
+# NORMALIZATION / KEYS
+# ============================================================
+
+
+def name_tokens(name: Optional[str]) -> List[str]:
+    text = unicodedata.normalize("NFKD", name or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return sorted(t for t in re.split(r"[^a-z]+", text) if t and t not in _TITLES)
+
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    digits = re.sub(r"\D", "", phone or "")
+    return digits[-10:] if len(digits) >= 7 else None
+
+
+def soundex(token: str) -> str:
+    codes = {**dict.fromkeys("bfpv", "1"), **dict.fromkeys("cgjkqsxz", "2"),
+             **dict.fromkeys("dt", "3"), "l": "4", **dict.fromkeys("mn", "5"), "r": "6"}
+    out, last = token[0].upper(), codes.get(token[0], "")
+    for ch in token[1:]:
+        code = codes.get(ch, "")
+        if code and code != last:
+            out += code
+        if ch not in "hw":
+            last = code
+    return (out + "000")[:4]
+
+
+def _dob(value) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    return value.isoformat() if isinstance(value, date) else str(value)[:10]
+
+
+def blocking_keys(full_name, date_of_birth=None, phone=None, email=None) -> List[str]:
+    tokens = name_tokens(full_name)
+    dob = _dob(date_of_birth)
+    keys = []
+    if tokens and dob:
+        keys.append(f"nd:{' '.join(tokens)}|{dob}")
+        keys.append(f"ns:{' '.join(sorted(soundex(t) for t in tokens))}|{dob[:4]}")
+    phone = normalize_phone(phone)
+    if phone:
+        keys.append(f"p:{phone}")
+    if email and "@" in email:
+        keys.append(f"e:{email.strip().lower()}")
+    return [k[:128] for k in keys]
+
+
+def index_patient(cur, patient_id: int, full_name, date_of_birth=None, phone=None, email=None):
+    """(Re)write one patient's blocking keys; call in the writing transaction."""
+    cur.execute("DELETE FROM patient_blocking_keys WHERE patient_id = %s", (patient_id,))
+    keys = blocking_keys(full_name, date_of_birth, phone, email)
+    if keys:
+        cur.executemany(
+            "INSERT IGNORE INTO patient_blocking_keys (block_key, patient_id) VALUES (%s, %s)",
+            [(k, patient_id) for k in keys],
+        )
+
+# ============================================================
+# SCORING
+# ============================================================
+
+
+def score(a: dict, b: dict) -> Tuple[float, List[str]]:
+    """
+    Similarity in [0, 1] of two patient dicts (full_name, date_of_birth,
+    gender, phone, email) and the reasons behind it. Fields missing on
+    either side do not count for or against.
+    """
+    ta, tb = name_tokens(a["full_name"]), name_tokens(b["full_name"])
+    if not ta or not tb:
+        return 0.0, []
+    name_sim = max(
+        SequenceMatcher(None, " ".join(ta), " ".join(tb)).ratio(),
+        len(set(ta) & set(tb)) / len(set(ta) | set(tb)),
+    )
+    parts = [(0.5, name_sim)]
+    reasons = [f"name {name_sim:.2f}"]
+
+    da, db = _dob(a["date_of_birth"]), _dob(b["date_of_birth"])
+    if da and db:
+        if da == db:
+            dob_sim = 1.0
+            reasons.append("same dob")
+        elif da[:4] == db[:4] and da[5:7] == db[8:10] and da[8:10] == db[5:7]:
+            dob_sim = 0.7
+            reasons.append("dob day/month swapped")
+        elif da[4:] == db[4:] and abs(int(da[:4]) - int(db[:4])) == 1:
+            dob_sim = 0.5
+            reasons.append("dob year off by one")
+        else:
+            dob_sim = 0.0
+        parts.append((0.3, dob_sim))
+
+    pa, pb = normalize_phone(a["phone"]), normalize_phone(b["phone"])
+    if pa and pb:
+        parts.append((0.15, float(pa == pb)))
+        if pa == pb:
+            reasons.append("same phone")
+
+    ea, eb = (a["email"] or "").strip().lower(), (b["email"] or "").strip().lower()
+    if ea and eb:
+        parts.append((0.15, float(ea == eb)))
+        if ea == eb:
+            reasons.append("same email")
+
+    total = sum(w * s for w, s in parts) / sum(w for w, _ in parts)
+    if a["gender"] and b["gender"] and a["gender"] != b["gender"]:
+        total *= 0.8
+        reasons.append("gender differs")
+    return round(total, 3), reasons
+
+
+def _rows(cur) -> List[dict]:
+    cols = [c[0] for c in cur.description]
+    return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+# ============================================================
+# ONLINE CHECK
+# ============================================================
+
+
+def possible_duplicates(cur, full_name, date_of_birth=None, phone=None, email=None,
+                        gender=None, exclude_id: Optional[int] = None) -> List[dict]:
+    """Existing patients likely to be the same person, best match first."""
+    keys = blocking_keys(full_name, date_of_birth, phone, email)
+    if not keys:
+        return []
+    fmt = ",".join(["%s"] * len(keys))
+    cur.execute(f"""
+        SELECT {_PATIENT_COLS}
+        FROM patients
+        WHERE patient_id IN (
+            SELECT patient_id FROM patient_blocking_keys WHERE block_key IN ({fmt})
+        )
+        LIMIT {MAX_ONLINE_CANDIDATES}
+    """, tuple(keys))
+    probe = {"full_name": full_name, "date_of_birth": date_of_birth, "gender": gender,
+             "phone": phone, "email": email}
+    matches = []
+    for row in _rows(cur):
+        if row["patient_id"] == exclude_id:
+            continue
+        s, reasons = score(probe, row)
+        if s >= config.DEDUP_MIN_SCORE:
+            matches.append({**row, "score": s, "reasons": reasons})
+    matches.sort(key=lambda m: -m["score"])
+    return matches
+
+# ============================================================
+# BATCH SCAN
+# ============================================================
+
+
+def index_missing(conn, batch_size: int = 5000) -> int:
+    """Write keys for patients that have none (e.g. bulk-loaded rows)."""
+    cur = conn.cursor()
+    total = last_id = 0
+    while True:
+        cur.execute(f"""
+            SELECT {_PATIENT_COLS} FROM patients p
+            WHERE NOT EXISTS (
+                SELECT 1 FROM patient_blocking_keys k WHERE k.patient_id = p.patient_id
+            )
+            AND p.merged_into IS NULL
+            AND p.patient_id > %s
+            ORDER BY p.patient_id
+            LIMIT %s
+        """, (last_id, batch_size))
+        rows = _rows(cur)
+        if not rows:
+            break
+        params = [
+            (k, r["patient_id"])
+            for r in rows
+            for k in blocking_keys(r["full_name"], r["date_of_birth"], r["phone"], r["email"])
+        ]
+        if params:
+            cur.executemany(
+                "INSERT IGNORE INTO patient_blocking_keys (block_key, patient_id) VALUES (%s, %s)",
+                params,
+            )
+        conn.commit()
+        total += len(rows)
+        last_id = rows[-1]["patient_id"]
+    cur.close()
+    return total
+
+
+def scan_range(lo: int, hi: int, skip_keys: List[str], min_score: float) -> List[tuple]:
+    """
+    Worker: score every pair (a, b) with lo <= a <= hi, b > a sharing a
+    key. Runs in a separate process with its own connection.
+    """
+    from .db import get_db_connection
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    skip = ""
+    params: list = [lo, hi]
+    if skip_keys:
+        skip = f"AND a.block_key NOT IN ({','.join(['%s'] * len(skip_keys))})"
+        params += skip_keys
+    cur.execute(f"""
+        SELECT DISTINCT a.patient_id, b.patient_id
+        FROM patient_blocking_keys a
+        JOIN patient_blocking_keys b ON b.block_key = a.block_key AND b.patient_id > a.patient_id
+        WHERE a.patient_id BETWEEN %s AND %s {skip}
+    """, tuple(params))
+    pairs = cur.fetchall()
+    if not pairs:
+        conn.close()
+        return []
+
+    ids = sorted({i for pair in pairs for i in pair})
+    patients: Dict[int, dict] = {}
+    for start in range(0, len(ids), 1000):
+        chunk = ids[start:start + 1000]
+        cur.execute(
+            f"SELECT {_PATIENT_COLS} FROM patients WHERE patient_id IN ({','.join(['%s'] * len(chunk))})",
+            tuple(chunk),
+        )
+        patients.update((r["patient_id"], r) for r in _rows(cur))
+    conn.close()
+
+    found = []
+    for a, b in pairs:
+        if a in patients and b in patients:
+            s, reasons = score(patients[a], patients[b])
+            if s >= min_score:
+                found.append((a, b, s, ", ".join(reasons)[:255]))
+    return found
+
+
+def scan(conn, workers: int = None, chunk: int = None, progress=None) -> int:
+    """Propose merges across the whole patients table; returns pairs recorded."""
+    workers = workers or config.DEDUP_WORKERS
+    chunk = chunk or config.DEDUP_CHUNK
+    index_missing(conn)
+
+    cur = conn.cursor()
+    cur.execute("SELECT MIN(patient_id), MAX(patient_id) FROM patients")
+    lo, hi = cur.fetchone()
+    if lo is None:
+        return 0
+    cur.execute("""
+        SELECT block_key FROM patient_blocking_keys
+        GROUP BY block_key HAVING COUNT(*) > %s
+    """, (config.DEDUP_MAX_BLOCK,))
+    skip_keys = [r[0] for r in cur.fetchall()]
+
+    ranges = [(s, min(s + chunk - 1, hi)) for s in range(lo, hi + 1, chunk)]
+    total = 0
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(scan_range, a, b, skip_keys, config.DEDUP_MIN_SCORE) for a, b in ranges]
+        for done, fut in enumerate(futures, 1):
+            found = fut.result()
+            if found:
+                # Re-scans refresh scores but keep reviewers' decisions
+                cur.executemany("""
+                    INSERT INTO patient_merge_candidates (patient_id, duplicate_id, score, reasons)
+                    VALUES (%s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE score = VALUES(score), reasons = VALUES(reasons)
+                """, found)
+                conn.commit()
+                total += len(found)
+            if progress:
+                progress(done, len(ranges), total)
+    cur.close()
+    return total
+
+
+def list_candidates(cur, min_score: float, limit: int) -> List[dict]:
+    cur.execute("""
+        SELECT c.patient_id, a.full_name AS patient_name,
+               c.duplicate_id, b.full_name AS duplicate_name,
+               c.score, c.reasons, c.found_at
+        FROM patient_merge_candidates c
+        JOIN patients a ON a.patient_id = c.patient_id
+        JOIN patients b ON b.patient_id = c.duplicate_id
+        WHERE c.status = 'PROPOSED' AND c.score >= %s
+        ORDER BY c.score DESC, c.patient_id, c.duplicate_id
+        LIMIT %s
+    """, (min_score, limit))
+    return _rows(cur)
+
+# ============================================================
+# CLI
+# ============================================================
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Duplicate patient detection")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sc = sub.add_parser("scan", help="propose merges across all patients")
+    sc.add_argument("--workers", type=int, default=config.DEDUP_WORKERS)
+    sc.add_argument("--chunk", type=int, default=config.DEDUP_CHUNK, help="patient ids per task")
+    sub.add_parser("index", help="write blocking keys for patients without them")
+    args = ap.parse_args()
+
+    from .db import get_db_connection
+
+    conn = get_db_connection()
+    t0 = time.perf_counter()
+    if args.cmd == "index":
+        n = index_missing(conn)
+        print(f"✓ Indexed {n} patients in {time.perf_counter() - t0:.2f}s")
+    else:
+        n = scan(conn, args.workers, args.chunk, progress=lambda d, t, f: print(
+            f"\r{d}/{t} ranges, {f} candidate pairs", end="", flush=True))
+        print(f"\n✓ {n} candidate pairs recorded in {time.perf_counter() - t0:.2f}s")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
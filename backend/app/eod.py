@@ -0,0 +1,290 @@
+"""
+End-of-day batch report generation.
+
+Selects every order that became REPORT_READY in a window (through
+idx_orders_tat), loads their headers and lines in bulk (two queries per
+batch of BATCH_SIZE orders), renders the PDFs across the report process
+pool and writes them to REPORT_BATCH_DIR/<job_id>/ plus a combined zip.
+
+Progress is kept in manifest.json next to the PDFs and rewritten after
+every batch, so a job is resumable: re-running the same window skips
+orders already written whose report_key is unchanged, re-renders those
+whose data changed and drops orders no longer in the window. Throughput
+is reported in reports/minute.
+
+    cd backend
+    python -m app.eod --date 2025-06-01
+    python -m app.eod --from 2025-06-01 --to 2025-06-07
+"""
+import argparse
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import as_completed
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Optional
+
+import orjson
+
+from . import config, reports
+
+BATCH_SIZE = 200
+MANIFEST = "manifest.json"
+ARCHIVE = "reports.zip"
+# A "running" manifest not updated for this long belongs to a dead process
+STALE_AFTER_SECONDS = 120
+
+_JOB_ID_RE = re.compile(r"^eod-\d{4}-\d{2}-\d{2}-\d{4}-\d{2}-\d{2}$")
+
+
+def job_id_for(date_from: date, date_to: date) -> str:
+    return f"eod-{date_from.isoformat()}-{date_to.isoformat()}"
+
+
+def valid_job_id(job_id: str) -> bool:
+    return bool(_JOB_ID_RE.match(job_id))
+
+
+def job_dir(job_id: str) -> str:
+    return os.path.join(config.REPORT_BATCH_DIR, job_id)
+
+
+def read_manifest(job_id: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(job_dir(job_id), MANIFEST), "rb") as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(directory: str, manifest: dict):
+    manifest["updated_at"] = time.time()
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+    os.replace(tmp, os.path.join(directory, MANIFEST))
+
+
+def is_running(manifest: Optional[dict]) -> bool:
+    return bool(
+        manifest
+        and manifest["status"] == "running"
+        and time.time() - manifest.get("updated_at", 0) < STALE_AFTER_SECONDS
+    )
+
+
+def summary(manifest: dict) -> dict:
+    """Manifest without the per-order map, for progress reporting."""
+    return {k: v for k, v in manifest.items() if k != "orders"}
+
+
+def load_settings(cur) -> Dict[str, str]:
+    cur.execute("SELECT setting_key, setting_value FROM app_settings")
+    return {key: (value or "") for key, value in cur.fetchall()}
+
+
+def run(connect: Callable, date_from: date, date_to: date,
+        settings: Optional[Dict[str, str]] = None,
+        progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """
+    Generate (or resume) the batch for [date_from, date_to]. `connect`
+    opens a DB connection. Returns the final manifest.
+    """
+    job_id = job_id_for(date_from, date_to)
+    directory = job_dir(job_id)
+    os.makedirs(directory, exist_ok=True)
+
+    # orders: order_id -> {"file": pdf name, "key": report_key it was rendered from}
+    manifest = read_manifest(job_id) or {"job_id": job_id, "orders": {}}
+    done: Dict[str, dict] = {
+        oid: entry for oid, entry in manifest["orders"].items()
+        if isinstance(entry, dict) and os.path.exists(os.path.join(directory, entry["file"]))
+    }
+    manifest["orders"] = done
+    manifest.update({
+        "date_from": date_from.isoformat(),
+        "date_to": date_to.isoformat(),
+        "status": "running",
+        "started_at": time.time(),
+        "resumed_from": 0,
+        "total": None,
+        "done": len(done),
+        "rendered": 0,
+        "cached": 0,
+        "failed": [],
+        "archive": None,
+        "error": None,
+    })
+
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        if settings is None:
+            settings = load_settings(cur)
+        cur.execute("""
+            SELECT order_id FROM test_orders
+            WHERE report_ready_at >= %s AND report_ready_at < %s AND status = 'REPORT_READY'
+            ORDER BY report_ready_at, order_id
+        """, (date_from, date_to + timedelta(days=1)))
+        order_ids = [r[0] for r in cur.fetchall()]
+        _drop_stale(directory, done, {str(oid) for oid in order_ids})
+        manifest["total"] = len(order_ids)
+        manifest["resumed_from"] = len(done)
+        _write_manifest(directory, manifest)
+
+        # Written orders are reloaded too: their key shows whether the
+        # report changed (results corrected, settings edited) since then.
+        pool = reports.get_pool()
+        for start in range(0, len(order_ids), BATCH_SIZE):
+            batch = reports.load_reports_data(cur, order_ids[start:start + BATCH_SIZE], settings)
+
+            futures = {}
+            for data in batch:
+                oid = data["order"]["order_id"]
+                key = reports.report_key(data)
+                if done.get(str(oid), {}).get("key") == key:
+                    continue
+                pdf = reports.read_cached(key)
+                if pdf is not None:
+                    manifest["cached"] += 1
+                    _save(directory, manifest, oid, key, pdf)
+                else:
+                    futures[pool.submit(reports.render_report, data)] = (oid, key)
+
+            for fut in as_completed(futures):
+                oid, key = futures[fut]
+                try:
+                    pdf = fut.result()
+                except Exception as e:
+                    manifest["failed"].append({"order_id": oid, "error": str(e)})
+                    done.pop(str(oid), None)  # never archive an outdated report
+                    continue
+                reports.write_cached(key, pdf)
+                manifest["rendered"] += 1
+                _save(directory, manifest, oid, key, pdf)
+
+            _update_rate(manifest)
+            _write_manifest(directory, manifest)
+            if progress:
+                progress(summary(manifest))
+        cur.close()
+
+        manifest["archive"] = _build_archive(directory, done)
+        manifest["status"] = "done" if not manifest["failed"] else "done_with_errors"
+        reports.prune_cache()
+    except Exception as e:
+        manifest["status"] = "failed"
+        manifest["error"] = str(e)
+        raise
+    finally:
+        conn.close()
+        _update_rate(manifest)
+        _write_manifest(directory, manifest)
+        if progress:
+            progress(summary(manifest))
+    return manifest
+
+
+def _save(directory: str, manifest: dict, order_id: int, key: str, pdf: bytes):
+    name = f"report-{order_id}.pdf"
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(pdf)
+    os.replace(tmp, os.path.join(directory, name))
+    manifest["orders"][str(order_id)] = {"file": name, "key": key}
+
+
+def _drop_stale(directory: str, done: Dict[str, dict], order_ids):
+    """Forget (and delete) reports of orders that left the window."""
+    for oid in [oid for oid in done if oid not in order_ids]:
+        try:
+            os.remove(os.path.join(directory, done.pop(oid)["file"]))
+        except FileNotFoundError:
+            pass
+
+
+def _update_rate(manifest: dict):
+    elapsed = time.time() - manifest["started_at"]
+    produced = manifest["rendered"] + manifest["cached"]
+    manifest["done"] = len(manifest["orders"])
+    manifest["elapsed_seconds"] = round(elapsed, 2)
+    manifest["reports_per_minute"] = round(produced / elapsed * 60, 1) if elapsed > 0 else None
+
+
+def _build_archive(directory: str, done: Dict[str, dict]) -> str:
+    path = os.path.join(directory, ARCHIVE)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    # PDF content streams are already compressed
+    with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_STORED) as zf:
+        for oid in sorted(done, key=int):
+            zf.write(os.path.join(directory, done[oid]["file"]), done[oid]["file"])
+    os.replace(tmp, path)
+    return path
+
+# ============================================================
+# BACKGROUND JOBS (API)
+# ============================================================
+
+_threads: Dict[str, threading.Thread] = {}
+_threads_lock = threading.Lock()
+
+
+def start_job(connect: Callable, date_from: date, date_to: date,
+              settings: Optional[Dict[str, str]] = None) -> dict:
+    """Run the batch in a background thread unless it is already running."""
+    job_id = job_id_for(date_from, date_to)
+    with _threads_lock:
+        thread = _threads.get(job_id)
+        if (thread and thread.is_alive()) or is_running(read_manifest(job_id)):
+            return {"job_id": job_id, "status": "running"}
+
+        def target():
+            try:
+                run(connect, date_from, date_to, settings)
+            except Exception:
+                pass  # recorded in the manifest
+
+        thread = threading.Thread(target=target, name=f"medlab-{job_id}", daemon=True)
+        _threads[job_id] = thread
+        thread.start()
+    return {"job_id": job_id, "status": "started"}
+
+# ============================================================
+# CLI
+# ============================================================
+
+
+def main():
+    ap = argparse.ArgumentParser(description="End-of-day batch report generation")
+    ap.add_argument("--date", type=date.fromisoformat, help="single day (default: today)")
+    ap.add_argument("--from", dest="date_from", type=date.fromisoformat)
+    ap.add_argument("--to", dest="date_to", type=date.fromisoformat)
+    args = ap.parse_args()
+
+    date_from = args.date_from or args.date or date.today()
+    date_to = args.date_to or args.date or date_from
+
+    from .db import get_db_connection
+
+    def show(m):
+        print(
+            f"\r{m['done']}/{m['total'] or 0} reports "
+            f"({m['rendered']} rendered, {m['cached']} cached, {len(m['failed'])} failed) "
+            f"{m['reports_per_minute'] or 0:.0f} reports/min",
+            end="", flush=True,
+        )
+
+    try:
+        manifest = run(get_db_connection, date_from, date_to, progress=show)
+    finally:
+        print()
+        reports.shutdown_pool()
+    print(f"✓ {manifest['status']} at {datetime.now():%H:%M:%S}: {manifest['archive']}")
+
+
+if __name__ == "__main__":
+    main()
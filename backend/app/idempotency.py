@@ -0,0 +1,124 @@
+"""
+Idempotency-Key support for non-idempotent writes (order creation, result
+submission).
+
+The key is claimed with an INSERT into `idempotency_keys` as the first
+statement of the handler's own transaction, and the response is stored in
+the same row just before COMMIT:
+
+  * first request   → INSERT succeeds, the handler runs, the response is
+                      stored and committed atomically with the writes;
+  * retry           → INSERT hits the primary key (1062); the stored
+                      response is returned without re-running anything;
+  * concurrent dup  → INSERT blocks on the first transaction's row lock,
+                      then either sees its committed response or, if it
+                      rolled back, proceeds as the first request.
+
+Rows expire after IDEMPOTENCY_TTL_HOURS and are purged opportunistically.
+"""
+import hashlib
+import random
+
+import orjson
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+from . import config, storage
+from .serialization import dumps
+
+MAX_KEY_LENGTH = 128
+
+IDEMPOTENCY_KEYS_DDL = """
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        idem_key VARCHAR(128) NOT NULL,
+        endpoint VARCHAR(64) NOT NULL,
+        request_hash CHAR(64) NOT NULL,
+        status_code SMALLINT NULL,
+        response_body MEDIUMBLOB NULL,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        expires_at DATETIME NOT NULL,
+        PRIMARY KEY (idem_key, endpoint),
+        INDEX idx_idem_expires (expires_at)
+    )
+"""
+
+_PURGE_PROBABILITY = 0.01
+
+
+def request_hash(endpoint: str, *parts) -> str:
+    body = orjson.dumps([endpoint, *parts], option=orjson.OPT_SORT_KEYS, default=str)
+    return hashlib.sha256(body).hexdigest()
+
+
+def _insert(cur, key, endpoint, req_hash):
+    cur.execute("""
+        INSERT INTO idempotency_keys (idem_key, endpoint, request_hash, expires_at)
+        VALUES (%s, %s, %s, NOW() + INTERVAL %s HOUR)
+    """, (key, endpoint, req_hash, config.IDEMPOTENCY_TTL_HOURS))
+
+
+def claim(conn, key: str, endpoint: str, req_hash: str):
+    """
+    Claim `key` for this transaction. Returns None when the caller should
+    execute the request, or a Response replaying the stored result.
+    Must be the first statement of the transaction.
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(400, f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+
+    cur = conn.cursor()
+    try:
+        if random.random() < _PURGE_PROBABILITY:
+            cur.execute("DELETE FROM idempotency_keys WHERE expires_at < NOW() LIMIT 500")
+
+        for _ in range(2):
+            try:
+                _insert(cur, key, endpoint, req_hash)
+                return None
+            except storage.IntegrityError as e:
+                if e.errno != 1062:
+                    raise
+
+            # Locking read: sees the latest committed row, not our snapshot.
+            cur.execute("""
+                SELECT request_hash, status_code, response_body, expires_at < NOW()
+                FROM idempotency_keys
+                WHERE idem_key=%s AND endpoint=%s
+                FOR SHARE
+            """, (key, endpoint))
+            row = cur.fetchone()
+            if row is None:
+                continue
+            stored_hash, status_code, body, expired = row
+            if expired:
+                cur.execute(
+                    "DELETE FROM idempotency_keys WHERE idem_key=%s AND endpoint=%s",
+                    (key, endpoint),
+                )
+                continue
+            if stored_hash != req_hash:
+                raise HTTPException(422, "Idempotency-Key was already used with a different request")
+            if status_code is None:
+                # Only possible if the original transaction stored no response.
+                raise HTTPException(409, "Request with this Idempotency-Key is still in progress")
+            return Response(
+                content=bytes(body),
+                status_code=status_code,
+                media_type="application/json",
+                headers={"Idempotent-Replayed": "true"},
+            )
+
+        raise HTTPException(409, "Could not claim Idempotency-Key")
+    finally:
+        cur.close()
+
+
+def store(conn, key: str, endpoint: str, result, status_code: int = 200):
+    """Record the response for `key`; call right before COMMIT."""
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE idempotency_keys
+        SET status_code=%s, response_body=%s
+        WHERE idem_key=%s AND endpoint=%s
+    """, (status_code, dumps(result), key, endpoint))
+    cur.close()
@@ -0,0 +1,503 @@
+"""
+Analyzer result ingestion over TCP (HL7 v2 ORU^R01 subset, MLLP framing).
+
+Each message is framed as <VT> segments <FS><CR>; segments are separated
+by CR. The subset understood:
+
+    MSH|^~\\&|<app>|<facility>|...|<time>||ORU^R01|<control id>|P|2.5
+    OBR|1|<order id or accession no>|...   (placer order number)
+    OBX|1|NM|<test id>^<test name>||<value>|<unit>|<range>|<flag>|||F
+    OBX|2|ST|^<test name>||Reactive|...|||F
+
+OBX lines belong to the preceding OBR, whose order is given by id or by
+the accession number on the tube (recognised by its check digit). NM values are stored as
+result_value, any other value type as result_text; result status X
+(cannot obtain) and D (deleted) are skipped. Tests are matched by id, or
+by name when the id component is not numeric.
+
+Connections read messages as a stream and hand them to a single writer
+task that applies everything queued (up to INGEST_BATCH_SIZE results) in
+one transaction through results.record_results(), the same statement the
+results API uses. Every message gets an ACK in arrival order on its own
+connection, so an analyzer may pipeline: AA when all its results matched
+an order line, AE naming the unmatched ones (the rest are stored), AR for
+messages that could not be parsed.
+
+    cd backend
+    python -m app.ingest serve                            # INGEST_HOST:INGEST_PORT
+    python -m app.ingest simulate --orders 2000 --connections 4
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set
+
+from . import accession, config, outbox, results
+from .metrics import Counter, Histogram, register
+
+logger = logging.getLogger("medlab.ingest")
+
+VT, FS, CR = b"\x0b", b"\x1c", b"\r"
+FRAME_END = FS + CR
+SKIP_STATUSES = {"X", "D"}
+MAX_FRAME_BYTES = 1 << 20
+TEST_NAMES_TTL = 60.0
+
+INGEST_RESULTS = register(Counter(
+    "medlab_ingest_results_total",
+    "Analyzer results received, by outcome (applied/unmatched/rejected).",
+    ("outcome",),
+))
+INGEST_BATCH_SECONDS = register(Histogram(
+    "medlab_ingest_batch_seconds",
+    "Time to apply one batch of analyzer results.",
+    (),
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+))
+
+
+class ParseError(ValueError):
+    def __init__(self, text: str, message: Optional[dict] = None):
+        super().__init__(text)
+        # Header fields parsed so far, for addressing the AR
+        self.message = message or {"control_id": "", "sender": ("", "")}
+
+# ============================================================
+# PROTOCOL
+# ============================================================
+
+
+def parse_message(raw: bytes) -> dict:
+    """
+    One de-framed ORU message as {"control_id", "sender", "results"},
+    where results are dicts with order_id or accession_no, test_id or
+    test_name, value, text and the OBX set id.
+    """
+    text = raw.decode("utf-8", errors="replace").replace("\n", "\r")
+    segments = [s for s in text.split("\r") if s.strip()]
+    if not segments or not segments[0].startswith("MSH"):
+        raise ParseError("message must start with MSH")
+
+    msh = segments[0].split("|")
+    if len(msh) < 10:
+        raise ParseError("MSH too short")
+    # MSH-1 is the field separator itself, so MSH-n is msh[n - 1]
+    component = msh[1][:1] or "^"
+    message_type = msh[8].split(component)[0]
+    message = {"control_id": msh[9], "sender": (msh[2], msh[3]), "results": []}
+    if message_type != "ORU":
+        raise ParseError(f"unsupported message type {message_type or '?'}", message)
+
+    order_ref = None
+    for seg in segments[1:]:
+        fields = seg.split("|")
+        kind = fields[0]
+        if kind == "OBR":
+            placer = fields[2].split(component)[0] if len(fields) > 2 else ""
+            filler = fields[3].split(component)[0] if len(fields) > 3 else ""
+            ref = accession.normalize(placer or filler)
+            if not ref.isdigit():
+                raise ParseError(f"OBR: bad order number {ref!r}", message)
+            order_ref = ref
+        elif kind == "OBX":
+            fields += [""] * (12 - len(fields))
+            set_id, value_type, ident, value, status = fields[1], fields[2], fields[3], fields[5], fields[11]
+            if status in SKIP_STATUSES:
+                continue
+            if order_ref is None:
+                raise ParseError(f"OBX {set_id} before any OBR", message)
+            parts = ident.split(component)
+            is_accession = accession.is_valid(order_ref)
+            result = {"set_id": set_id,
+                      "order_id": None if is_accession else int(order_ref),
+                      "accession_no": order_ref if is_accession else None,
+                      "test_id": None, "test_name": None, "value": None, "text": None}
+            if parts[0].isdigit():
+                result["test_id"] = int(parts[0])
+            else:
+                result["test_name"] = (parts[1] if len(parts) > 1 and parts[1] else parts[0]).strip()
+                if not result["test_name"]:
+                    raise ParseError(f"OBX {set_id}: missing test identifier", message)
+            if value_type == "NM":
+                try:
+                    result["value"] = float(value)
+                except ValueError:
+                    raise ParseError(f"OBX {set_id}: non-numeric NM value {value!r}", message)
+                if not abs(result["value"]) < 1e8:
+                    raise ParseError(f"OBX {set_id}: value out of range", message)
+            else:
+                result["text"] = value[:255] or None
+            message["results"].append(result)
+    return message
+
+
+def build_ack(control_id: str, code: str, text: str = "",
+              sender=("", ""), message_id: str = "") -> bytes:
+    now = datetime.now().strftime("%Y%m%d%H%M%S")
+    msh = f"MSH|^~\\&|MEDLAB|LAB|{sender[0]}|{sender[1]}|{now}||ACK^R01|{message_id or control_id}|P|2.5"
+    msa = f"MSA|{code}|{control_id}" + (f"|{text[:200]}" if text else "")
+    return VT + (msh + "\r" + msa + "\r").encode() + FRAME_END
+
+
+def frame(message: str) -> bytes:
+    return VT + message.encode() + FRAME_END
+
+
+def unframe(data: bytes) -> bytes:
+    return data[:-len(FRAME_END)].lstrip(b"\r\n\t ").lstrip(VT)
+
+# ============================================================
+# APPLYING RESULTS
+# ============================================================
+
+
+class ResultWriter:
+    """Applies batches of parsed messages on one DB connection (runs in a thread)."""
+
+    def __init__(self, connect: Callable):
+        self._connect = connect
+        self._conn = None
+        self._names: Dict[str, int] = {}
+        self._names_loaded = 0.0
+
+    def _test_names(self, cur) -> Dict[str, int]:
+        if time.monotonic() - self._names_loaded > TEST_NAMES_TTL:
+            cur.execute("SELECT test_id, test_name FROM tests")
+            self._names = {name.strip().lower(): tid for tid, name in cur.fetchall()}
+            self._names_loaded = time.monotonic()
+        return self._names
+
+    def _accession_orders(self, cur, messages: List[dict]) -> Dict[str, int]:
+        accessions = sorted({
+            r["accession_no"] for m in messages for r in m["results"] if r["accession_no"]
+        })
+        if not accessions:
+            return {}
+        fmt = ",".join(["%s"] * len(accessions))
+        cur.execute(
+            f"SELECT accession_no, order_id FROM test_orders WHERE accession_no IN ({fmt})",
+            tuple(accessions),
+        )
+        return dict(cur.fetchall())
+
+    def apply(self, messages: List[dict]) -> List[List[str]]:
+        """Store the results of `messages`; returns the unmatched OBX set ids per message."""
+        if self._conn is None:
+            self._conn = self._connect()
+        conn = self._conn
+        try:
+            cur = conn.cursor()
+            names = self._test_names(cur)
+            orders = self._accession_orders(cur, messages)
+            items = []
+            for m in messages:
+                for r in m["results"]:
+                    if r["order_id"] is None:
+                        r["order_id"] = orders.get(r["accession_no"])
+                    if r["test_id"] is None:
+                        r["test_id"] = names.get(r["test_name"].lower())
+                    if r["order_id"] is not None and r["test_id"] is not None:
+                        items.append((r["order_id"], r["test_id"], r["value"], r["text"]))
+
+            matched = results.record_results(cur, items)
+
+            by_order: Dict[int, list] = {}
+            for m in messages:
+                for r in m["results"]:
+                    if (r["order_id"], r["test_id"]) in matched:
+                        by_order.setdefault(r["order_id"], []).append(
+                            {"test_id": r["test_id"], "value": r["value"], "text": r["text"]}
+                        )
+            if by_order:
+                ids = sorted(by_order)
+                fmt = ",".join(["%s"] * len(ids))
+                cur.execute(f"""
+                    UPDATE test_orders
+                    SET results_entered_at = COALESCE(results_entered_at, NOW())
+                    WHERE order_id IN ({fmt})
+                """, tuple(ids))
+                cur.executemany("""
+                    INSERT INTO activity_log(action, entity_type, entity_id, description)
+                    VALUES ('UPDATE_RESULTS', 'ORDER', %s, 'Results received from analyzer')
+                """, [(oid,) for oid in ids])
+                outbox.emit_many(cur, [
+                    ("order.results_entered", "order", oid,
+                     {"order_id": oid, "results": by_order[oid], "status": None, "source": "analyzer"})
+                    for oid in ids
+                ])
+            conn.commit()
+            cur.close()
+        except Exception:
+            try:
+                conn.rollback()
+                conn.close()
+            except Exception:
+                pass
+            self._conn = None
+            raise
+
+        return [
+            [r["set_id"] for r in m["results"] if (r["order_id"], r["test_id"]) not in matched]
+            for m in messages
+        ]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+# ============================================================
+# SERVER
+# ============================================================
+
+
+class IngestServer:
+    def __init__(self, apply: Callable[[List[dict]], List[List[str]]],
+                 batch_size: int = None, max_wait: float = None):
+        self._apply = apply
+        self.batch_size = batch_size or config.INGEST_BATCH_SIZE
+        self.max_wait = config.INGEST_BATCH_WAIT_MS / 1000.0 if max_wait is None else max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._server = None
+        self._writer_task = None
+        self._handlers: Set[asyncio.Task] = set()
+
+    async def start(self, host: str, port: int):
+        self._queue = asyncio.Queue(maxsize=self.batch_size * 4)
+        self._writer_task = asyncio.create_task(self._write_loop())
+        self._server = await asyncio.start_server(
+            self._handle, host, port, limit=MAX_FRAME_BYTES,
+        )
+        return self._server
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+        # Open connections and the writer would otherwise be cancelled by
+        # loop shutdown, mid-ack; finish them here so close() returns clean
+        tasks = list(self._handlers)
+        if self._writer_task is not None:
+            tasks.append(self._writer_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        acks: asyncio.Queue = asyncio.Queue()
+        ack_task = asyncio.create_task(self._ack_loop(acks, writer))
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            while True:
+                try:
+                    data = await reader.readuntil(FRAME_END)
+                except asyncio.IncompleteReadError:
+                    break
+                except asyncio.LimitOverrunError:
+                    logger.warning("analyzer frame too large, closing connection")
+                    break
+                fut = loop.create_future()
+                try:
+                    message = parse_message(unframe(data))
+                except ParseError as e:
+                    INGEST_RESULTS.inc("rejected")
+                    fut.set_result(build_ack(e.message["control_id"], "AR", str(e), e.message["sender"]))
+                    await acks.put(fut)
+                    continue
+                await acks.put(fut)
+                # Backpressure: blocks this connection while the writer is behind
+                await self._queue.put((message, fut))
+        except asyncio.CancelledError:
+            # Server shutdown: queued acks will never be answered. Not
+            # re-raised, start_server's done callback logs cancelled handlers
+            ack_task.cancel()
+        finally:
+            self._handlers.discard(task)
+            await acks.put(None)
+            await asyncio.gather(ack_task, return_exceptions=True)
+            writer.close()
+
+    async def _ack_loop(self, acks: asyncio.Queue, writer: asyncio.StreamWriter):
+        while True:
+            fut = await acks.get()
+            if fut is None:
+                return
+            try:
+                writer.write(await fut)
+                await writer.drain()
+            except (ConnectionError, asyncio.CancelledError):
+                return
+
+    async def _write_loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            count = len(batch[0][0]["results"])
+            deadline = time.monotonic() + self.max_wait
+            while count < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get_nowait() if timeout <= 0 else \
+                        await asyncio.wait_for(self._queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                batch.append(item)
+                count += len(item[0]["results"])
+
+            messages = [m for m, _ in batch]
+            t0 = time.perf_counter()
+            try:
+                unmatched = await asyncio.to_thread(self._apply, messages)
+                error = None
+            except Exception as e:
+                logger.warning("analyzer batch failed: %s", e)
+                unmatched, error = None, str(e)
+            INGEST_BATCH_SECONDS.observe(time.perf_counter() - t0)
+
+            for i, (message, fut) in enumerate(batch):
+                n = len(message["results"])
+                if error is not None:
+                    INGEST_RESULTS.inc("rejected", amount=n)
+                    ack = build_ack(message["control_id"], "AE", f"not stored: {error}", message["sender"])
+                elif unmatched[i]:
+                    INGEST_RESULTS.inc("applied", amount=n - len(unmatched[i]))
+                    INGEST_RESULTS.inc("unmatched", amount=len(unmatched[i]))
+                    ack = build_ack(message["control_id"], "AE",
+                                    "no matching order line for OBX " + ",".join(unmatched[i]),
+                                    message["sender"])
+                else:
+                    INGEST_RESULTS.inc("applied", amount=n)
+                    ack = build_ack(message["control_id"], "AA", "", message["sender"])
+                if not fut.done():
+                    fut.set_result(ack)
+
+# ============================================================
+# SIMULATED ANALYZER
+# ============================================================
+
+
+def build_oru(control_id: str, order_id: int, tests: List[tuple]) -> str:
+    """ORU^R01 for one order; `tests` are (test_id, name, value, unit)."""
+    now = datetime.now().strftime("%Y%m%d%H%M%S")
+    segments = [
+        f"MSH|^~\\&|SIMULATOR|LAB|MEDLAB|LAB|{now}||ORU^R01|{control_id}|P|2.5",
+        f"OBR|1|{order_id}||PANEL",
+    ]
+    for i, (test_id, name, value, unit) in enumerate(tests, 1):
+        segments.append(f"OBX|{i}|NM|{test_id}^{name}||{value}|{unit or ''}|||||F")
+    return "\r".join(segments) + "\r"
+
+
+async def simulate(host: str, port: int, orders: Dict[int, List[tuple]],
+                   connections: int, pipeline: int) -> dict:
+    """Send one ORU per order over `connections` sockets, `pipeline` unacked at a time each."""
+    items = list(orders.items())
+    shards = [items[i::connections] for i in range(connections)]
+    stats = {"AA": 0, "AE": 0, "AR": 0, "results": sum(len(t) for t in orders.values())}
+
+    async def client(shard):
+        reader, writer = await asyncio.open_connection(host, port)
+        window = asyncio.Semaphore(pipeline)
+
+        async def send():
+            for n, (order_id, tests) in enumerate(shard):
+                await window.acquire()
+                writer.write(frame(build_oru(f"SIM{order_id}-{n}", order_id, tests)))
+                await writer.drain()
+
+        sender = asyncio.create_task(send())
+        for _ in shard:
+            ack = (await reader.readuntil(FRAME_END)).decode()
+            code = ack.split("MSA|", 1)[1][:2]
+            stats[code] = stats.get(code, 0) + 1
+            window.release()
+        await sender
+        writer.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client(s) for s in shards if s))
+    stats["seconds"] = round(time.perf_counter() - t0, 3)
+    stats["results_per_second"] = round(stats["results"] / max(stats["seconds"], 1e-9))
+    return stats
+
+
+def _pending_lines(limit: int) -> Dict[int, List[tuple]]:
+    from .db import get_db_connection
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT tot.order_id, tot.test_id, t.test_name, t.normal_min, t.normal_max, tot.unit
+        FROM test_order_tests tot
+        JOIN tests t ON t.test_id = tot.test_id
+        WHERE tot.order_id IN (
+            SELECT order_id FROM (
+                SELECT DISTINCT order_id FROM test_order_tests
+                WHERE result_value IS NULL AND result_text IS NULL
+                ORDER BY order_id DESC LIMIT %s
+            ) recent
+        )
+    """, (limit,))
+    orders: Dict[int, List[tuple]] = {}
+    for order_id, test_id, name, lo, hi, unit in cur.fetchall():
+        lo, hi = float(lo if lo is not None else 1), float(hi if hi is not None else 10)
+        value = round(random.uniform(lo * 0.8, hi * 1.2), 2)
+        orders.setdefault(order_id, []).append((test_id, name, value, unit))
+    conn.close()
+    return orders
+
+# ============================================================
+# CLI
+# ============================================================
+
+
+async def serve(host: str, port: int):
+    from .db import get_db_connection
+
+    writer = ResultWriter(get_db_connection)
+    server = IngestServer(writer.apply)
+    await server.start(host, port)
+    print(f"Analyzer listener on {host}:{port} (batch {server.batch_size} results)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+        writer.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Analyzer result ingestion")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    srv = sub.add_parser("serve", help="run the TCP listener")
+    srv.add_argument("--host", default=config.INGEST_HOST)
+    srv.add_argument("--port", type=int, default=config.INGEST_PORT)
+    sim = sub.add_parser("simulate", help="send results for pending order lines")
+    sim.add_argument("--host", default="127.0.0.1")
+    sim.add_argument("--port", type=int, default=config.INGEST_PORT)
+    sim.add_argument("--orders", type=int, default=1000)
+    sim.add_argument("--connections", type=int, default=4)
+    sim.add_argument("--pipeline", type=int, default=32, help="unacknowledged messages per connection")
+    args = ap.parse_args()
+
+    if args.cmd == "serve":
+        try:
+            asyncio.run(serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    orders = _pending_lines(args.orders)
+    if not orders:
+        ap.error("no order lines without results")
+    stats = asyncio.run(simulate(args.host, args.port, orders, args.connections, args.pipeline))
+    print(f"✓ {len(orders)} messages, {stats['results']} results in {stats['seconds']}s "
+          f"({stats['results_per_second']}/s): {stats['AA']} AA, {stats['AE']} AE, {stats['AR']} AR")
+
+
+if __name__ == "__main__":
+    main()
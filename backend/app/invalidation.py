@@ -0,0 +1,124 @@
+"""
+Cross-worker cache invalidation without an external broker.
+
+Writers call bump(cur, entity, ...) inside their transaction; this
+increments a per-entity counter in `cache_versions` and clears the local
+caches straight away. Every worker runs a VersionPoller thread that reads
+the (tiny, primary-key ordered) table every INVALIDATION_POLL_MS on an
+autocommit connection and drops caches whose entity version moved, so a
+write in any worker is visible everywhere within one poll interval.
+
+If the poll fails, or on the first successful poll, all caches are dropped:
+a worker that cannot see the version table never serves stale data for
+longer than the poll interval.
+"""
+import logging
+import threading
+from typing import Callable, Optional
+
+from . import config
+from .cache import invalidate_all, invalidate_entities
+
+logger = logging.getLogger("medlab.invalidation")
+
+# Entities tracked in cache_versions
+CATALOGUE = "catalogue"          # tests, categories, reference ranges
+SETTINGS = "settings"
+DOCTORS = "doctors"
+PATIENTS = "patients"          # demographics behind cached statistics (merges)
+
+CACHE_VERSIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS cache_versions (
+        entity VARCHAR(64) PRIMARY KEY,
+        version BIGINT UNSIGNED NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)
+            ON UPDATE CURRENT_TIMESTAMP(6)
+    )
+"""
+
+
+def bump(cur, *entities: str):
+    """
+    Increment the version of each entity as part of the caller's transaction
+    and clear this worker's dependent caches.
+    """
+    if not entities:
+        return
+    values = ",".join(["(%s, 1)"] * len(entities))
+    cur.execute(f"""
+        INSERT INTO cache_versions (entity, version)
+        VALUES {values}
+        ON DUPLICATE KEY UPDATE version = version + 1
+    """, tuple(entities))
+    invalidate_entities(entities)
+
+
+class VersionPoller:
+    def __init__(self, connect: Callable, interval: float):
+        self._connect = connect
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._seen: Optional[dict] = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="medlab-cache-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval * 2)
+
+    def poll_once(self, conn):
+        cur = conn.cursor()
+        cur.execute("SELECT entity, version FROM cache_versions")
+        versions = dict(cur.fetchall())
+        cur.close()
+
+        if self._seen is None:
+            invalidate_all()
+        else:
+            changed = {e for e, v in versions.items() if self._seen.get(e) != v}
+            if changed:
+                invalidate_entities(changed)
+        self._seen = versions
+
+    def _run(self):
+        conn = None
+        while not self._stop.wait(self.interval):
+            try:
+                if conn is None:
+                    conn = self._connect()
+                    conn.autocommit = True  # fresh snapshot on every poll
+                self.poll_once(conn)
+            except Exception as e:
+                logger.warning("cache version poll failed: %s", e)
+                invalidate_all()
+                self._seen = None
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+        if conn is not None:
+            conn.close()
+
+
+_poller: Optional[VersionPoller] = None
+
+
+def start_poller(connect: Callable):
+    global _poller
+    if _poller is None:
+        _poller = VersionPoller(connect, config.INVALIDATION_POLL_MS / 1000.0)
+    _poller.start()
+
+
+def stop_poller():
+    if _poller is not None:
+        _poller.stop()
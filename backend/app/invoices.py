@@ -0,0 +1,142 @@
+"""
+Invoices built from the per-line price snapshot on test_order_tests.
+
+create_order() copies tests.test_name and tests.price onto each order line,
+so an invoice never changes when the catalogue is repriced and needs no
+join back to `tests`: one primary-key read for the order header plus one
+index range read on test_order_tests(order_id) for the lines. A day's
+batch uses the same two-query shape over all of that day's orders.
+
+Lines created before the snapshot columns existed are backfilled in
+primary-key chunks:
+
+    cd backend
+    python -m app.invoices backfill
+"""
+import argparse
+import time
+from datetime import date, timedelta
+from typing import Dict, List
+
+_HEADER_SQL = """
+    SELECT
+        o.order_id, o.order_date, o.priority, o.total_amount, o.notes,
+        p.patient_id, p.full_name AS patient_name, p.phone AS patient_phone,
+        p.address AS patient_address,
+        d.full_name AS doctor_name
+    FROM test_orders o
+    JOIN patients p ON p.patient_id = o.patient_id
+    LEFT JOIN doctors d ON d.doctor_id = o.doctor_id
+"""
+
+_LINES_SQL = """
+    SELECT order_id, test_id, test_name, price, panel_test_id
+    FROM test_order_tests
+"""
+
+
+def backfill_line_snapshots(conn, batch_size: int = 5000) -> int:
+    """
+    Copy current test name/price onto lines missing a snapshot, one
+    primary-key range per transaction. Returns the number of lines updated.
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0)
+        FROM test_order_tests WHERE price IS NULL
+    """)
+    lo, hi = cur.fetchone()
+    updated = 0
+    start = lo
+    while start <= hi and hi:
+        cur.execute("""
+            UPDATE test_order_tests tot
+            JOIN tests t ON t.test_id = tot.test_id
+            SET tot.test_name = t.test_name, tot.price = t.price
+            WHERE tot.id BETWEEN %s AND %s AND tot.price IS NULL
+        """, (start, start + batch_size - 1))
+        updated += cur.rowcount
+        conn.commit()
+        start += batch_size
+    cur.close()
+    return updated
+
+
+def _as_invoice(header: dict, lines: List[dict]) -> dict:
+    subtotal = sum(l["price"] or 0 for l in lines)
+    return {
+        "order_id": header["order_id"],
+        "order_date": header["order_date"],
+        "priority": header["priority"],
+        "patient": {
+            "patient_id": header["patient_id"],
+            "full_name": header["patient_name"],
+            "phone": header["patient_phone"],
+            "address": header["patient_address"],
+        },
+        "doctor_name": header["doctor_name"],
+        "notes": header["notes"],
+        "lines": [
+            {
+                "test_id": l["test_id"],
+                "test_name": l["test_name"],
+                "price": l["price"],
+                "panel_test_id": l["panel_test_id"],
+            }
+            for l in lines
+        ],
+        "subtotal": subtotal,
+        "total_amount": header["total_amount"],
+    }
+
+
+def _fetch(cur, sql, params) -> List[dict]:
+    cur.execute(sql, params)
+    cols = [c[0] for c in cur.description]
+    return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+def get_invoice(cur, order_id: int):
+    headers = _fetch(cur, _HEADER_SQL + " WHERE o.order_id = %s", (order_id,))
+    if not headers:
+        return None
+    lines = _fetch(cur, _LINES_SQL + " WHERE order_id = %s ORDER BY id", (order_id,))
+    return _as_invoice(headers[0], lines)
+
+
+def get_invoices_for_day(cur, day: date) -> List[dict]:
+    """All invoices for orders placed on `day`, in two queries."""
+    headers = _fetch(
+        cur,
+        _HEADER_SQL + " WHERE o.order_date >= %s AND o.order_date < %s ORDER BY o.order_id",
+        (day, day + timedelta(days=1)),
+    )
+    if not headers:
+        return []
+
+    ids = [h["order_id"] for h in headers]
+    placeholders = ",".join(["%s"] * len(ids))
+    by_order: Dict[int, List[dict]] = {}
+    for line in _fetch(cur, _LINES_SQL + f" WHERE order_id IN ({placeholders}) ORDER BY id", tuple(ids)):
+        by_order.setdefault(line["order_id"], []).append(line)
+
+    return [_as_invoice(h, by_order.get(h["order_id"], [])) for h in headers]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Order line price snapshot maintenance")
+    ap.add_argument("command", choices=["backfill"])
+    ap.add_argument("--batch-size", type=int, default=5000)
+    args = ap.parse_args()
+
+    from .db import get_db_connection
+
+    conn = get_db_connection()
+    t0 = time.perf_counter()
+    n = backfill_line_snapshots(conn, args.batch_size)
+    conn.close()
+    print(f"✓ Backfilled {n} order lines in {time.perf_counter() - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,32 @@
 import os
+import threading
+import time
 from datetime import datetime, timedelta, date
 from typing import Optional, Dict, List
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, Response
 from pydantic import BaseModel
-import mysql.connector
+import anyio
 from dotenv import load_dotenv
 
+from . import (
+    accession, admission, archive, changes, config, dedup, eod, idempotency, invalidation, invoices, merge, metrics,
+    outbox, panels, qc, reports, results, revenue, routing, storage, tat, tracing,
+)
+from .cache import LocalCache
+from .compression import CompressionMiddleware, no_compression
+from .singleflight import SingleFlightMiddleware
+from .serialization import FastJSONResponse, fetch_dicts, sql_case
+
 load_dotenv()
 
 # ============================================================
 # CONFIGURATION
 # ============================================================
 
-DB_HOST = os.getenv("DB_HOST", "localhost")
-DB_PORT = int(os.getenv("DB_PORT", "3306"))
-DB_USER = os.getenv("DB_USER", "root")
-DB_PASSWORD = os.getenv("DB_PASSWORD", "")
-DB_NAME = os.getenv("DB_NAME", "medlab_db")
-
-app = FastAPI(title="MedLAB+ Backend")
+app = FastAPI(title="MedLAB+ Backend", default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,34 +34,32 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Consistency-Token"],
 )
 
+replica_router = routing.ReplicaRouter.from_config()
+
+app.add_middleware(routing.ConsistencyMiddleware, router=replica_router)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(tracing.QueryTraceMiddleware)
+
+admission_gates = admission.build_gates()
+app.add_middleware(admission.AdmissionMiddleware, gates=admission_gates)
+app.add_middleware(SingleFlightMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
 # ============================================================
 # RAW DB CONNECTION
 # ============================================================
 def get_raw_connection(include_db: bool = True):
-    cfg = {
-        "host": DB_HOST,
-        "port": DB_PORT,
-        "user": DB_USER,
-        "password": DB_PASSWORD,
-        "autocommit": False,
-    }
-    if include_db:
-        cfg["database"] = DB_NAME
-    return mysql.connector.connect(**cfg)
+    return storage.get_engine().connect(include_db)
 
 # ============================================================
 # INITIALIZE DATABASE & TABLES
 # ============================================================
 def init_database_and_tables():
     # Create DB if not exists
-    conn = get_raw_connection(include_db=False)
-    c = conn.cursor()
-    c.execute(f"CREATE DATABASE IF NOT EXISTS `{DB_NAME}`")
-    conn.commit()
-    c.close()
-    conn.close()
+    storage.get_engine().create_database()
 
     # Connect to DB
     conn = get_raw_connection(include_db=True)
@@ -71,7 +75,10 @@ def init_database_and_tables():
             phone VARCHAR(32) NULL,
             email VARCHAR(255) NULL,
             address VARCHAR(255) NULL,
-            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            merged_into INT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)
+                ON UPDATE CURRENT_TIMESTAMP(6)
         )
     """)
 
@@ -91,10 +98,18 @@ def init_database_and_tables():
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS test_categories (
             category_id INT AUTO_INCREMENT PRIMARY KEY,
-            category_name VARCHAR(255) NOT NULL
+            category_name VARCHAR(255) NOT NULL,
+            description VARCHAR(255) NULL
         )
     """)
 
+    # Category descriptions (as in the app/db.py schema the mock data targets)
+    try:
+        cursor.execute("ALTER TABLE test_categories ADD COLUMN description VARCHAR(255) NULL")
+    except storage.Error as e:
+        if e.errno != 1060:
+            raise
+
     # Tests
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS tests (
@@ -132,7 +147,7 @@ def init_database_and_tables():
         cursor.execute("""
             CREATE INDEX idx_trr ON test_reference_ranges (test_id, gender, age_min, age_max)
         """)
-    except mysql.connector.Error as e:
+    except storage.Error as e:
         if e.errno != 1061:
             raise
 
@@ -148,6 +163,11 @@ def init_database_and_tables():
                 NOT NULL DEFAULT 'PENDING',
             total_amount DECIMAL(10,2) NOT NULL DEFAULT 0,
             notes TEXT NULL,
+            sample_collected_at DATETIME NULL,
+            results_entered_at DATETIME NULL,
+            report_ready_at DATETIME NULL,
+            updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)
+                ON UPDATE CURRENT_TIMESTAMP(6),
             FOREIGN KEY (patient_id) REFERENCES patients(patient_id),
             FOREIGN KEY (doctor_id) REFERENCES doctors(doctor_id) ON DELETE SET NULL
         )
@@ -162,13 +182,87 @@ def init_database_and_tables():
             unit VARCHAR(32) NULL,
             normal_range_text VARCHAR(255) NULL,
             result_value DECIMAL(10,2) NULL,
+            result_text VARCHAR(255) NULL,
             result_flag ENUM('LOW','NORMAL','HIGH') NULL,
             result_entered_at DATETIME NULL,
+            test_name VARCHAR(255) NULL,
+            price DECIMAL(10,2) NULL,
+            panel_test_id INT NULL,
+            updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)
+                ON UPDATE CURRENT_TIMESTAMP(6),
             FOREIGN KEY (order_id) REFERENCES test_orders(order_id) ON DELETE CASCADE,
             FOREIGN KEY (test_id) REFERENCES tests(test_id)
         )
     """)
 
+    # Price/name snapshot per order line (tables created before it existed)
+    for column in ("test_name VARCHAR(255) NULL", "price DECIMAL(10,2) NULL"):
+        try:
+            cursor.execute(f"ALTER TABLE test_order_tests ADD COLUMN {column}")
+        except storage.Error as e:
+            if e.errno != 1060:
+                raise
+
+    # Component lines remember the panel they were expanded from
+    try:
+        cursor.execute("ALTER TABLE test_order_tests ADD COLUMN panel_test_id INT NULL")
+    except storage.Error as e:
+        if e.errno != 1060:
+            raise
+
+    # Qualitative results next to the numeric value
+    try:
+        cursor.execute("ALTER TABLE test_order_tests ADD COLUMN result_text VARCHAR(255) NULL")
+    except storage.Error as e:
+        if e.errno != 1060:
+            raise
+    results.migrate_result_columns(cursor)
+
+    for ddl in (results.RESULT_INDEX_DDL, qc.QC_INDEX_DDL):
+        try:
+            cursor.execute(ddl)
+        except storage.Error as e:
+            if e.errno != 1061:
+                raise
+
+    # Status transition timestamps for turnaround time
+    for column in tat.TAT_COLUMNS:
+        try:
+            cursor.execute(f"ALTER TABLE test_orders ADD COLUMN {column}")
+        except storage.Error as e:
+            if e.errno != 1060:
+                raise
+
+    try:
+        cursor.execute(tat.TAT_INDEX_DDL)
+    except storage.Error as e:
+        if e.errno != 1061:
+            raise
+
+    # Panel membership
+    cursor.execute(panels.PANEL_MEMBERS_DDL)
+
+    try:
+        cursor.execute("CREATE INDEX idx_orders_date ON test_orders (order_date)")
+    except storage.Error as e:
+        if e.errno != 1061:
+            raise
+
+    # Row change times for the change feed
+    for table in changes.TABLES:
+        try:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {changes.UPDATED_AT_COLUMN}")
+        except storage.Error as e:
+            if e.errno != 1060:
+                raise
+
+    for ddl in changes.index_ddl():
+        try:
+            cursor.execute(ddl)
+        except storage.Error as e:
+            if e.errno != 1061:
+                raise
+
     # Activity Log
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS activity_log (
@@ -189,14 +283,92 @@ def init_database_and_tables():
         )
     """)
 
+    # Cache versions (cross-worker invalidation)
+    cursor.execute(invalidation.CACHE_VERSIONS_DDL)
+
+    # Idempotency keys for retried writes
+    cursor.execute(idempotency.IDEMPOTENCY_KEYS_DDL)
+
+    # Events for integrations, written with the change they describe
+    cursor.execute(outbox.OUTBOX_DDL)
+
+    # Cold archive of old completed orders
+    cursor.execute(archive.ARCHIVE_DDL)
+
+    # Duplicate patient detection
+    cursor.execute(dedup.KEYS_DDL)
+    cursor.execute(dedup.CANDIDATES_DDL)
+
+    # Merged duplicates point at the record they were merged into
+    try:
+        cursor.execute(f"ALTER TABLE patients ADD COLUMN {merge.MERGED_INTO_COLUMN}")
+    except storage.Error as e:
+        if e.errno != 1060:
+            raise
+
+    # Accession numbers: per-branch/day sequences, lookup by barcode
+    cursor.execute(accession.SEQUENCES_DDL)
+    for table in ("test_orders", "archived_orders"):
+        try:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {accession.ACCESSION_COLUMN}")
+        except storage.Error as e:
+            if e.errno != 1060:
+                raise
+    for ddl in (accession.ACCESSION_INDEX_DDL, archive.ARCHIVE_ACCESSION_INDEX_DDL):
+        try:
+            cursor.execute(ddl)
+        except storage.Error as e:
+            if e.errno != 1061:
+                raise
+
+    # Revenue aggregates
+    for ddl in revenue.REVENUE_DDL:
+        cursor.execute(ddl)
+
     conn.commit()
     cursor.close()
+
+    # Lines written without a snapshot (older rows, or inserts that skip
+    # the columns); a no-op range query once everything is filled in
+    invoices.backfill_line_snapshots(conn)
+    # Patients without blocking keys (created before dedup, or bulk-loaded)
+    # are invisible to possible_duplicates() until indexed
+    dedup.index_missing(conn)
+
     conn.close()
 
 
+_tables_ready = False
+
+
+def _ensure_tables():
+    global _tables_ready
+    if not _tables_ready:
+        init_database_and_tables()
+        _tables_ready = True
+
+
 def get_db_connection():
-    init_database_and_tables()
-    return get_raw_connection(include_db=True)
+    t0 = time.perf_counter()
+    _ensure_tables()
+    conn = get_raw_connection(include_db=True)
+    metrics.observe_connection_acquire(time.perf_counter() - t0)
+    return metrics.InstrumentedConnection(conn, cursor_class=tracing.TracedCursor)
+
+
+def get_read_connection():
+    """
+    Connection for read-only endpoints. Routed to a healthy replica when
+    REPLICA_DSNS is configured and the client's consistency token allows it.
+    """
+    t0 = time.perf_counter()
+    _ensure_tables()
+    conn = replica_router.connect_for_read(lambda: get_raw_connection(include_db=True))
+    metrics.observe_connection_acquire(time.perf_counter() - t0)
+    return metrics.InstrumentedConnection(conn, cursor_class=tracing.TracedCursor)
+
+
+tracing.configure(lambda: get_raw_connection(include_db=True))
 
 # ============================================================
 # Pydantic Models
@@ -213,6 +385,10 @@ class PatientCreate(BaseModel):
 class PatientUpdate(PatientCreate):
     pass
 
+class PatientMergePayload(BaseModel):
+    duplicateId: int
+    dryRun: bool = False
+
 class TestCreate(BaseModel):
     testName: str
     sampleType: Optional[str] = None
@@ -221,6 +397,9 @@ class TestCreate(BaseModel):
     normalMax: Optional[float] = None
     price: float
 
+class PanelComponentsUpdate(BaseModel):
+    componentIds: List[int]
+
 class DoctorCreate(BaseModel):
     fullName: str
     specialization: Optional[str] = None
@@ -233,6 +412,7 @@ class CreateOrderPayload(BaseModel):
     priority: str
     notes: Optional[str] = None
     testIds: List[int]
+    branch: Optional[str] = None
 
 class OrderUpdate(BaseModel):
     priority: Optional[str] = None
@@ -242,6 +422,7 @@ class OrderUpdate(BaseModel):
 class TestResultItem(BaseModel):
     testId: int
     value: Optional[float] = None
+    text: Optional[str] = None
 
 class UpdateResultsPayload(BaseModel):
     results: List[TestResultItem]
@@ -269,28 +450,49 @@ def map_gender_to_db(g):
 def map_priority_to_db(p):
     return "URGENT" if p.lower() == "urgent" else "NORMAL"
 
+PRIORITY_FROM_DB = {"URGENT": "urgent", "NORMAL": "normal"}
+STATUS_FROM_DB = {
+    "PENDING": "pending",
+    "SAMPLE_COLLECTED": "in-progress",
+    "RESULTS_ENTERED": "in-progress",
+    "REPORT_READY": "completed",
+}
+
 def map_priority_from_db(p):
-    return "urgent" if p == "URGENT" else "normal"
+    return PRIORITY_FROM_DB.get(p, "normal")
 
 def map_status_to_db(s):
     s = s.lower()
     if s == "pending": return "PENDING"
+    if s in ("collected", "sample-collected"): return "SAMPLE_COLLECTED"
     if s == "in-progress": return "RESULTS_ENTERED"
     return "REPORT_READY"
 
 def map_status_from_db(s):
-    if s == "PENDING": return "pending"
-    if s in ("SAMPLE_COLLECTED", "RESULTS_ENTERED"):
-        return "in-progress"
-    return "completed"
+    return STATUS_FROM_DB.get(s, "completed")
+
+# Same mappings evaluated inside MySQL for list queries
+def priority_from_db_sql(col):
+    return sql_case(col, PRIORITY_FROM_DB, "normal")
+
+def status_from_db_sql(col):
+    return sql_case(col, STATUS_FROM_DB, "completed")
 
 # ============================================================
 # HEALTH CHECK
 # ============================================================
 @app.get("/api/health")
+@no_compression
 def health():
     return {"status": "ok", "time": datetime.utcnow().isoformat()}
 
+# ============================================================
+# METRICS (Prometheus text format)
+# ============================================================
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return Response(metrics.render_metrics(), media_type=metrics.CONTENT_TYPE)
+
 # ============================================================
 # PATIENTS
 # ============================================================
@@ -299,12 +501,12 @@ def health():
 def list_patients():
     try:
         conn = get_db_connection()
-        cur = conn.cursor(dictionary=True)
-        cur.execute("SELECT * FROM patients ORDER BY created_at DESC")
-        rows = cur.fetchall()
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM patients WHERE merged_into IS NULL ORDER BY created_at DESC")
+        rows = fetch_dicts(cur)
         cur.close()
         conn.close()
-        return rows
+        return FastJSONResponse(rows)
     except Exception as e:
         raise HTTPException(500, str(e))
 
@@ -312,115 +514,268 @@ def list_patients():
 def create_patient(payload: PatientCreate):
     try:
         conn = get_db_connection()
-        cur = conn.cursor(dictionary=True)
+        try:
+            cur = conn.cursor(dictionary=True)
 
-        g = map_gender_to_db(payload.gender)
+            g = map_gender_to_db(payload.gender)
 
-        cur.execute("""
-            INSERT INTO patients (full_name,date_of_birth,gender,phone,email,address)
-            VALUES (%s,%s,%s,%s,%s,%s)
-        """, (
-            payload.fullName, payload.dateOfBirth, g,
-            payload.phone, payload.email, payload.address
-        ))
-        pid = cur.lastrowid
-
-        # Log
-        cur.execute("""
-            INSERT INTO activity_log(action,entity_type,entity_id,description)
-            VALUES ('CREATE_PATIENT','PATIENT',%s,'New patient created')
-        """, (pid,))
+            # Registration check: one lookup on the blocking-key index
+            kcur = conn.cursor()
+            duplicates = dedup.possible_duplicates(
+                kcur, payload.fullName, payload.dateOfBirth, payload.phone, payload.email, g,
+            )
 
-        conn.commit()
+            cur.execute("""
+                INSERT INTO patients (full_name,date_of_birth,gender,phone,email,address)
+                VALUES (%s,%s,%s,%s,%s,%s)
+            """, (
+                payload.fullName, payload.dateOfBirth, g,
+                payload.phone, payload.email, payload.address
+            ))
+            pid = cur.lastrowid
+            dedup.index_patient(kcur, pid, payload.fullName, payload.dateOfBirth, payload.phone, payload.email)
+            kcur.close()
+
+            # Log
+            cur.execute("""
+                INSERT INTO activity_log(action,entity_type,entity_id,description)
+                VALUES ('CREATE_PATIENT','PATIENT',%s,'New patient created')
+            """, (pid,))
+
+            outbox.emit(cur, "patient.created", "patient", pid, {
+                "patient_id": pid, "full_name": payload.fullName,
+                "date_of_birth": payload.dateOfBirth, "gender": g,
+                "phone": payload.phone, "email": payload.email, "address": payload.address,
+            })
+
+            conn.commit()
+            outbox.notify()
+
+            cur.execute("SELECT * FROM patients WHERE patient_id=%s", (pid,))
+            row = cur.fetchone()
+            row["possible_duplicates"] = duplicates
+
+            cur.close()
+            return row
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
 
-        cur.execute("SELECT * FROM patients WHERE patient_id=%s", (pid,))
-        row = cur.fetchone()
+    except Exception as e:
+        raise HTTPException(400, str(e))
 
+@app.get("/api/patients/possible-duplicates")
+def check_patient_duplicates(
+    fullName: str,
+    dateOfBirth: Optional[str] = None,
+    phone: Optional[str] = None,
+    email: Optional[str] = None,
+    gender: Optional[str] = None,
+):
+    """Existing patients matching registration details, best match first."""
+    try:
+        conn = get_read_connection()
+        cur = conn.cursor()
+        rows = dedup.possible_duplicates(
+            cur, fullName, dateOfBirth, phone, email, map_gender_to_db(gender),
+        )
         cur.close()
         conn.close()
-        return row
+    except Exception as e:
+        raise HTTPException(500, str(e))
+    return FastJSONResponse(rows)
+
 
+@app.get("/api/patients/merge-candidates")
+def list_merge_candidates(minScore: float = 0.0, limit: int = 100):
+    """Duplicate pairs proposed by `python -m app.dedup scan`, best first."""
+    try:
+        conn = get_read_connection()
+        cur = conn.cursor()
+        rows = dedup.list_candidates(cur, minScore, max(1, min(limit, 1000)))
+        cur.close()
+        conn.close()
     except Exception as e:
-        raise HTTPException(400, str(e))
+        raise HTTPException(500, str(e))
+    return FastJSONResponse(rows)
+
+
+@app.post("/api/patients/{patient_id}/merge")
+def merge_patient(patient_id: int, payload: PatientMergePayload):
+    """
+    Merge payload.duplicateId into this patient: orders (hot and archived)
+    are re-pointed in chunks, one activity log entry summarizes the merge.
+    With dryRun only the counts are returned.
+    """
+    try:
+        conn = get_db_connection()
+        try:
+            result = merge.merge_patients(conn, patient_id, payload.duplicateId, payload.dryRun)
+        finally:
+            conn.close()
+    except LookupError as e:
+        raise HTTPException(404, str(e))
+    except merge.MergeConflict as e:
+        raise HTTPException(409, str(e))
+    except Exception as e:
+        raise HTTPException(500, str(e))
+    return result
+
+
+@app.get("/api/patients/{patient_id}/orders")
+def patient_orders(patient_id: int):
+    """A patient's order history, including archived orders."""
+    try:
+        conn = get_read_connection()
+        cur = conn.cursor()
+        rows = archive.patient_history(cur, patient_id)
+        cur.close()
+        conn.close()
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+    for r in rows:
+        r["priority"] = map_priority_from_db(r["priority"])
+        r["status"] = map_status_from_db(r["status"])
+    return FastJSONResponse(rows)
 
 # ============================================================
 # TESTS
 # ============================================================
 
+catalogue_cache = LocalCache("catalogue", [invalidation.CATALOGUE])
+
+
+def _range_text(r, default_unit):
+    if r["normal_min"] is None or r["normal_max"] is None:
+        return None
+    unit = r["unit"] or default_unit or ""
+    mn = ("%g" % float(r["normal_min"]))
+    mx = ("%g" % float(r["normal_max"]))
+    return f"{mn} - {mx}{(' ' + unit) if unit else ''}"
+
+
+def load_test_catalogue():
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    cur.execute("""
+        SELECT t.test_id,t.test_name,t.sample_type,t.unit,t.price,c.category_name
+        FROM tests t
+        LEFT JOIN test_categories c ON t.category_id=c.category_id
+        WHERE t.is_active=1
+        ORDER BY t.test_name
+    """)
+    tests = fetch_dicts(cur)
+
+    # All reference ranges in one pass instead of one query per test
+    cur.execute("""
+        SELECT test_id,gender,normal_min,normal_max,unit
+        FROM test_reference_ranges
+    """)
+    ranges = {}
+    for r in fetch_dicts(cur):
+        ranges.setdefault(r["test_id"], []).append(r)
+
+    gender_key = {"ANY": "any_range_text", "M": "male_range_text", "F": "female_range_text"}
+    components = panels.load_components(cur)
+
+    # Attach ANY / MALE / FEMALE ranges
+    for t in tests:
+        t["any_range_text"] = None
+        t["male_range_text"] = None
+        t["female_range_text"] = None
+
+        for r in ranges.get(t["test_id"], ()):
+            txt = _range_text(r, t["unit"])
+            if txt and r["gender"] in gender_key:
+                t[gender_key[r["gender"]]] = txt
+
+        t["components"] = components.get(t["test_id"], [])
+        t["is_panel"] = bool(t["components"])
+
+    cur.close()
+    conn.close()
+    return tests
+
+
 @app.get("/api/tests")
 def list_tests():
     """
-    Returns tests with ANY/M/F reference ranges combined.
+    Returns tests with ANY/M/F reference ranges combined; panels carry
+    their component tests.
+    """
+    try:
+        return FastJSONResponse(catalogue_cache.get_or_load("active", load_test_catalogue))
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+
+@app.put("/api/tests/{test_id}/components")
+def update_panel_components(test_id: int, payload: PanelComponentsUpdate):
+    """
+    Replace the component tests of a panel; an empty list turns the panel
+    back into a single test.
     """
     try:
         conn = get_db_connection()
-        cur = conn.cursor(dictionary=True)
+        try:
+            cur = conn.cursor()
 
-        cur.execute("""
-            SELECT t.test_id,t.test_name,t.sample_type,t.unit,t.price,c.category_name
-            FROM tests t
-            LEFT JOIN test_categories c ON t.category_id=c.category_id
-            WHERE t.is_active=1
-            ORDER BY t.test_name
-        """)
-        tests = cur.fetchall()
+            cur.execute("SELECT test_name FROM tests WHERE test_id=%s", (test_id,))
+            row = cur.fetchone()
+            if row is None:
+                raise HTTPException(404, "Test not found")
 
-        cur2 = conn.cursor(dictionary=True)
+            try:
+                panels.set_components(cur, test_id, payload.componentIds)
+            except ValueError as e:
+                raise HTTPException(400, str(e))
 
-        def build_text(r, default_unit):
-            if r["normal_min"] is None or r["normal_max"] is None:
-                return None
-            unit = r["unit"] or default_unit or ""
-            mn = ("%g" % float(r["normal_min"]))
-            mx = ("%g" % float(r["normal_max"]))
-            return f"{mn} - {mx}{(' ' + unit) if unit else ''}"
-
-        # Attach ANY / MALE / FEMALE ranges
-        for t in tests:
-            cur2.execute("""
-                SELECT gender,normal_min,normal_max,unit
-                FROM test_reference_ranges
-                WHERE test_id=%s
-            """, (t["test_id"],))
-            rows = cur2.fetchall()
-
-            t["any_range_text"] = None
-            t["male_range_text"] = None
-            t["female_range_text"] = None
-
-            for r in rows:
-                txt = build_text(r, t["unit"])
-                if not txt:
-                    continue
-                if r["gender"] == "ANY":
-                    t["any_range_text"] = txt
-                elif r["gender"] == "M":
-                    t["male_range_text"] = txt
-                elif r["gender"] == "F":
-                    t["female_range_text"] = txt
+            cur.execute("""
+                INSERT INTO activity_log(action,entity_type,entity_id,description)
+                VALUES ('UPDATE_PANEL','TEST',%s,%s)
+            """, (test_id, f"Panel {row[0]} components updated"))
 
-        cur.close()
-        cur2.close()
-        conn.close()
-        return tests
+            invalidation.bump(cur, invalidation.CATALOGUE)
 
+            conn.commit()
+            cur.close()
+            return {"status": "ok", "test_id": test_id, "componentIds": payload.componentIds}
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(500, str(e))
+        raise HTTPException(400, str(e))
 
 # ============================================================
 # DOCTORS
 # ============================================================
 
+doctors_cache = LocalCache("doctors", [invalidation.DOCTORS])
+
+
+def load_doctors():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM doctors ORDER BY full_name")
+    rows = fetch_dicts(cur)
+    cur.close()
+    conn.close()
+    return rows
+
+
 @app.get("/api/doctors")
 def list_doctors():
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(dictionary=True)
-        cur.execute("SELECT * FROM doctors ORDER BY full_name")
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-        return rows
+        return FastJSONResponse(doctors_cache.get_or_load("all", load_doctors))
     except Exception as e:
         raise HTTPException(500, str(e))
 
@@ -428,31 +783,38 @@ def list_doctors():
 def create_doctor(payload: DoctorCreate):
     try:
         conn = get_db_connection()
-        cur = conn.cursor(dictionary=True)
-        cur.execute("""
-            INSERT INTO doctors (full_name,specialization,phone,email)
-            VALUES (%s,%s,%s,%s)
-        """, (
-            payload.fullName,
-            payload.specialization,
-            payload.phone,
-            payload.email
-        ))
-        did = cur.lastrowid
+        try:
+            cur = conn.cursor(dictionary=True)
+            cur.execute("""
+                INSERT INTO doctors (full_name,specialization,phone,email)
+                VALUES (%s,%s,%s,%s)
+            """, (
+                payload.fullName,
+                payload.specialization,
+                payload.phone,
+                payload.email
+            ))
+            did = cur.lastrowid
 
-        cur.execute("""
-            INSERT INTO activity_log(action,entity_type,entity_id,description)
-            VALUES ('CREATE_DOCTOR','DOCTOR',%s,'New doctor created')
-        """, (did,))
+            cur.execute("""
+                INSERT INTO activity_log(action,entity_type,entity_id,description)
+                VALUES ('CREATE_DOCTOR','DOCTOR',%s,'New doctor created')
+            """, (did,))
 
-        conn.commit()
+            invalidation.bump(cur, invalidation.DOCTORS)
 
-        cur.execute("SELECT * FROM doctors WHERE doctor_id=%s", (did,))
-        row = cur.fetchone()
+            conn.commit()
 
-        cur.close()
-        conn.close()
-        return row
+            cur.execute("SELECT * FROM doctors WHERE doctor_id=%s", (did,))
+            row = cur.fetchone()
+
+            cur.close()
+            return row
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
 
     except Exception as e:
         raise HTTPException(400, str(e))
@@ -464,16 +826,17 @@ def create_doctor(payload: DoctorCreate):
 @app.get("/api/orders")
 def list_orders():
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(dictionary=True)
+        conn = get_read_connection()
+        cur = conn.cursor()
 
-        cur.execute("""
+        cur.execute(f"""
             SELECT 
                 o.order_id,
+                o.accession_no,
                 p.full_name AS patient_name,
                 o.order_date,
-                o.priority,
-                o.status,
+                {priority_from_db_sql("o.priority")} AS priority,
+                {status_from_db_sql("o.status")} AS status,
                 (
                     SELECT COUNT(*) 
                     FROM test_order_tests t 
@@ -484,94 +847,120 @@ def list_orders():
             ORDER BY o.order_date DESC
         """)
 
-        rows = cur.fetchall()
+        # Enums already mapped → frontend format in SQL
+        rows = fetch_dicts(cur)
 
         cur.close()
         conn.close()
 
-        # Map enums → frontend format
-        for r in rows:
-            r["priority"] = map_priority_from_db(r["priority"])
-            r["status"] = map_status_from_db(r["status"])
-
-        return rows
+        return FastJSONResponse(rows)
 
     except Exception as e:
         raise HTTPException(500, str(e))
 
 
 @app.post("/api/orders")
-def create_order(payload: CreateOrderPayload):
+def create_order(payload: CreateOrderPayload,
+                 idempotency_key: Optional[str] = Header(None)):
     if not payload.testIds:
         raise HTTPException(400, "At least one test is required")
+    if payload.branch is not None and not accession.valid_branch(payload.branch):
+        raise HTTPException(400, "branch must be a two-digit code")
 
     try:
+        # The accession number usually comes from this worker's reserved
+        # block; taken before this transaction writes anything, since a
+        # block reservation commits on its own connection (and SQLite
+        # allows one writer at a time). A replay just leaves a gap.
+        accession_no = accession.next_accession(payload.branch)
         conn = get_db_connection()
-        cur = conn.cursor(dictionary=True)
-
-        # Calculate total price
-        ids_fmt = ",".join(["%s"] * len(payload.testIds))
-        cur.execute(f"""
-            SELECT test_id, price 
-            FROM tests 
-            WHERE test_id IN ({ids_fmt})
-        """, tuple(payload.testIds))
-
-        total = sum(float(r["price"]) for r in cur.fetchall())
-
-        # Insert order
-        cur.execute("""
-            INSERT INTO test_orders 
-            (patient_id, doctor_id, priority, status, total_amount, notes)
-            VALUES (%s, %s, %s, 'PENDING', %s, %s)
-        """, (
-            payload.patientId,
-            payload.doctorId,
-            map_priority_to_db(payload.priority),
-            total,
-            payload.notes
-        ))
-
-        order_id = cur.lastrowid
-
-        # Insert test list
-        for test_id in payload.testIds:
-            cur.execute("SELECT unit FROM tests WHERE test_id=%s", (test_id,))
-            udata = cur.fetchone()
-            unit_val = udata["unit"] if udata else None
-
+        # Error paths roll back so the idempotency claim and row locks
+        # are released (and SQLite's write lock with them)
+        try:
+            # Retried request? Blocks here while a duplicate is still in flight.
+            if idempotency_key:
+                replay = idempotency.claim(
+                    conn, idempotency_key, "create_order",
+                    idempotency.request_hash("create_order", payload.model_dump()),
+                )
+                if replay is not None:
+                    conn.rollback()
+                    return replay
+
+            cur = conn.cursor(dictionary=True)
+
+            # Shared lock: a merge of this patient waits for the order to commit
+            cur.execute("SELECT merged_into FROM patients WHERE patient_id = %s FOR SHARE",
+                        (payload.patientId,))
+            patient = cur.fetchone()
+            if patient and patient["merged_into"]:
+                raise HTTPException(409, f"Patient {payload.patientId} was merged into {patient['merged_into']}")
+
+            # Calculate total price
+            ids_fmt = ",".join(["%s"] * len(payload.testIds))
+            cur.execute(f"""
+                SELECT test_id, price 
+                FROM tests 
+                WHERE test_id IN ({ids_fmt})
+            """, tuple(payload.testIds))
+            prices = cur.fetchall()
+            unknown = set(payload.testIds) - {r["test_id"] for r in prices}
+            if unknown:
+                raise HTTPException(400, f"Unknown test ids: {sorted(unknown)}")
+
+            total = sum(float(r["price"]) for r in prices)
+
+            # Insert order
             cur.execute("""
-                SELECT normal_min, normal_max, unit
-                FROM test_reference_ranges
-                WHERE test_id=%s AND gender='ANY'
-                LIMIT 1
-            """, (test_id,))
-            rng = cur.fetchone()
-
-            normal_text = None
-            if rng and rng["normal_min"] is not None:
-                mn = ("%g" % float(rng["normal_min"]))
-                mx = ("%g" % float(rng["normal_max"]))
-                use_unit = rng["unit"] or unit_val or ""
-                normal_text = f"{mn} - {mx}{(' ' + use_unit) if use_unit else ''}"
-
+                INSERT INTO test_orders 
+                (patient_id, doctor_id, priority, status, total_amount, notes, accession_no)
+                VALUES (%s, %s, %s, 'PENDING', %s, %s, %s)
+            """, (
+                payload.patientId,
+                payload.doctorId,
+                map_priority_to_db(payload.priority),
+                total,
+                payload.notes,
+                accession_no,
+            ))
+
+            order_id = cur.lastrowid
+
+            # Insert test list; panels expand into their components
+            panels.insert_order_lines(cur, order_id, payload.testIds)
+
+            # log
             cur.execute("""
-                INSERT INTO test_order_tests (order_id, test_id, unit, normal_range_text)
-                VALUES (%s,%s,%s,%s)
-            """, (order_id, test_id, unit_val, normal_text))
+                INSERT INTO activity_log(action, entity_type, entity_id, description)
+                VALUES ('CREATE_ORDER','ORDER',%s,'Order created')
+            """, (order_id,))
 
-        # log
-        cur.execute("""
-            INSERT INTO activity_log(action, entity_type, entity_id, description)
-            VALUES ('CREATE_ORDER','ORDER',%s,'Order created')
-        """, (order_id,))
+            revenue.apply_order(cur, order_id)
 
-        conn.commit()
-        cur.close()
-        conn.close()
+            outbox.emit(cur, "order.created", "order", order_id, {
+                "order_id": order_id, "accession_no": accession_no,
+                "patient_id": payload.patientId, "doctor_id": payload.doctorId,
+                "priority": map_priority_to_db(payload.priority), "test_ids": payload.testIds,
+                "total_amount": total, "notes": payload.notes,
+            })
+
+            result = {"order_id": order_id, "accession_no": accession_no}
+            if idempotency_key:
+                idempotency.store(conn, idempotency_key, "create_order", result)
+
+            conn.commit()
+            outbox.notify()
+            cur.close()
 
-        return {"order_id": order_id}
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(400, str(e))
 
@@ -598,23 +987,38 @@ def get_order(order_id: int):
         order = cur.fetchone()
 
         if not order:
-            raise HTTPException(404, "Order not found")
+            # Not in the hot tables: read through to the archive
+            cur.close()
+            cur = conn.cursor()
+            order = archive.get_order(cur, order_id)
+            cur.close()
+            conn.close()
+            if order is None:
+                raise HTTPException(404, "Order not found")
+            order["priority"] = map_priority_from_db(order["priority"])
+            order["status"] = map_status_from_db(order["status"])
+            order["archived"] = True
+            return order
 
         order["priority"] = map_priority_from_db(order["priority"])
         order["status"] = map_status_from_db(order["status"])
+        order["archived"] = False
 
         cur2 = conn.cursor(dictionary=True)
         cur2.execute("""
             SELECT 
                 tot.test_id,
-                t.test_name,
+                tot.test_name,
                 tot.unit,
                 tot.normal_range_text,
                 tot.result_value,
-                t.price
+                tot.result_text,
+                LOWER(tot.result_flag) AS result_flag,
+                tot.price,
+                tot.panel_test_id
             FROM test_order_tests tot
-            JOIN tests t ON t.test_id = tot.test_id
             WHERE tot.order_id=%s
+            ORDER BY tot.id
         """, (order_id,))
 
         order["tests"] = cur2.fetchall()
@@ -624,55 +1028,153 @@ def get_order(order_id: int):
         conn.close()
         return order
 
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+
+@app.get("/api/accessions/{accession_no}")
+def get_order_by_accession(accession_no: str):
+    """Order for a scanned or typed accession number (dashes/spaces ignored)."""
+    accession_no = accession.normalize(accession_no)
+    if not accession.is_valid(accession_no):
+        raise HTTPException(400, "Invalid accession number")
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        order_id = accession.find_order_id(cur, accession_no)
+        cur.close()
+        conn.close()
     except Exception as e:
         raise HTTPException(500, str(e))
+    if order_id is None:
+        raise HTTPException(404, "Order not found")
+    return get_order(order_id)
 
 
 @app.put("/api/orders/{order_id}")
 def update_order(order_id: int, payload: OrderUpdate):
     try:
         conn = get_db_connection()
-        cur = conn.cursor()
+        try:
+            cur = conn.cursor()
 
-        updates = []
-        vals = []
+            updates = []
+            vals = []
 
-        if payload.priority:
-            updates.append("priority=%s")
-            vals.append(map_priority_to_db(payload.priority))
+            if payload.priority:
+                updates.append("priority=%s")
+                vals.append(map_priority_to_db(payload.priority))
 
-        if payload.status:
-            updates.append("status=%s")
-            vals.append(map_status_to_db(payload.status))
+            if payload.status:
+                updates.append("status=%s")
+                vals.append(map_status_to_db(payload.status))
+                updates.append(tat.STAMP_SQL)
 
-        if payload.notes is not None:
-            updates.append("notes=%s")
-            vals.append(payload.notes)
+            if payload.notes is not None:
+                updates.append("notes=%s")
+                vals.append(payload.notes)
 
-        if not updates:
-            raise HTTPException(400, "Nothing to update")
+            if not updates:
+                raise HTTPException(400, "Nothing to update")
 
-        vals.append(order_id)
+            # Nothing is logged or emitted for an order that isn't here
+            cur.execute("SELECT status FROM test_orders WHERE order_id=%s FOR UPDATE", (order_id,))
+            if cur.fetchone() is None:
+                cur.execute("SELECT 1 FROM archived_orders WHERE order_id=%s", (order_id,))
+                if cur.fetchone() is not None:
+                    raise HTTPException(409, "Archived orders are read-only")
+                raise HTTPException(404, "Order not found")
 
-        cur.execute(f"""
-            UPDATE test_orders 
-            SET {', '.join(updates)} 
-            WHERE order_id=%s
-        """, tuple(vals))
+            vals.append(order_id)
 
-        cur.execute("""
-            INSERT INTO activity_log(action, entity_type, entity_id, description)
-            VALUES ('UPDATE_ORDER','ORDER',%s,'Order updated')
-        """, (order_id,))
+            # Priority is a revenue dimension: move the order between buckets
+            if payload.priority:
+                revenue.apply_order(cur, order_id, -1)
+
+            cur.execute(f"""
+                UPDATE test_orders 
+                SET {', '.join(updates)} 
+                WHERE order_id=%s
+            """, tuple(vals))
+
+            if payload.priority:
+                revenue.apply_order(cur, order_id, 1)
+
+            cur.execute("""
+                INSERT INTO activity_log(action, entity_type, entity_id, description)
+                VALUES ('UPDATE_ORDER','ORDER',%s,'Order updated')
+            """, (order_id,))
 
-        conn.commit()
+            changed = {}
+            if payload.priority:
+                changed["priority"] = map_priority_to_db(payload.priority)
+            if payload.status:
+                changed["status"] = map_status_to_db(payload.status)
+            if payload.notes is not None:
+                changed["notes"] = payload.notes
+            outbox.emit(cur, "order.updated", "order", order_id, {"order_id": order_id, "changes": changed})
+
+            conn.commit()
+            outbox.notify()
+            cur.close()
+
+            return {"status": "ok"}
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(400, str(e))
+
+
+# ============================================================
+# INVOICES
+# ============================================================
+
+@app.get("/api/orders/{order_id}/invoice")
+def get_order_invoice(order_id: int):
+    try:
+        conn = get_read_connection()
+        cur = conn.cursor()
+        invoice = invoices.get_invoice(cur, order_id)
         cur.close()
         conn.close()
+    except Exception as e:
+        raise HTTPException(500, str(e))
 
-        return {"status": "ok"}
+    if invoice is None:
+        raise HTTPException(404, "Order not found")
+    invoice["priority"] = map_priority_from_db(invoice["priority"])
+    return invoice
 
+
+@app.get("/api/invoices")
+def list_invoices(date_: Optional[date] = Query(None, alias="date")):
+    """All invoices for orders placed on one day (default: today)."""
+    day = date_ or date.today()
+    try:
+        conn = get_read_connection()
+        cur = conn.cursor()
+        rows = invoices.get_invoices_for_day(cur, day)
+        cur.close()
+        conn.close()
     except Exception as e:
-        raise HTTPException(400, str(e))
+        raise HTTPException(500, str(e))
+
+    for inv in rows:
+        inv["priority"] = map_priority_from_db(inv["priority"])
+    return FastJSONResponse({
+        "date": day,
+        "count": len(rows),
+        "total_amount": sum(inv["total_amount"] for inv in rows),
+        "invoices": rows,
+    })
 
 
 # ============================================================
@@ -680,59 +1182,79 @@ def update_order(order_id: int, payload: OrderUpdate):
 # ============================================================
 
 @app.put("/api/orders/{order_id}/results")
-def update_results(order_id: int, payload: UpdateResultsPayload):
+def update_results(order_id: int, payload: UpdateResultsPayload,
+                   idempotency_key: Optional[str] = Header(None)):
     """
-    Updates test_order_tests.result_value for each test.
-    Automatically marks order as REPORT_READY unless markCompleted=False.
+    Updates test_order_tests.result_value / result_text and the result
+    flag for each test. Automatically marks order as REPORT_READY unless markCompleted=False.
     """
     try:
         conn = get_db_connection()
-        cur = conn.cursor(dictionary=True)
-
-        # 1) Verify order exists
-        cur.execute("SELECT order_id FROM test_orders WHERE order_id=%s", (order_id,))
-        if cur.fetchone() is None:
-            raise HTTPException(404, "Order not found")
-
-        # 2) Update each test result
-        for item in payload.results:
-            # Check if this test exists in the order
-            cur.execute("""
-                SELECT id FROM test_order_tests 
-                WHERE order_id=%s AND test_id=%s
-            """, (order_id, item.testId))
-            
+        try:
+            if idempotency_key:
+                replay = idempotency.claim(
+                    conn, idempotency_key, "update_results",
+                    idempotency.request_hash("update_results", order_id, payload.model_dump()),
+                )
+                if replay is not None:
+                    conn.rollback()
+                    return replay
+
+            cur = conn.cursor(dictionary=True)
+
+            # 1) Verify order exists
+            cur.execute("SELECT order_id FROM test_orders WHERE order_id=%s", (order_id,))
             if cur.fetchone() is None:
-                continue  # Skip if test not in order
-            
-            # Update the result
+                raise HTTPException(404, "Order not found")
+
+            # 2) Update the test results; tests not in the order match no row
+            results.record_results(cur, [
+                (order_id, item.testId, item.value, item.text) for item in payload.results
+            ])
+
+            # 3) Mark order as completed if requested; stamp TAT times
+            if payload.markCompleted:
+                cur.execute(f"""
+                    UPDATE test_orders
+                    SET status='REPORT_READY', {tat.STAMP_SQL}
+                    WHERE order_id=%s
+                """, (order_id,))
+            else:
+                cur.execute("""
+                    UPDATE test_orders
+                    SET results_entered_at = COALESCE(results_entered_at, NOW())
+                    WHERE order_id=%s
+                """, (order_id,))
+
+            # 4) Log activity
             cur.execute("""
-                UPDATE test_order_tests
-                SET 
-                    result_value=%s,
-                    result_entered_at=NOW()
-                WHERE order_id=%s AND test_id=%s
-            """, (item.value, order_id, item.testId))
-
-        # 3) Mark order as completed if requested
-        if payload.markCompleted:
-            cur.execute("""
-                UPDATE test_orders
-                SET status='REPORT_READY'
-                WHERE order_id=%s
+                INSERT INTO activity_log(action, entity_type, entity_id, description)
+                VALUES ('UPDATE_RESULTS','ORDER',%s,'Test results updated')
             """, (order_id,))
 
-        # 4) Log activity
-        cur.execute("""
-            INSERT INTO activity_log(action, entity_type, entity_id, description)
-            VALUES ('UPDATE_RESULTS','ORDER',%s,'Test results updated')
-        """, (order_id,))
-
-        conn.commit()
-        cur.close()
-        conn.close()
-
-        return {"status": "ok", "message": "Results updated successfully"}
+            outbox.emit(cur, "order.results_entered", "order", order_id, {
+                "order_id": order_id,
+                "results": [
+                    {"test_id": item.testId, "value": item.value, "text": item.text}
+                    for item in payload.results
+                ],
+                "status": "REPORT_READY" if payload.markCompleted else None,
+            })
+
+            result = {"status": "ok", "message": "Results updated successfully"}
+            if idempotency_key:
+                idempotency.store(conn, idempotency_key, "update_results", result)
+
+            conn.commit()
+            outbox.notify()
+            cur.close()
+
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
 
     except HTTPException:
         raise
@@ -747,7 +1269,7 @@ def update_results(order_id: int, payload: UpdateResultsPayload):
 @app.get("/api/dashboard")
 def dashboard():
     try:
-        conn = get_db_connection()
+        conn = get_read_connection()
         cur = conn.cursor(dictionary=True)
 
         today = date.today()
@@ -841,16 +1363,16 @@ def list_reports():
     Returns completed reports only.
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(dictionary=True)
+        conn = get_read_connection()
+        cur = conn.cursor()
 
-        cur.execute("""
+        cur.execute(f"""
             SELECT 
                 o.order_id,
                 p.full_name AS patient_name,
                 o.order_date,
-                o.priority,
-                o.status,
+                {priority_from_db_sql("o.priority")} AS priority,
+                'completed' AS status,
                 o.total_amount
             FROM test_orders o
             JOIN patients p ON o.patient_id = p.patient_id
@@ -858,21 +1380,312 @@ def list_reports():
             ORDER BY o.order_date DESC
         """)
 
-        rows = cur.fetchall()
+        rows = fetch_dicts(cur)
+
+        cur.close()
+        conn.close()
+
+        return FastJSONResponse(rows)
+
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+
+# ============================================================
+# COHORTS
+# ============================================================
+
+@app.get("/api/cohorts")
+def cohort_query(
+    testId: int,
+    minValue: Optional[float] = None,
+    maxValue: Optional[float] = None,
+    flag: Optional[str] = None,
+    dateFrom: Optional[date] = None,
+    dateTo: Optional[date] = None,
+    gender: Optional[str] = None,
+    ageMin: Optional[int] = None,
+    ageMax: Optional[int] = None,
+    limit: int = 500,
+):
+    """
+    Results of one test filtered by value range, flag (low/normal/high),
+    entry date and patient gender/age, e.g. HbA1c > 6.5 in the last month:
+    /api/cohorts?testId=21&minValue=6.5&dateFrom=2025-05-01
+    Defaults to the last 30 days.
+    """
+    date_to = dateTo or date.today()
+    date_from = dateFrom or (date_to - timedelta(days=30))
+    g = map_gender_to_db(gender)
+    if gender and g is None:
+        raise HTTPException(400, "gender must be one of: male, female, other")
+
+    try:
+        conn = get_read_connection()
+        cur = conn.cursor()
+        summary, rows = results.query_cohort(
+            cur, testId,
+            value_min=minValue, value_max=maxValue,
+            flag=flag.upper() if flag else None,
+            date_from=date_from, date_to=date_to,
+            gender=g, age_min=ageMin, age_max=ageMax,
+            limit=limit,
+        )
+        cur.close()
+        conn.close()
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+    return FastJSONResponse({
+        "testId": testId,
+        "dateFrom": date_from,
+        "dateTo": date_to,
+        "summary": summary,
+        "results": rows,
+    })
+
+
+@app.get("/api/orders/{order_id}/report.pdf")
+def get_order_report_pdf(order_id: int, if_none_match: Optional[str] = Header(None)):
+    """
+    Rendered PDF report. Cached on disk by content, so reprints are a file
+    read and any result or settings change renders a fresh copy.
+    """
+    try:
+        settings = settings_cache.get_or_load("all", load_settings)
+        conn = get_read_connection()
+        cur = conn.cursor()
+        data = reports.load_report_data(cur, order_id, settings)
+        cur.close()
+        conn.close()
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+    if data is None:
+        raise HTTPException(404, "Order not found")
+
+    etag = f'"{reports.report_key(data)}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+
+    try:
+        _, pdf, _ = reports.get_or_render(data)
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+    headers["Content-Disposition"] = f'inline; filename="report-{order_id}.pdf"'
+    return Response(pdf, media_type="application/pdf", headers=headers)
+
+
+@app.post("/api/reports/batch", status_code=202)
+def start_report_batch(dateFrom: Optional[date] = None, dateTo: Optional[date] = None):
+    """
+    Render every report that became ready in the window (default today)
+    in the background. Re-posting the same window resumes it.
+    """
+    date_from = dateFrom or date.today()
+    date_to = dateTo or date_from
+    if date_to < date_from:
+        raise HTTPException(400, "dateTo must not be before dateFrom")
+    try:
+        settings = settings_cache.get_or_load("all", load_settings)
+        return eod.start_job(get_db_connection, date_from, date_to, settings)
+    except Exception as e:
+        raise HTTPException(500, str(e))
 
+
+@app.get("/api/reports/batch/{job_id}")
+def report_batch_status(job_id: str):
+    manifest = eod.read_manifest(job_id) if eod.valid_job_id(job_id) else None
+    if manifest is None:
+        raise HTTPException(404, "Batch not found")
+    return eod.summary(manifest)
+
+
+@app.get("/api/reports/batch/{job_id}/archive")
+def report_batch_archive(job_id: str):
+    manifest = eod.read_manifest(job_id) if eod.valid_job_id(job_id) else None
+    if manifest is None:
+        raise HTTPException(404, "Batch not found")
+    if not manifest.get("archive") or not os.path.exists(manifest["archive"]):
+        raise HTTPException(409, f"Batch is {manifest['status']}, archive not ready")
+    return FileResponse(manifest["archive"], media_type="application/zip",
+                        filename=f"{job_id}.zip")
+
+
+# ============================================================
+# REVENUE ANALYTICS
+# ============================================================
+
+@app.get("/api/analytics/revenue")
+def revenue_analytics(
+    period: str = "day",
+    groupBy: Optional[str] = None,
+    dateFrom: Optional[date] = None,
+    dateTo: Optional[date] = None,
+):
+    """
+    Revenue per day/week/month, optionally broken down by any of
+    category, doctor, priority (groupBy=category,doctor).
+    Defaults to the last 30 days.
+    """
+    try:
+        dims = revenue.parse_dimensions(groupBy)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    date_to = dateTo or date.today()
+    date_from = dateFrom or (date_to - timedelta(days=30))
+
+    try:
+        conn = get_read_connection()
+        cur = conn.cursor()
+        rows = revenue.query(cur, period, dims, date_from, date_to)
         cur.close()
         conn.close()
 
-        # map priority + status
-        for r in rows:
-            r["priority"] = map_priority_from_db(r["priority"])
-            r["status"] = "completed"
+        return FastJSONResponse({
+            "period": period,
+            "groupBy": dims,
+            "from": date_from,
+            "to": date_to,
+            "rows": rows,
+        })
+
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+
+# ============================================================
+# TURNAROUND TIME
+# ============================================================
+
+@app.get("/api/analytics/tat")
+def tat_analytics(
+    groupBy: Optional[str] = None,
+    dateFrom: Optional[date] = None,
+    dateTo: Optional[date] = None,
+):
+    """
+    p50/p90/p99 collection-to-report and order-to-report minutes for
+    orders reported in the window (default last 30 days), grouped by any
+    of priority (default), category, hour; with SLA breach rates.
+    """
+    date_to = dateTo or date.today()
+    date_from = dateFrom or (date_to - timedelta(days=30))
+    try:
+        dims = tat.parse_dimensions(groupBy)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    try:
+        conn = get_read_connection()
+        cur = conn.cursor()
+        rows = tat.query(cur, date_from, date_to, dims)
+        cur.close()
+        conn.close()
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+    return FastJSONResponse({
+        "dateFrom": date_from,
+        "dateTo": date_to,
+        "groupBy": dims,
+        "slaMinutes": {
+            "urgent": config.TAT_SLA_URGENT_MINUTES,
+            "normal": config.TAT_SLA_NORMAL_MINUTES,
+        },
+        "rows": rows,
+    })
+
+
+# ============================================================
+# QC STATISTICS
+# ============================================================
+
+@app.get("/api/analytics/qc")
+def qc_statistics(
+    days: int = 30,
+    dateFrom: Optional[date] = None,
+    dateTo: Optional[date] = None,
+    testIds: Optional[str] = None,
+    stratify: Optional[str] = None,
+    bins: int = 20,
+):
+    """
+    Per-test result distributions (mean, SD, percentiles, histogram,
+    LOW/HIGH rates) over a window, default the last 30 days. Optional
+    testIds=1,2,3 and stratify=gender,age.
+    """
+    date_to = dateTo or date.today()
+    date_from = dateFrom or (date_to - timedelta(days=days))
+    try:
+        strata = qc.parse_strata(stratify)
+        ids = [int(x) for x in testIds.split(",") if x.strip()] if testIds else None
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if not 1 <= bins <= 200:
+        raise HTTPException(400, "bins must be between 1 and 200")
+
+    try:
+        rows = qc.window_stats(get_read_connection, date_from, date_to, ids, strata, bins)
+        catalogue = {t["test_id"]: t for t in catalogue_cache.get_or_load("active", load_test_catalogue)}
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+    tests = []
+    for row in rows:
+        t = catalogue.get(row["test_id"])
+        tests.append({
+            "test_id": row["test_id"],
+            "test_name": t["test_name"] if t else None,
+            "unit": t["unit"] if t else None,
+            **row,
+        })
+    return FastJSONResponse({
+        "dateFrom": date_from,
+        "dateTo": date_to,
+        "stratify": strata,
+        "tests": tests,
+    })
 
-        return rows
 
+# ============================================================
+# CHANGE FEED
+# ============================================================
+
+@app.get("/api/changes")
+def list_changes(
+    since: Optional[str] = None,
+    limit: int = 500,
+    entities: Optional[str] = None,
+):
+    """
+    Rows of patients, orders and order lines changed after `since`, in
+    change order. Start without `since` and pass back the returned cursor;
+    has_more=true means the next page is already available.
+    """
+    try:
+        names = changes.parse_entities(entities)
+        # Primary: a lagging replica could hand out a cursor past rows it
+        # has not applied yet
+        conn = get_db_connection()
+        cur = conn.cursor()
+        rows, cursor, has_more = changes.fetch_changes(cur, since, limit, names)
+        cur.close()
+        conn.close()
+    except ValueError as e:
+        raise HTTPException(400, str(e))
     except Exception as e:
         raise HTTPException(500, str(e))
 
+    return FastJSONResponse({"changes": rows, "cursor": cursor, "has_more": has_more})
+
 
 # ============================================================
 # ACTIVITY LOG
@@ -881,8 +1694,8 @@ def list_reports():
 @app.get("/api/activity")
 def list_activity(limit: int = 50):
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(dictionary=True)
+        conn = get_read_connection()
+        cur = conn.cursor()
 
         cur.execute("""
             SELECT *
@@ -891,12 +1704,12 @@ def list_activity(limit: int = 50):
             LIMIT %s
         """, (limit,))
 
-        rows = cur.fetchall()
+        rows = fetch_dicts(cur)
 
         cur.close()
         conn.close()
 
-        return rows
+        return FastJSONResponse(rows)
 
     except Exception as e:
         raise HTTPException(500, str(e))
@@ -906,24 +1719,25 @@ def list_activity(limit: int = 50):
 # SETTINGS
 # ============================================================
 
-@app.get("/api/settings")
-def get_settings():
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor(dictionary=True)
+settings_cache = LocalCache("settings", [invalidation.SETTINGS])
 
-        cur.execute("SELECT * FROM app_settings")
-        rows = cur.fetchall()
 
-        cur.close()
-        conn.close()
+def load_settings():
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    cur.execute("SELECT setting_key, setting_value FROM app_settings")
+    settings = {key: (value or "") for key, value in cur.fetchall()}
+
+    cur.close()
+    conn.close()
+    return settings
 
-        settings = {
-            row["setting_key"]: (row["setting_value"] or "")
-            for row in rows
-        }
 
-        return {"settings": settings}
+@app.get("/api/settings")
+def get_settings():
+    try:
+        return {"settings": settings_cache.get_or_load("all", load_settings)}
 
     except Exception as e:
         raise HTTPException(500, str(e))
@@ -933,25 +1747,32 @@ def get_settings():
 def update_settings(payload: SettingsUpdatePayload):
     try:
         conn = get_db_connection()
-        cur = conn.cursor()
+        try:
+            cur = conn.cursor()
+
+            for key, value in payload.settings.items():
+                cur.execute("""
+                    INSERT INTO app_settings(setting_key, setting_value)
+                    VALUES(%s, %s)
+                    ON DUPLICATE KEY UPDATE setting_value = VALUES(setting_value)
+                """, (key, value))
 
-        for key, value in payload.settings.items():
             cur.execute("""
-                INSERT INTO app_settings(setting_key, setting_value)
-                VALUES(%s, %s)
-                ON DUPLICATE KEY UPDATE setting_value = VALUES(setting_value)
-            """, (key, value))
+                INSERT INTO activity_log(action, entity_type, description)
+                VALUES ('UPDATE_SETTINGS','SETTINGS','Settings updated')
+            """)
 
-        cur.execute("""
-            INSERT INTO activity_log(action, entity_type, description)
-            VALUES ('UPDATE_SETTINGS','SETTINGS','Settings updated')
-        """)
+            invalidation.bump(cur, invalidation.SETTINGS)
 
-        conn.commit()
-        cur.close()
-        conn.close()
+            conn.commit()
+            cur.close()
 
-        return {"status": "ok"}
+            return {"status": "ok"}
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
 
     except Exception as e:
         raise HTTPException(400, str(e))
@@ -974,7 +1795,7 @@ def sql_demo(payload: SqlDemoPayload):
         raise HTTPException(400, "Only safe SELECT queries allowed.")
 
     try:
-        conn = get_db_connection()
+        conn = get_read_connection()
         cur = conn.cursor()
 
         t0 = datetime.now()
@@ -987,25 +1808,13 @@ def sql_demo(payload: SqlDemoPayload):
         cur.close()
         conn.close()
 
-        # Convert to JSON safe output
-        safe_rows = []
-        for row in rows:
-            out = []
-            for col in row:
-                if isinstance(col, datetime):
-                    out.append(col.isoformat())
-                elif isinstance(col, date):
-                    out.append(col.isoformat())
-                else:
-                    out.append(col)
-            safe_rows.append(out)
-
-        return {
+        # orjson serializes datetime/date/Decimal tuples natively
+        return FastJSONResponse({
             "columns": columns,
-            "rows": safe_rows,
-            "rowCount": len(safe_rows),
+            "rows": rows,
+            "rowCount": len(rows),
             "timeMs": (t1 - t0).total_seconds() * 1000
-        }
+        })
 
     except Exception as e:
         raise HTTPException(400, str(e))
@@ -1018,12 +1827,34 @@ def sql_demo(payload: SqlDemoPayload):
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup"""
+    global _tables_ready
+
+    # Every admitted request may hold a worker thread; size the pool so the
+    # admission limits (not the threadpool) are what bounds concurrency.
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = max(limiter.total_tokens, admission.total_concurrency(admission_gates) + 4)
+
     try:
         init_database_and_tables()
+        _tables_ready = True
         print("✓ Database initialized successfully")
     except Exception as e:
         print(f"✗ Database initialization failed: {e}")
 
+    invalidation.start_poller(lambda: get_raw_connection(include_db=True))
+    accession.init(lambda: get_raw_connection(include_db=True))
+    replica_router.start(primary_connect=lambda: get_raw_connection(include_db=True))
+    outbox.start_dispatcher(lambda: get_raw_connection(include_db=True))
+    threading.Thread(target=reports.prune_cache, name="medlab-report-prune", daemon=True).start()
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    invalidation.stop_poller()
+    replica_router.stop()
+    outbox.stop_dispatcher()
+    reports.shutdown_pool()
+
 
 # ============================================================
 # END OF FILE
@@ -0,0 +1,216 @@
+"""
+Merging duplicate patient records.
+
+merge_patients(conn, survivor, duplicate) moves everything that belongs
+to `duplicate` over to `survivor`:
+
+  test_orders.patient_id, archived_orders.patient_id
+      re-pointed with UPDATE ... LIMIT MERGE_CHUNK_SIZE, one short
+      transaction per chunk, so a patient with thousands of orders never
+      holds row locks for long and order entry for other patients is not
+      blocked;
+  patients
+      contact and demographic fields missing on the survivor are filled
+      from the duplicate; the duplicate row is kept, with merged_into set,
+      so old references still resolve;
+  patient_blocking_keys, patient_merge_candidates
+      the duplicate's keys are dropped and the survivor re-indexed; the
+      merged pair is marked MERGED and stale proposals for the duplicate
+      are removed (the next scan proposes them against the survivor).
+
+The duplicate is marked merged first, in its own transaction. From then
+on create_order() refuses it (it reads merged_into under a shared lock,
+so an order being placed either commits before the mark, and is moved by
+the chunks, or sees the mark), and a merge that fails half way can simply
+be rerun. The last transaction writes a single activity_log entry with
+the row counts, bumps the `patients` cache version and emits a
+patient.merged event.
+
+With dry_run=True nothing is written; the same counts are returned.
+
+    cd backend
+    python -m app.merge 123 456 --dry-run      # keep 123, merge 456 into it
+"""
+import argparse
+import time
+from typing import Callable, List, Optional
+
+from . import config, dedup, invalidation, outbox
+
+MERGED_INTO_COLUMN = "merged_into INT NULL"
+
+# Tables whose rows are re-pointed from the duplicate to the survivor
+MOVED_TABLES = ("test_orders", "archived_orders")
+
+# Survivor fields filled from the duplicate when empty
+FILLED_FIELDS = ("date_of_birth", "gender", "phone", "email", "address")
+
+
+class MergeConflict(Exception):
+    """The pair cannot be merged in its current state."""
+
+
+def _patients(cur, survivor_id: int, duplicate_id: int, lock: bool) -> dict:
+    cur.execute(f"""
+        SELECT patient_id, full_name, {', '.join(FILLED_FIELDS)}, merged_into
+        FROM patients WHERE patient_id IN (%s, %s)
+        {'FOR UPDATE' if lock else ''}
+    """, (survivor_id, duplicate_id))
+    cols = [c[0] for c in cur.description]
+    rows = {r[0]: dict(zip(cols, r)) for r in cur.fetchall()}
+    for pid in (survivor_id, duplicate_id):
+        if pid not in rows:
+            raise LookupError(f"Patient {pid} not found")
+
+    survivor, duplicate = rows[survivor_id], rows[duplicate_id]
+    if survivor["merged_into"] is not None:
+        raise MergeConflict(
+            f"Patient {survivor_id} was merged into {survivor['merged_into']}; merge into that record"
+        )
+    if duplicate["merged_into"] not in (None, survivor_id):
+        raise MergeConflict(f"Patient {duplicate_id} was already merged into {duplicate['merged_into']}")
+    return rows
+
+
+def _filled(survivor: dict, duplicate: dict) -> List[str]:
+    return [f for f in FILLED_FIELDS if survivor[f] in (None, "") and duplicate[f] not in (None, "")]
+
+
+def _counts(cur, duplicate_id: int) -> dict:
+    counts = {}
+    for table in MOVED_TABLES:
+        cur.execute(f"SELECT COUNT(*) FROM {table} WHERE patient_id = %s", (duplicate_id,))
+        counts[table] = cur.fetchone()[0]
+    return counts
+
+
+def _move_chunk(cur, table: str, survivor_id: int, duplicate_id: int, chunk_size: int) -> int:
+    cur.execute(
+        f"UPDATE {table} SET patient_id = %s WHERE patient_id = %s LIMIT %s",
+        (survivor_id, duplicate_id, chunk_size),
+    )
+    return cur.rowcount
+
+
+def merge_patients(conn, survivor_id: int, duplicate_id: int, dry_run: bool = False,
+                   chunk_size: Optional[int] = None, progress: Optional[Callable] = None) -> dict:
+    """
+    Merge `duplicate_id` into `survivor_id`. Returns the moved row counts
+    per table, the survivor fields filled in and the number of
+    transactions used (or, for a dry run, what would be done).
+
+    Raises LookupError if either patient is missing and MergeConflict if
+    the pair is the same patient or either side was merged elsewhere.
+    """
+    if survivor_id == duplicate_id:
+        raise MergeConflict("A patient cannot be merged into itself")
+    chunk_size = chunk_size or config.MERGE_CHUNK_SIZE
+    cur = conn.cursor()
+
+    if dry_run:
+        rows = _patients(cur, survivor_id, duplicate_id, lock=False)
+        result = {
+            "survivor_id": survivor_id, "duplicate_id": duplicate_id, "dry_run": True,
+            "moved": _counts(cur, duplicate_id),
+            "filled_fields": _filled(rows[survivor_id], rows[duplicate_id]),
+        }
+        conn.rollback()
+        cur.close()
+        return result
+
+    # 1. Mark the duplicate so no new orders land on it while we move
+    rows = _patients(cur, survivor_id, duplicate_id, lock=True)
+    survivor, duplicate = rows[survivor_id], rows[duplicate_id]
+    cur.execute("UPDATE patients SET merged_into = %s WHERE patient_id = %s", (survivor_id, duplicate_id))
+    conn.commit()
+    transactions = 1
+
+    # 2. Re-point rows in short transactions
+    moved = {table: 0 for table in MOVED_TABLES}
+    for table in MOVED_TABLES:
+        while True:
+            n = _move_chunk(cur, table, survivor_id, duplicate_id, chunk_size)
+            conn.commit()
+            transactions += 1
+            moved[table] += n
+            if progress and n:
+                progress(table, moved[table])
+            if n < chunk_size:
+                break
+
+    # 3. Fix up the survivor and the dedup tables, log once
+    filled = _filled(survivor, duplicate)
+    if filled:
+        cur.execute(
+            f"UPDATE patients SET {', '.join(f'{f} = %s' for f in filled)} WHERE patient_id = %s",
+            tuple(duplicate[f] for f in filled) + (survivor_id,),
+        )
+        survivor.update((f, duplicate[f]) for f in filled)
+
+    cur.execute("DELETE FROM patient_blocking_keys WHERE patient_id = %s", (duplicate_id,))
+    dedup.index_patient(cur, survivor_id, survivor["full_name"], survivor["date_of_birth"],
+                        survivor["phone"], survivor["email"])
+    cur.execute("""
+        UPDATE patient_merge_candidates SET status = 'MERGED'
+        WHERE (patient_id, duplicate_id) IN ((%s, %s), (%s, %s))
+    """, (survivor_id, duplicate_id, duplicate_id, survivor_id))
+    cur.execute("""
+        DELETE FROM patient_merge_candidates
+        WHERE status = 'PROPOSED' AND (patient_id = %s OR duplicate_id = %s)
+    """, (duplicate_id, duplicate_id))
+
+    summary = ", ".join(f"{n} {table}" for table, n in moved.items())
+    cur.execute("""
+        INSERT INTO activity_log(action, entity_type, entity_id, description)
+        VALUES ('MERGE_PATIENT', 'PATIENT', %s, %s)
+    """, (survivor_id, (
+        f"Merged patient #{duplicate_id} ({duplicate['full_name']}) into #{survivor_id}: "
+        f"moved {summary}" + (f"; filled {', '.join(filled)}" if filled else "")
+    )))
+    invalidation.bump(cur, invalidation.PATIENTS)
+    outbox.emit(cur, "patient.merged", "patient", survivor_id, {
+        "patient_id": survivor_id, "merged_patient_id": duplicate_id,
+        "moved": moved, "filled_fields": filled,
+    })
+    conn.commit()
+    transactions += 1
+    outbox.notify()
+    cur.close()
+
+    return {
+        "survivor_id": survivor_id, "duplicate_id": duplicate_id, "dry_run": False,
+        "moved": moved, "filled_fields": filled, "transactions": transactions,
+    }
+
+# ============================================================
+# CLI
+# ============================================================
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Merge a duplicate patient into another")
+    ap.add_argument("survivor_id", type=int, help="patient record to keep")
+    ap.add_argument("duplicate_id", type=int, help="patient record merged into it")
+    ap.add_argument("--chunk-size", type=int, default=config.MERGE_CHUNK_SIZE)
+    ap.add_argument("--dry-run", action="store_true", help="only report what would change")
+    args = ap.parse_args()
+
+    from .db import get_db_connection
+
+    conn = get_db_connection()
+    t0 = time.perf_counter()
+    try:
+        result = merge_patients(conn, args.survivor_id, args.duplicate_id, args.dry_run, args.chunk_size)
+    except (LookupError, MergeConflict) as e:
+        ap.exit(1, f"✗ {e}\n")
+    finally:
+        conn.close()
+
+    moved = ", ".join(f"{n} {table}" for table, n in result["moved"].items())
+    filled = ", ".join(result["filled_fields"]) or "none"
+    verb = "Would move" if args.dry_run else "Moved"
+    print(f"✓ {verb} {moved}; fields filled: {filled} ({time.perf_counter() - t0:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
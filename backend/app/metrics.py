@@ -0,0 +1,390 @@
+"""
+Lightweight Prometheus-style metrics for the MedLAB+ backend.
+
+Everything here is in-process and dependency free:
+  * Counter / Histogram primitives with label support
+  * MetricsMiddleware (pure ASGI) timing every HTTP request
+  * InstrumentedConnection / InstrumentedCursor wrapping mysql-connector
+  * render_metrics() producing the text exposition format for /metrics
+
+The hot path is kept to a couple of perf_counter() calls, one lock and a
+bisect per observation so the per-request overhead stays well below 50 µs.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Optional, Sequence, Tuple
+
+# ============================================================
+# PRIMITIVES
+# ============================================================
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+QUERY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0
+)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for lv, v in items:
+            yield f"{self.name}{_format_labels(self.label_names, lv)} {_format_value(v)}"
+
+
+class Gauge:
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, *label_values, value: float):
+        with self._lock:
+            self._values[label_values] = value
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def dec(self, *label_values, amount: float = 1.0):
+        self.inc(*label_values, amount=-amount)
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} gauge"
+        with self._lock:
+            items = list(self._values.items())
+        for lv, v in items:
+            yield f"{self.name}{_format_labels(self.label_names, lv)} {_format_value(v)}"
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(label_values)
+            if s is None:
+                s = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[idx] += 1
+            s[-1] += value
+
+    def count(self, *label_values) -> int:
+        s = self._series.get(label_values)
+        return sum(s[:-1]) if s else 0
+
+    def render(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(lv, list(s)) for lv, s in self._series.items()]
+        for lv, s in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), s[:-1]):
+                cumulative += n
+                le = 'le="%s"' % _format_value(bound)
+                yield f"{self.name}_bucket{_format_labels(self.label_names, lv, le)} {cumulative}"
+            labels = _format_labels(self.label_names, lv)
+            yield f"{self.name}_sum{labels} {_format_value(s[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+# ============================================================
+# REGISTRY
+# ============================================================
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+HTTP_REQUESTS = register(Counter(
+    "medlab_http_requests_total",
+    "HTTP requests handled, by method, route template and status code.",
+    ("method", "route", "status"),
+))
+HTTP_LATENCY = register(Histogram(
+    "medlab_http_request_duration_seconds",
+    "HTTP request latency, by method, route template and status code.",
+    ("method", "route", "status"),
+))
+HTTP_IN_FLIGHT = register(Gauge(
+    "medlab_http_requests_in_flight",
+    "HTTP requests currently being processed.",
+))
+DB_QUERY_LATENCY = register(Histogram(
+    "medlab_db_query_duration_seconds",
+    "Duration of individual SQL statements, by statement verb.",
+    ("operation",),
+    QUERY_BUCKETS,
+))
+DB_QUERIES_PER_REQUEST = register(Histogram(
+    "medlab_db_queries_per_request",
+    "Number of SQL statements executed per HTTP request, by route template.",
+    ("route",),
+    COUNT_BUCKETS,
+))
+DB_TIME_PER_REQUEST = register(Histogram(
+    "medlab_db_time_per_request_seconds",
+    "Total time spent in SQL statements per HTTP request, by route template.",
+    ("route",),
+))
+DB_CONNECT_LATENCY = register(Histogram(
+    "medlab_db_connection_acquire_seconds",
+    "Time taken to acquire a database connection.",
+    (),
+    QUERY_BUCKETS + (2.5, 5.0),
+))
+CACHE_REQUESTS = register(Counter(
+    "medlab_cache_requests_total",
+    "In-process cache lookups, by cache name and result (hit/miss).",
+    ("cache", "result"),
+))
+
+
+def record_cache_hit(cache: str):
+    CACHE_REQUESTS.inc(cache, "hit")
+
+
+def record_cache_miss(cache: str):
+    CACHE_REQUESTS.inc(cache, "miss")
+
+
+def _render_cache_ratios():
+    name = "medlab_cache_hit_ratio"
+    yield f"# HELP {name} Fraction of cache lookups that were hits, by cache name."
+    yield f"# TYPE {name} gauge"
+    caches = sorted({lv[0] for lv, _ in list(CACHE_REQUESTS._values.items())})
+    for cache in caches:
+        hits = CACHE_REQUESTS.value(cache, "hit")
+        total = hits + CACHE_REQUESTS.value(cache, "miss")
+        ratio = hits / total if total else 0.0
+        yield f'{name}{{cache="{_escape(cache)}"}} {_format_value(ratio)}'
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(_render_cache_ratios())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ============================================================
+# PER-REQUEST DB ACCOUNTING
+# ============================================================
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time", "connect_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.connect_time = 0.0
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("medlab_request_stats", default=None)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+
+def observe_connection_acquire(seconds: float):
+    DB_CONNECT_LATENCY.observe(seconds)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.connect_time += seconds
+
+
+def _statement_verb(sql: str) -> str:
+    head = sql.lstrip()[:16].split(None, 1)
+    return head[0].upper() if head else "UNKNOWN"
+
+
+class InstrumentedCursor:
+    """
+    Thin proxy over a mysql-connector cursor that times execute()/executemany().
+    All other attributes (fetchall, lastrowid, description, ...) pass through.
+    """
+
+    __slots__ = ("_cursor",)
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _record(self, sql: str, elapsed: float):
+        DB_QUERY_LATENCY.observe(elapsed, _statement_verb(sql))
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            self._record(operation, time.perf_counter() - t0)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            self._record(operation, time.perf_counter() - t0)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """
+    Proxy over a mysql-connector connection whose cursor() returns
+    InstrumentedCursor objects (or the given subclass).
+    """
+
+    __slots__ = ("_conn", "_cursor_class")
+
+    def __init__(self, conn, cursor_class=InstrumentedCursor):
+        self._conn = conn
+        self._cursor_class = cursor_class
+
+    def cursor(self, *args, **kwargs):
+        return self._cursor_class(self._conn.cursor(*args, **kwargs))
+
+    @property
+    def raw(self):
+        return self._conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._conn.close()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name in InstrumentedConnection.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+
+# ============================================================
+# ASGI MIDDLEWARE
+# ============================================================
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no BaseHTTPMiddleware task overhead) recording
+    request count/latency per route template and per-request DB totals.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        HTTP_IN_FLIGHT.inc()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - t0
+            HTTP_IN_FLIGHT.dec()
+            _request_stats.reset(token)
+
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "<unmatched>"
+            status = str(status_holder[0])
+            method = scope["method"]
+
+            HTTP_REQUESTS.inc(method, route_path, status)
+            HTTP_LATENCY.observe(elapsed, method, route_path, status)
+            DB_QUERIES_PER_REQUEST.observe(stats.queries, route_path)
+            DB_TIME_PER_REQUEST.observe(stats.db_time, route_path)
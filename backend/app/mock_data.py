@@ -2,19 +2,22 @@
 Mock Data Generator for MedLAB+ Database
 Generates realistic test data for all tables
 """
-import mysql.connector
 from datetime import datetime, timedelta
 import random
 
+from app import config, storage
+
 def get_db_connection(host, port, user, password, database):
-    """Create database connection"""
-    return mysql.connector.connect(
+    """Create database connection (SQLITE_PATH when DB_ENGINE=sqlite)"""
+    if config.DB_ENGINE == "sqlite":
+        return storage.get_engine().connect()
+    return storage.MySQLEngine(
         host=host,
         port=port,
         user=user,
         password=password,
         database=database,
-    )
+    ).connect()
 
 
 def clear_all_data(conn):
@@ -23,9 +26,12 @@ def clear_all_data(conn):
     
     tables = [
         'activity_log',
+        'event_outbox',
+        'archived_orders',
         'test_order_tests',
         'test_orders',
         'test_reference_ranges',
+        'test_panel_members',
         'tests',
         'test_categories',
         'doctors',
@@ -157,6 +163,37 @@ def insert_tests(conn):
     print(f"✓ Inserted {len(tests)} tests")
 
 
+def insert_panel_members(conn):
+    """Link panels to their component tests"""
+    cursor = conn.cursor()
+    
+    cursor.execute("SELECT test_name, test_id FROM tests")
+    tests = dict(cursor.fetchall())
+    
+    panels = {
+        'Complete Blood Count (CBC)': [
+            'Hemoglobin (Hb)', 'Total Leukocyte Count (TLC)', 'Platelet Count',
+        ],
+        'Lipid Profile': [
+            'Total Cholesterol', 'HDL Cholesterol', 'LDL Cholesterol',
+            'Triglycerides', 'VLDL Cholesterol',
+        ],
+    }
+    
+    count = 0
+    for panel, components in panels.items():
+        for sort_order, component in enumerate(components):
+            cursor.execute("""
+                INSERT INTO test_panel_members (panel_test_id, component_test_id, sort_order)
+                VALUES (%s, %s, %s)
+            """, (tests[panel], tests[component], sort_order))
+            count += 1
+    
+    conn.commit()
+    cursor.close()
+    print(f"✓ Inserted {count} panel components for {len(panels)} panels")
+
+
 def insert_reference_ranges(conn):
     """Insert gender-specific reference ranges"""
     cursor = conn.cursor()
@@ -289,6 +326,9 @@ def insert_orders_and_results(conn):
     cursor.execute("SELECT test_id, price FROM tests")
     test_data = cursor.fetchall()
     
+    cursor.execute("SELECT test_id, test_name FROM tests")
+    test_names = dict(cursor.fetchall())
+    
     statuses = ['PENDING', 'SAMPLE_COLLECTED', 'RESULTS_ENTERED', 'REPORT_READY']
     priorities = ['NORMAL', 'URGENT']
     
@@ -319,12 +359,24 @@ def insert_orders_and_results(conn):
         ]
         notes = random.choice(notes_options)
         
+        # Status transition times (urgent orders are turned around faster)
+        sample_collected_at = results_entered_at = report_ready_at = None
+        if status != 'PENDING':
+            sample_collected_at = order_date + timedelta(minutes=random.randint(10, 90))
+        if status in ('RESULTS_ENTERED', 'REPORT_READY'):
+            hours = random.uniform(1, 6) if priority == 'URGENT' else random.uniform(4, 36)
+            results_entered_at = sample_collected_at + timedelta(hours=hours)
+        if status == 'REPORT_READY':
+            report_ready_at = results_entered_at + timedelta(minutes=random.randint(5, 60))
+        
         # Insert order
         cursor.execute("""
             INSERT INTO test_orders 
-            (patient_id, doctor_id, order_date, priority, status, total_amount, notes)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (patient_id, doctor_id, order_date, priority, status, total_amount, notes))
+            (patient_id, doctor_id, order_date, priority, status, total_amount, notes,
+             sample_collected_at, results_entered_at, report_ready_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, (patient_id, doctor_id, order_date, priority, status, total_amount, notes,
+              sample_collected_at, results_entered_at, report_ready_at))
         
         order_id = cursor.lastrowid
         
@@ -379,9 +431,11 @@ def insert_orders_and_results(conn):
             
             cursor.execute("""
                 INSERT INTO test_order_tests 
-                (order_id, test_id, unit, normal_range_text, result_value, result_flag, result_entered_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (order_id, test_id, unit, normal_range_text, result_value, result_flag, result_entered_at))
+                (order_id, test_id, unit, normal_range_text, result_value, result_flag, result_entered_at,
+                 test_name, price)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (order_id, test_id, unit, normal_range_text, result_value, result_flag, result_entered_at,
+                  test_names.get(test_id), price))
         
         # Add activity log
         cursor.execute("""
@@ -419,6 +473,64 @@ def insert_settings(conn):
     print(f"✓ Inserted {len(settings)} lab settings")
 
 
+def bump_cache_versions(conn):
+    """Tell running backend workers to drop their cached reference data"""
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("""
+            INSERT INTO cache_versions (entity, version)
+            VALUES (%s, 1)
+            ON DUPLICATE KEY UPDATE version = version + 1
+        """, [('catalogue',), ('settings',), ('doctors',)])
+        conn.commit()
+        print("✓ Bumped cache versions")
+    except Exception as e:
+        print(f"⚠ Could not bump cache versions: {e}")
+    cursor.close()
+
+
+def rebuild_revenue_aggregates(conn):
+    """Recompute revenue aggregates for the generated orders"""
+    try:
+        from app.revenue import rebuild
+        rebuild(conn)
+        print("✓ Rebuilt revenue aggregates")
+    except Exception as e:
+        print(f"⚠ Could not rebuild revenue aggregates ({e}); run: python -m app.revenue rebuild")
+
+
+def index_patient_keys(conn):
+    """Write duplicate-detection blocking keys for the generated patients"""
+    try:
+        from app.dedup import index_missing
+        n = index_missing(conn)
+        print(f"✓ Indexed {n} patients for duplicate detection")
+    except Exception as e:
+        print(f"⚠ Could not index patients ({e}); run: python -m app.dedup index")
+
+
+def populate(conn, clear_existing=True):
+    """Fill every table through an open connection"""
+    if clear_existing:
+        print("\n📌 Clearing existing data...")
+        clear_all_data(conn)
+    
+    print("\n📌 Generating mock data...")
+    print()
+    
+    insert_test_categories(conn)
+    insert_tests(conn)
+    insert_panel_members(conn)
+    insert_reference_ranges(conn)
+    insert_patients(conn)
+    index_patient_keys(conn)
+    insert_doctors(conn)
+    insert_orders_and_results(conn)
+    insert_settings(conn)
+    bump_cache_versions(conn)
+    rebuild_revenue_aggregates(conn)
+
+
 def generate_mock_data(host='localhost', port=3306, user='root', password='', database='medlab_db', clear_existing=True):
     """
     Main function to generate all mock data
@@ -439,20 +551,7 @@ def generate_mock_data(host='localhost', port=3306, user='root', password='', da
         conn = get_db_connection(host, port, user, password, database)
         print(f"✓ Connected to database: {database}")
         
-        if clear_existing:
-            print("\n📌 Clearing existing data...")
-            clear_all_data(conn)
-        
-        print("\n📌 Generating mock data...")
-        print()
-        
-        insert_test_categories(conn)
-        insert_tests(conn)
-        insert_reference_ranges(conn)
-        insert_patients(conn)
-        insert_doctors(conn)
-        insert_orders_and_results(conn)
-        insert_settings(conn)
+        populate(conn, clear_existing)
         
         conn.close()
         
@@ -0,0 +1,455 @@
+"""
+Transactional outbox and background event dispatcher.
+
+Write handlers call emit(cur, ...) inside their own transaction, so an
+event row exists if and only if the change it describes committed. A
+Dispatcher thread per worker then:
+
+  1. claims a batch of due events (SELECT ... FOR UPDATE SKIP LOCKED, so
+     concurrent dispatchers never pick the same rows) and leases them by
+     pushing next_attempt_at OUTBOX_LEASE_SECONDS ahead, then commits;
+  2. delivers the batch to every sink outside any transaction;
+  3. marks the events DELIVERED, or schedules a retry with exponential
+     backoff for the sinks that failed (pending_sinks). After
+     OUTBOX_MAX_ATTEMPTS an event is parked as DEAD.
+
+A dispatcher that dies mid-batch leaves a lease that simply expires, so
+delivery is at-least-once: receivers dedupe on the event `id`. Handlers
+call notify() after commit to wake the local dispatcher at once; other
+workers' events are picked up within OUTBOX_POLL_MS.
+
+Sinks: WebhookSink (POST {"events": [...]} to OUTBOX_WEBHOOK_URLS),
+SpoolSink (JSON lines under OUTBOX_SPOOL_DIR) and in-process subscribers
+registered with subscribe(). With none of them (the default), or with
+OUTBOX_ENABLED=0, emit() records nothing: undeliverable rows would stay
+PENDING forever, as only delivered events are purged. To watch
+deliveries locally:
+
+    cd backend
+    python -m app.outbox stub --port 9100
+    OUTBOX_WEBHOOK_URLS=http://127.0.0.1:9100/events uvicorn app.main:app
+"""
+import argparse
+import logging
+import os
+import random
+import threading
+import time
+import urllib.request
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+import orjson
+
+from . import config
+from .metrics import Counter, Histogram, register
+
+logger = logging.getLogger("medlab.outbox")
+
+OUTBOX_DDL = """
+    CREATE TABLE IF NOT EXISTS event_outbox (
+        event_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        event_type VARCHAR(64) NOT NULL,
+        entity_type VARCHAR(32) NOT NULL,
+        entity_id INT NOT NULL,
+        payload JSON NOT NULL,
+        created_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+        status ENUM('PENDING','DELIVERED','DEAD') NOT NULL DEFAULT 'PENDING',
+        attempts INT NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+        pending_sinks JSON NULL,
+        last_error VARCHAR(500) NULL,
+        delivered_at TIMESTAMP(6) NULL,
+        INDEX idx_outbox_due (status, next_attempt_at)
+    )
+"""
+
+OUTBOX_DELIVERED = register(Counter(
+    "medlab_outbox_delivered_total",
+    "Outbox events delivered, by sink.",
+    ("sink",),
+))
+OUTBOX_FAILED = register(Counter(
+    "medlab_outbox_failed_total",
+    "Failed outbox delivery attempts, by sink.",
+    ("sink",),
+))
+OUTBOX_LAG = register(Histogram(
+    "medlab_outbox_delivery_lag_seconds",
+    "Time from event commit to successful delivery to every sink.",
+    (),
+    (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 30.0, 300.0),
+))
+
+
+def enabled() -> bool:
+    """Whether events are recorded: the outbox is on and has somewhere to deliver."""
+    if not config.OUTBOX_ENABLED:
+        return False
+    if config.OUTBOX_WEBHOOK_URLS or config.OUTBOX_SPOOL_DIR:
+        return True
+    return _dispatcher is not None and bool(_dispatcher.sinks)
+
+
+def emit(cur, event_type: str, entity_type: str, entity_id: int, data: dict):
+    """Queue an event as part of the caller's transaction."""
+    if not enabled():
+        return
+    cur.execute("""
+        INSERT INTO event_outbox (event_type, entity_type, entity_id, payload)
+        VALUES (%s, %s, %s, %s)
+    """, (event_type, entity_type, entity_id, orjson.dumps(data, default=str).decode()))
+
+
+def emit_many(cur, events: List[Tuple[str, str, int, dict]]):
+    """Queue many (event_type, entity_type, entity_id, data) in one statement."""
+    if not events or not enabled():
+        return
+    cur.executemany("""
+        INSERT INTO event_outbox (event_type, entity_type, entity_id, payload)
+        VALUES (%s, %s, %s, %s)
+    """, [
+        (event_type, entity_type, entity_id, orjson.dumps(data, default=str).decode())
+        for event_type, entity_type, entity_id, data in events
+    ])
+
+# ============================================================
+# SINKS
+# ============================================================
+
+
+class WebhookSink:
+    def __init__(self, url: str, timeout: float):
+        self.name = f"webhook:{url}"
+        self.url = url
+        self.timeout = timeout
+
+    def deliver(self, events: List[dict]):
+        req = urllib.request.Request(
+            self.url, data=orjson.dumps({"events": events}), method="POST",
+            headers={"Content-Type": "application/json"},
+        )
+        # Non-2xx raises HTTPError
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            resp.read()
+
+
+class SpoolSink:
+    """Appends one JSON line per event to <directory>/events-YYYYMMDD.jsonl."""
+
+    def __init__(self, directory: str):
+        self.name = "spool"
+        self.directory = directory
+
+    def deliver(self, events: List[dict]):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"events-{datetime.now():%Y%m%d}.jsonl")
+        with open(path, "ab") as f:
+            f.write(b"".join(orjson.dumps(e) + b"\n" for e in events))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class CallbackSink:
+    def __init__(self, name: str, callback: Callable[[List[dict]], None]):
+        self.name = f"subscriber:{name}"
+        self.callback = callback
+
+    def deliver(self, events: List[dict]):
+        self.callback(events)
+
+
+def configured_sinks() -> list:
+    sinks = [
+        WebhookSink(url, config.OUTBOX_WEBHOOK_TIMEOUT_MS / 1000.0)
+        for url in config.OUTBOX_WEBHOOK_URLS
+    ]
+    if config.OUTBOX_SPOOL_DIR:
+        sinks.append(SpoolSink(config.OUTBOX_SPOOL_DIR))
+    return sinks
+
+# ============================================================
+# DISPATCHER
+# ============================================================
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Delay before retry number `attempts` (1-based), with jitter."""
+    delay = min(
+        config.OUTBOX_BACKOFF_BASE_MS * 2 ** (attempts - 1), config.OUTBOX_BACKOFF_MAX_MS,
+    ) / 1000.0
+    return delay * random.uniform(0.5, 1.0)
+
+
+class Dispatcher:
+    PURGE_INTERVAL = 60.0
+
+    def __init__(self, connect: Callable, sinks: list, batch_size: int, interval: float):
+        self._connect = connect
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_purge = 0.0
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="medlab-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval * 2 + 1)
+
+    def notify(self):
+        self._wake.set()
+
+    def claim(self, conn) -> List[dict]:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT event_id, event_type, entity_type, entity_id, payload, created_at,
+                   attempts, pending_sinks, TIMESTAMPDIFF(MICROSECOND, created_at, NOW(6))
+            FROM event_outbox
+            WHERE status = 'PENDING' AND next_attempt_at <= NOW(6)
+            ORDER BY next_attempt_at, event_id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (self.batch_size,))
+        rows = cur.fetchall()
+        if rows:
+            fmt = ",".join(["%s"] * len(rows))
+            cur.execute(f"""
+                UPDATE event_outbox
+                SET next_attempt_at = NOW(6) + INTERVAL %s SECOND
+                WHERE event_id IN ({fmt})
+            """, (config.OUTBOX_LEASE_SECONDS, *[r[0] for r in rows]))
+        conn.commit()
+        cur.close()
+
+        claimed_at = time.monotonic()
+        return [{
+            "id": r[0],
+            "attempts": r[6],
+            "pending": orjson.loads(r[7]) if r[7] else None,
+            "claimed_at": claimed_at,
+            "age": r[8] / 1e6,
+            "message": {
+                "id": r[0],
+                "type": r[1],
+                "entity_type": r[2],
+                "entity_id": r[3],
+                "created_at": r[5],
+                "attempt": r[6] + 1,
+                "data": orjson.loads(r[4]),
+            },
+        } for r in rows]
+
+    def deliver(self, events: List[dict]):
+        """Sink names still failing per event id, and the last error of each."""
+        failed: Dict[int, List[str]] = {}
+        errors: Dict[int, str] = {}
+        for sink in self.sinks:
+            targets = [e for e in events if e["pending"] is None or sink.name in e["pending"]]
+            if not targets:
+                continue
+            try:
+                sink.deliver([e["message"] for e in targets])
+                OUTBOX_DELIVERED.inc(sink.name, amount=len(targets))
+            except Exception as ex:
+                OUTBOX_FAILED.inc(sink.name, amount=len(targets))
+                logger.warning("outbox delivery to %s failed: %s", sink.name, ex)
+                for e in targets:
+                    failed.setdefault(e["id"], []).append(sink.name)
+                    errors[e["id"]] = f"{sink.name}: {ex}"[:500]
+        return failed, errors
+
+    def settle(self, conn, events: List[dict], failed: Dict[int, List[str]], errors: Dict[int, str]):
+        cur = conn.cursor()
+        delivered = [e for e in events if e["id"] not in failed]
+        if delivered:
+            fmt = ",".join(["%s"] * len(delivered))
+            cur.execute(f"""
+                UPDATE event_outbox
+                SET status = 'DELIVERED', delivered_at = NOW(6), pending_sinks = NULL
+                WHERE event_id IN ({fmt})
+            """, tuple(e["id"] for e in delivered))
+            now = time.monotonic()
+            for e in delivered:
+                OUTBOX_LAG.observe(e["age"] + now - e["claimed_at"])
+
+        for e in events:
+            if e["id"] not in failed:
+                continue
+            attempts = e["attempts"] + 1
+            # `attempts` on the right of status is the incremented value
+            cur.execute("""
+                UPDATE event_outbox
+                SET attempts = attempts + 1,
+                    status = IF(attempts >= %s, 'DEAD', 'PENDING'),
+                    pending_sinks = %s,
+                    last_error = %s,
+                    next_attempt_at = NOW(6) + INTERVAL %s MICROSECOND
+                WHERE event_id = %s
+            """, (
+                config.OUTBOX_MAX_ATTEMPTS, orjson.dumps(failed[e["id"]]).decode(),
+                errors[e["id"]], int(backoff_seconds(attempts) * 1e6), e["id"],
+            ))
+        conn.commit()
+        cur.close()
+
+    def run_once(self, conn) -> int:
+        """Claim, deliver and settle one batch; returns the batch size."""
+        if not self.sinks:
+            return 0
+        events = self.claim(conn)
+        if events:
+            failed, errors = self.deliver(events)
+            self.settle(conn, events, failed, errors)
+        return len(events)
+
+    def purge(self, conn):
+        cur = conn.cursor()
+        cur.execute("""
+            DELETE FROM event_outbox
+            WHERE status = 'DELIVERED' AND delivered_at < NOW(6) - INTERVAL %s HOUR
+            LIMIT 5000
+        """, (config.OUTBOX_RETENTION_HOURS,))
+        conn.commit()
+        cur.close()
+
+    def _run(self):
+        conn = None
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                if conn is None:
+                    conn = self._connect()
+                # Drain: a full batch means more are probably due
+                while not self._stop.is_set() and self.run_once(conn) == self.batch_size:
+                    pass
+                if time.monotonic() - self._last_purge > self.PURGE_INTERVAL:
+                    self._last_purge = time.monotonic()
+                    self.purge(conn)
+            except Exception as e:
+                logger.warning("outbox dispatch failed: %s", e)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+        if conn is not None:
+            conn.close()
+
+
+_dispatcher: Optional[Dispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def _get_dispatcher(connect: Optional[Callable] = None) -> Dispatcher:
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = Dispatcher(
+                connect, configured_sinks(), config.OUTBOX_BATCH_SIZE, config.OUTBOX_POLL_MS / 1000.0,
+            )
+        elif connect is not None:
+            _dispatcher._connect = connect
+        return _dispatcher
+
+
+def subscribe(name: str, callback: Callable[[List[dict]], None]):
+    """
+    Deliver events to `callback(events)` in this process. An exception
+    from the callback counts as a failed delivery and is retried.
+    """
+    _get_dispatcher().sinks.append(CallbackSink(name, callback))
+
+
+def start_dispatcher(connect: Callable):
+    if config.OUTBOX_ENABLED:
+        _get_dispatcher(connect).start()
+
+
+def stop_dispatcher():
+    if _dispatcher is not None:
+        _dispatcher.stop()
+
+
+def notify():
+    """Wake this worker's dispatcher after committing events."""
+    if _dispatcher is not None:
+        _dispatcher.notify()
+
+# ============================================================
+# CLI
+# ============================================================
+
+
+def _serve_stub(port: int):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = orjson.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+            for e in body.get("events", []):
+                print(f"{datetime.now():%H:%M:%S.%f} #{e['id']} {e['type']} "
+                      f"{e['entity_type']} {e['entity_id']} (attempt {e['attempt']})", flush=True)
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    print(f"Webhook stub listening on http://127.0.0.1:{port}/events")
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Outbox event dispatcher")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    stub = sub.add_parser("stub", help="run a local webhook receiver that prints events")
+    stub.add_argument("--port", type=int, default=9100)
+    sub.add_parser("dispatch", help="run the dispatcher in the foreground")
+    sub.add_parser("retry-dead", help="requeue events that exhausted their attempts")
+    args = ap.parse_args()
+
+    if args.cmd == "stub":
+        _serve_stub(args.port)
+        return
+
+    from .db import get_db_connection
+
+    if args.cmd == "retry-dead":
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE event_outbox
+            SET status = 'PENDING', attempts = 0, next_attempt_at = NOW(6)
+            WHERE status = 'DEAD'
+        """)
+        conn.commit()
+        print(f"✓ Requeued {cur.rowcount} events")
+        conn.close()
+        return
+
+    dispatcher = _get_dispatcher(get_db_connection)
+    if not dispatcher.sinks:
+        ap.error("no sinks configured (OUTBOX_WEBHOOK_URLS / OUTBOX_SPOOL_DIR)")
+    print(f"Dispatching to {', '.join(s.name for s in dispatcher.sinks)}")
+    dispatcher.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        dispatcher.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Test panels (profiles) and set-based order line creation.
+
+A panel is an ordinary row in `tests` (e.g. "Lipid Profile") whose
+components are listed in `test_panel_members`. Ordering a panel creates
+the billed panel line plus one zero-priced line per component, tagged
+with panel_test_id, so results are entered per component. Panels are not
+nested: a component that is itself a panel is not expanded again.
+
+All lines of an order are written with two INSERT ... SELECT statements
+(ordered tests, then panel components) regardless of how many tests were
+selected.
+"""
+from typing import Dict, List, Sequence
+
+PANEL_MEMBERS_DDL = """
+    CREATE TABLE IF NOT EXISTS test_panel_members (
+        panel_test_id INT NOT NULL,
+        component_test_id INT NOT NULL,
+        sort_order INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (panel_test_id, component_test_id),
+        INDEX idx_panel_component (component_test_id),
+        FOREIGN KEY (panel_test_id) REFERENCES tests(test_id) ON DELETE CASCADE,
+        FOREIGN KEY (component_test_id) REFERENCES tests(test_id) ON DELETE CASCADE
+    )
+"""
+
+
+def _trim_decimal(col: str) -> str:
+    # DECIMAL(10,2) without trailing zeros: 13.00 -> 13, 0.30 -> 0.3
+    return f"TRIM(TRAILING '.' FROM TRIM(TRAILING '0' FROM {col}))"
+
+
+# "min - max unit" from the first gender-neutral reference range, as
+# create_order() has always formatted normal_range_text.
+_RANGE_JOIN = """
+    LEFT JOIN test_reference_ranges r ON r.range_id = (
+        SELECT MIN(rr.range_id) FROM test_reference_ranges rr
+        WHERE rr.test_id = t.test_id AND rr.gender = 'ANY'
+    )
+"""
+_RANGE_TEXT = f"""
+    CASE WHEN r.normal_min IS NULL OR r.normal_max IS NULL THEN NULL
+    ELSE CONCAT(
+        {_trim_decimal('r.normal_min')}, ' - ', {_trim_decimal('r.normal_max')},
+        IF(COALESCE(NULLIF(r.unit, ''), t.unit, '') = '', '',
+           CONCAT(' ', COALESCE(NULLIF(r.unit, ''), t.unit)))
+    ) END
+"""
+
+_LINE_COLUMNS = "(order_id, test_id, unit, normal_range_text, test_name, price, panel_test_id)"
+
+
+def insert_order_lines(cur, order_id: int, test_ids: Sequence[int]) -> int:
+    """
+    Create the test_order_tests rows for a new order: one per distinct
+    ordered test (price snapshotted) and one per panel component not
+    ordered directly. Returns the number of lines written.
+    """
+    ids = list(dict.fromkeys(test_ids))
+    ids_fmt = ",".join(["%s"] * len(ids))
+
+    cur.execute(f"""
+        INSERT INTO test_order_tests {_LINE_COLUMNS}
+        SELECT %s, t.test_id, t.unit, {_RANGE_TEXT}, t.test_name, t.price, NULL
+        FROM tests t
+        {_RANGE_JOIN}
+        WHERE t.test_id IN ({ids_fmt})
+        ORDER BY FIELD(t.test_id, {ids_fmt})
+    """, (order_id, *ids, *ids))
+    lines = cur.rowcount
+
+    # A component shared by two ordered panels is performed once.
+    cur.execute(f"""
+        INSERT INTO test_order_tests {_LINE_COLUMNS}
+        SELECT %s, t.test_id, t.unit, {_RANGE_TEXT}, t.test_name, 0, c.panel_test_id
+        FROM (
+            SELECT component_test_id, MIN(panel_test_id) AS panel_test_id, MIN(sort_order) AS sort_order
+            FROM test_panel_members
+            WHERE panel_test_id IN ({ids_fmt}) AND component_test_id NOT IN ({ids_fmt})
+            GROUP BY component_test_id
+        ) c
+        JOIN tests t ON t.test_id = c.component_test_id
+        {_RANGE_JOIN}
+        ORDER BY FIELD(c.panel_test_id, {ids_fmt}), c.sort_order
+    """, (order_id, *ids, *ids, *ids))
+    return lines + cur.rowcount
+
+
+def load_components(cur) -> Dict[int, List[dict]]:
+    """panel test_id -> ordered list of {test_id, test_name, unit}."""
+    cur.execute("""
+        SELECT m.panel_test_id, t.test_id, t.test_name, t.unit
+        FROM test_panel_members m
+        JOIN tests t ON t.test_id = m.component_test_id
+        ORDER BY m.panel_test_id, m.sort_order, t.test_name
+    """)
+    panels: Dict[int, List[dict]] = {}
+    for panel_id, test_id, test_name, unit in cur.fetchall():
+        panels.setdefault(panel_id, []).append(
+            {"test_id": test_id, "test_name": test_name, "unit": unit}
+        )
+    return panels
+
+
+def set_components(cur, panel_test_id: int, component_ids: Sequence[int]):
+    """
+    Replace a panel's components. Raises ValueError for self-references,
+    unknown tests and nesting (panel inside a panel).
+    """
+    ids = list(dict.fromkeys(component_ids))
+    if panel_test_id in ids:
+        raise ValueError("A panel cannot contain itself")
+
+    if ids:
+        ids_fmt = ",".join(["%s"] * len(ids))
+        cur.execute(f"SELECT COUNT(*) FROM tests WHERE test_id IN ({ids_fmt})", tuple(ids))
+        if cur.fetchone()[0] != len(ids):
+            raise ValueError("Unknown component test id")
+        cur.execute(f"""
+            SELECT COUNT(*) FROM test_panel_members
+            WHERE panel_test_id IN ({ids_fmt}) OR component_test_id = %s
+        """, (*ids, panel_test_id))
+        if cur.fetchone()[0]:
+            raise ValueError("Panels cannot be nested")
+
+    cur.execute("DELETE FROM test_panel_members WHERE panel_test_id=%s", (panel_test_id,))
+    if ids:
+        cur.executemany("""
+            INSERT INTO test_panel_members (panel_test_id, component_test_id, sort_order)
+            VALUES (%s, %s, %s)
+        """, [(panel_test_id, cid, i) for i, cid in enumerate(ids)])
@@ -0,0 +1,113 @@
+"""
+Minimal PDF writer: text and rules on A4 pages with the built-in
+Helvetica fonts, no external dependencies.
+
+    doc = PdfDocument()
+    page = doc.add_page()
+    page.text(50, 800, "Hello", size=14, bold=True)
+    page.line(50, 790, 545, 790)
+    data = doc.to_bytes()
+
+Coordinates are PDF points from the bottom-left corner. Text is encoded
+as WinAnsi (cp1252), which covers the lab's units (µ, °); anything else
+is replaced with "?". Content streams are Flate-compressed.
+"""
+import zlib
+from typing import List
+
+A4 = (595, 842)
+
+# Average Helvetica glyph width as a fraction of the font size, for
+# truncating text to a column without per-glyph metrics.
+AVG_CHAR_WIDTH = 0.52
+
+
+def _escape(text: str) -> bytes:
+    raw = str(text).encode("cp1252", errors="replace")
+    return raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def fit(text, width: float, size: float) -> str:
+    """Truncate `text` with an ellipsis to roughly fit `width` points."""
+    text = "" if text is None else str(text)
+    max_chars = int(width / (size * AVG_CHAR_WIDTH))
+    if len(text) <= max_chars:
+        return text
+    return text[:max(max_chars - 3, 0)] + "..."
+
+
+class PdfPage:
+    def __init__(self, width: float, height: float):
+        self.width = width
+        self.height = height
+        self._ops: List[bytes] = []
+
+    def text(self, x: float, y: float, text, size: float = 10, bold: bool = False,
+             gray: float = 0.0):
+        font = b"/F2" if bold else b"/F1"
+        self._ops.append(
+            b"BT %s %.2f Tf %.3f g %.2f %.2f Td (%s) Tj ET"
+            % (font, size, gray, x, y, _escape(text))
+        )
+
+    def line(self, x1: float, y1: float, x2: float, y2: float, width: float = 0.5,
+             gray: float = 0.0):
+        self._ops.append(
+            b"%.3f G %.2f w %.2f %.2f m %.2f %.2f l S" % (gray, width, x1, y1, x2, y2)
+        )
+
+    def rect(self, x: float, y: float, w: float, h: float, gray: float = 0.9):
+        self._ops.append(b"%.3f g %.2f %.2f %.2f %.2f re f" % (gray, x, y, w, h))
+
+    def content(self) -> bytes:
+        return b"\n".join(self._ops)
+
+
+class PdfDocument:
+    def __init__(self, title: str = ""):
+        self.title = title
+        self.pages: List[PdfPage] = []
+
+    def add_page(self, size=A4) -> PdfPage:
+        page = PdfPage(*size)
+        self.pages.append(page)
+        return page
+
+    def to_bytes(self) -> bytes:
+        # Fixed object numbers: 1 catalog, 2 page tree, 3/4 fonts, 5 info,
+        # then a (page, content) pair per page.
+        objects = {
+            3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+            4: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+            5: b"<< /Title (%s) /Producer (MedLAB+) >>" % _escape(self.title),
+        }
+        kids = []
+        for i, page in enumerate(self.pages):
+            page_no, content_no = 6 + 2 * i, 7 + 2 * i
+            kids.append(b"%d 0 R" % page_no)
+            objects[page_no] = (
+                b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+                b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>"
+                % (page.width, page.height, content_no)
+            )
+            stream = zlib.compress(page.content(), 6)
+            objects[content_no] = (
+                b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream"
+                % (len(stream), stream)
+            )
+        objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+        objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+
+        out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = {}
+        for no in sorted(objects):
+            offsets[no] = len(out)
+            out += b"%d 0 obj\n%s\nendobj\n" % (no, objects[no])
+
+        size = max(objects) + 1
+        xref = len(out)
+        out += b"xref\n0 %d\n0000000000 65535 f \n" % size
+        for no in range(1, size):
+            out += b"%010d 00000 n \n" % offsets[no]
+        out += b"trailer\n<< /Size %d /Root 1 0 R /Info 5 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref)
+        return bytes(out)
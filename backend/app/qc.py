@@ -0,0 +1,228 @@
+"""
+Population statistics per test for lab QC (analyzer drift detection).
+
+Result values for a window are streamed from MySQL in chunks into NumPy
+arrays, and mean, SD, percentiles, histograms and LOW/HIGH rates are
+computed for every test (and optional gender / age-band stratum) at
+once: one sort plus a handful of bincount passes, no per-test Python
+loop. The window scan reads only the covering index
+
+    idx_tot_qc (result_entered_at, test_id, result_value, result_flag, order_id)
+
+and joins orders/patients only when stratifying. Computed windows are
+cached for QC_CACHE_TTL_SECONDS, keyed by window and options, and dropped
+early when patients are merged.
+"""
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from . import config, invalidation
+from .cache import LocalCache
+
+QC_INDEX_DDL = """
+    CREATE INDEX idx_tot_qc
+    ON test_order_tests (result_entered_at, test_id, result_value, result_flag, order_id)
+"""
+
+STRATA = ("gender", "age")
+PERCENTILES = (5, 25, 50, 75, 95)
+
+GENDER_LABELS = ("unknown", "male", "female", "other")
+# Lower bounds of the age bands; ages below 0 (no date of birth) are "unknown"
+AGE_BAND_STARTS = np.array([0, 18, 40, 60])
+AGE_BAND_LABELS = ("0-17", "18-39", "40-59", "60+", "unknown")
+
+qc_cache = LocalCache("qc_stats", [invalidation.PATIENTS], ttl=config.QC_CACHE_TTL_SECONDS,
+                      max_entries=config.QC_CACHE_MAX_ENTRIES)
+
+
+def parse_strata(stratify: Optional[str]) -> List[str]:
+    dims = [d.strip().lower() for d in (stratify or "").split(",") if d.strip()]
+    unknown = [d for d in dims if d not in STRATA]
+    if unknown:
+        raise ValueError(f"Unknown stratify dimension(s): {', '.join(unknown)}")
+    return [d for d in STRATA if d in dims]
+
+# ============================================================
+# LOADING
+# ============================================================
+
+
+def load_window(cur, date_from: date, date_to: date, test_ids: Optional[Sequence[int]] = None,
+                strata: Sequence[str] = (), chunk_size: Optional[int] = None) -> np.ndarray:
+    """
+    Fetch (test_id, value, flag, gender, age) rows for results entered in
+    [date_from, date_to] as a float64 array, chunk by chunk. flag is
+    -1/0/1 for LOW/NORMAL/HIGH (0 when unflagged), gender indexes
+    GENDER_LABELS, age is -1 when unknown.
+    """
+    select = [
+        "tot.test_id",
+        "tot.result_value + 0e0",
+        "CASE tot.result_flag WHEN 'LOW' THEN -1 WHEN 'HIGH' THEN 1 ELSE 0 END",
+    ]
+    joins = ""
+    if strata:
+        select.append("CASE p.gender WHEN 'M' THEN 1 WHEN 'F' THEN 2 WHEN 'O' THEN 3 ELSE 0 END")
+        select.append("COALESCE(TIMESTAMPDIFF(YEAR, p.date_of_birth, CURDATE()), -1)")
+        joins = """
+            JOIN test_orders o ON o.order_id = tot.order_id
+            JOIN patients p ON p.patient_id = o.patient_id
+        """
+    else:
+        select += ["0", "-1"]
+
+    where = [
+        "tot.result_entered_at >= %s",
+        "tot.result_entered_at < %s",
+        "tot.result_value IS NOT NULL",
+    ]
+    params: list = [date_from, date_to + timedelta(days=1)]
+    if test_ids:
+        where.append(f"tot.test_id IN ({','.join(['%s'] * len(test_ids))})")
+        params += list(test_ids)
+
+    cur.execute(f"""
+        SELECT {', '.join(select)}
+        FROM test_order_tests tot FORCE INDEX (idx_tot_qc)
+        {joins}
+        WHERE {' AND '.join(where)}
+    """, tuple(params))
+
+    chunk_size = chunk_size or config.QC_CHUNK_SIZE
+    parts = []
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        parts.append(np.array(rows, dtype=np.float64))
+    if not parts:
+        return np.empty((0, 5))
+    return np.concatenate(parts)
+
+# ============================================================
+# VECTORIZED STATISTICS
+# ============================================================
+
+
+def group_stats(keys: np.ndarray, values: np.ndarray, flags: np.ndarray, n_groups: int,
+                bins: int = 20, percentiles: Sequence[float] = PERCENTILES) -> Dict[str, np.ndarray]:
+    """
+    Statistics of `values` (non-empty) for each group 0..n_groups-1 given
+    by `keys`. Every output is an array indexed by group; groups without
+    values have count 0 and NaN statistics.
+    """
+    counts = np.bincount(keys, minlength=n_groups)
+    has = counts > 0
+    n = np.where(has, counts, 1)
+
+    mean = np.bincount(keys, weights=values, minlength=n_groups) / n
+    sq = np.bincount(keys, weights=(values - mean[keys]) ** 2, minlength=n_groups)
+    sd = np.where(counts > 1, np.sqrt(sq / np.maximum(counts - 1, 1)), np.nan)
+    low = np.bincount(keys, weights=flags < 0, minlength=n_groups) / n
+    high = np.bincount(keys, weights=flags > 0, minlength=n_groups) / n
+
+    # Sort by (group, value) once; each group is then a contiguous run.
+    order = np.lexsort((values, keys))
+    sv = values[order]
+    starts = np.cumsum(counts) - counts
+    last = starts + np.maximum(counts - 1, 0)
+    end = len(sv) - 1
+    vmin = np.where(has, sv[np.minimum(starts, end)], np.nan)
+    vmax = np.where(has, sv[np.minimum(last, end)], np.nan)
+
+    # Linear interpolation between closest ranks (numpy's default method)
+    pct = {}
+    for q in percentiles:
+        pos = starts + (q / 100.0) * (counts - 1).clip(min=0)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.minimum(np.minimum(lo + 1, last), end)
+        lo = np.minimum(lo, end)
+        pct[q] = np.where(has, sv[lo] + (sv[hi] - sv[lo]) * (pos - lo), np.nan)
+
+    # Equal-width histogram between each group's min and max
+    width = np.where(has, (vmax - vmin) / bins, 0.0)
+    safe = np.where(width > 0, width, 1.0)
+    idx = ((values - vmin[keys]) / safe[keys]).astype(np.int64).clip(0, bins - 1)
+    hist = np.bincount(keys * bins + idx, minlength=n_groups * bins).reshape(n_groups, bins)
+
+    return {
+        "count": counts, "mean": np.where(has, mean, np.nan), "sd": sd,
+        "min": vmin, "max": vmax, "low_rate": low, "high_rate": high,
+        "percentiles": pct, "bin_width": width, "histogram": hist,
+    }
+
+
+def _num(x):
+    x = float(x)
+    return None if np.isnan(x) else round(x, 4)
+
+
+def compute(data: np.ndarray, strata: Sequence[str] = (), bins: int = 20) -> List[dict]:
+    """One row of statistics per (test, stratum) present in `data`."""
+    if not len(data):
+        return []
+
+    test_ids, test_idx = np.unique(data[:, 0].astype(np.int64), return_inverse=True)
+    values, flags = data[:, 1], data[:, 2]
+
+    n_gender = len(GENDER_LABELS) if "gender" in strata else 1
+    n_age = len(AGE_BAND_LABELS) if "age" in strata else 1
+    gender = data[:, 3].astype(np.int64) if "gender" in strata else 0
+    if "age" in strata:
+        age = data[:, 4]
+        band = np.searchsorted(AGE_BAND_STARTS, age, side="right") - 1
+        age_band = np.where(age < 0, len(AGE_BAND_LABELS) - 1, band)
+    else:
+        age_band = 0
+
+    keys = (test_idx * n_gender + gender) * n_age + age_band
+    n_groups = len(test_ids) * n_gender * n_age
+    s = group_stats(keys, values, flags, n_groups, bins)
+
+    rows = []
+    for g in np.flatnonzero(s["count"]):
+        t, rest = divmod(int(g), n_gender * n_age)
+        gi, ai = divmod(rest, n_age)
+        row = {"test_id": int(test_ids[t])}
+        if "gender" in strata:
+            row["gender"] = GENDER_LABELS[gi]
+        if "age" in strata:
+            row["age_band"] = AGE_BAND_LABELS[ai]
+        row.update({
+            "count": int(s["count"][g]),
+            "mean": _num(s["mean"][g]),
+            "sd": _num(s["sd"][g]),
+            "min": _num(s["min"][g]),
+            "max": _num(s["max"][g]),
+            "percentiles": {f"p{q}": _num(v[g]) for q, v in s["percentiles"].items()},
+            "low_rate": _num(s["low_rate"][g]),
+            "high_rate": _num(s["high_rate"][g]),
+            "histogram": {
+                "start": _num(s["min"][g]),
+                "bin_width": _num(s["bin_width"][g]),
+                "counts": s["histogram"][g].tolist(),
+            },
+        })
+        rows.append(row)
+    return rows
+
+
+def window_stats(connect, date_from: date, date_to: date, test_ids: Optional[Sequence[int]] = None,
+                 strata: Sequence[str] = (), bins: int = 20) -> List[dict]:
+    """Cached statistics for a window; `connect` opens a (read) connection."""
+    key = (date_from, date_to, tuple(sorted(test_ids or ())), tuple(strata), bins)
+
+    def load():
+        conn = connect()
+        try:
+            cur = conn.cursor()
+            data = load_window(cur, date_from, date_to, test_ids, strata)
+            cur.close()
+        finally:
+            conn.close()
+        return compute(data, strata, bins)
+
+    return qc_cache.get_or_load(key, load)
@@ -0,0 +1,379 @@
+"""
+Server-side PDF lab reports.
+
+A report is rendered from a plain dict (order header, lines with results,
+lab settings) by render_report() in a process pool, so layout work never
+holds the GIL of the API workers. PDFs are cached on disk under
+REPORT_CACHE_DIR, content-addressed by a SHA-256 of exactly that dict plus
+RENDERER_VERSION: a reprint is a file read, and any result, line or
+settings edit produces a new key, so stale reports are never served.
+Keys nobody asks for any more are removed by prune_cache().
+"""
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from itertools import zip_longest
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+
+from . import archive, config, metrics
+from .pdf import PdfDocument, fit
+
+# Bump when the layout changes so cached PDFs are re-rendered.
+RENDERER_VERSION = 3
+
+_ORDER_SQL = """
+    SELECT
+        o.order_id, o.accession_no, o.order_date, o.priority, o.status, o.notes,
+        o.sample_collected_at, o.report_ready_at,
+        p.patient_id, p.full_name AS patient_name, p.date_of_birth AS patient_dob,
+        p.gender AS patient_gender, p.phone AS patient_phone,
+        d.full_name AS doctor_name
+    FROM test_orders o
+    JOIN patients p ON p.patient_id = o.patient_id
+    LEFT JOIN doctors d ON d.doctor_id = o.doctor_id
+"""
+
+_LINES_SQL = """
+    SELECT order_id, test_id, test_name, unit, normal_range_text,
+           result_value, result_text, result_flag, panel_test_id
+    FROM test_order_tests
+"""
+
+# ============================================================
+# DATA
+# ============================================================
+
+
+def _rows(cur) -> List[dict]:
+    cols = [c[0] for c in cur.description]
+    return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+def _assemble(order: dict, lines: List[dict], settings: Dict[str, str]) -> dict:
+    return {"order": order, "lines": lines, "settings": dict(sorted(settings.items()))}
+
+
+_ORDER_KEYS = (
+    "order_id", "accession_no", "order_date", "priority", "status", "notes",
+    "sample_collected_at", "report_ready_at", "patient_id", "patient_name",
+    "patient_dob", "patient_gender", "patient_phone", "doctor_name",
+)
+_ORDER_DATETIMES = ("order_date", "sample_collected_at", "report_ready_at")
+
+
+def _load_archived(cur, order_id: int, settings: Dict[str, str]) -> Optional[dict]:
+    """
+    Report data for an order moved to the archive, with the same types as
+    the hot tables return, so the report (and its cache key) is unchanged.
+    """
+    archived = archive.get_order(cur, order_id)
+    if archived is None:
+        return None
+    order = {k: archived.get(k) for k in _ORDER_KEYS}
+    for k in _ORDER_DATETIMES:  # ISO strings in the archive document
+        if isinstance(order[k], str):
+            order[k] = datetime.fromisoformat(order[k])
+    lines = [{
+        "order_id": order_id,
+        "test_id": t["test_id"],
+        "test_name": t["test_name"],
+        "unit": t["unit"],
+        "normal_range_text": t["normal_range_text"],
+        "result_value": None if t["result_value"] is None else Decimal(str(t["result_value"])),
+        "result_text": t["result_text"],
+        "result_flag": t["result_flag"].upper() if t["result_flag"] else None,
+        "panel_test_id": t["panel_test_id"],
+    } for t in archived["tests"]]
+    return _assemble(order, lines, settings)
+
+
+def load_report_data(cur, order_id: int, settings: Dict[str, str]) -> Optional[dict]:
+    cur.execute(_ORDER_SQL + " WHERE o.order_id = %s", (order_id,))
+    orders = _rows(cur)
+    if not orders:
+        return _load_archived(cur, order_id, settings)
+    cur.execute(_LINES_SQL + " WHERE order_id = %s ORDER BY id", (order_id,))
+    return _assemble(orders[0], _rows(cur), settings)
+
+
+def load_reports_data(cur, order_ids: List[int], settings: Dict[str, str]) -> List[dict]:
+    """
+    Report data for many orders in two queries, in `order_ids` order;
+    orders archived in the meantime are read from the archive one by one.
+    """
+    if not order_ids:
+        return []
+    fmt = ",".join(["%s"] * len(order_ids))
+    cur.execute(_ORDER_SQL + f" WHERE o.order_id IN ({fmt})", tuple(order_ids))
+    orders = {o["order_id"]: o for o in _rows(cur)}
+    cur.execute(_LINES_SQL + f" WHERE order_id IN ({fmt}) ORDER BY id", tuple(order_ids))
+    lines: Dict[int, List[dict]] = {}
+    for line in _rows(cur):
+        lines.setdefault(line["order_id"], []).append(line)
+    result = []
+    for oid in order_ids:
+        data = (_assemble(orders[oid], lines.get(oid, []), settings) if oid in orders
+                else _load_archived(cur, oid, settings))
+        if data is not None:
+            result.append(data)
+    return result
+
+
+def report_key(data: dict) -> str:
+    body = orjson.dumps(
+        [RENDERER_VERSION, data], option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str,
+    )
+    return hashlib.sha256(body).hexdigest()
+
+# ============================================================
+# RENDERING (runs in worker processes)
+# ============================================================
+
+_MARGIN = 50
+_COLUMNS = (  # title, x, width
+    ("Test", 50, 190),
+    ("Result", 245, 80),
+    ("Unit", 330, 60),
+    ("Reference Range", 395, 110),
+    ("Flag", 510, 40),
+)
+
+
+def _fmt_date(v, with_time=False):
+    if v is None:
+        return "-"
+    if isinstance(v, str):
+        return v
+    return v.strftime("%d %b %Y %H:%M" if with_time and isinstance(v, datetime) else "%d %b %Y")
+
+
+def _fmt_value(line):
+    if line["result_value"] is not None:
+        return ("%f" % line["result_value"]).rstrip("0").rstrip(".")
+    return line["result_text"] or ""
+
+
+def _age(dob, on):
+    if dob is None or on is None:
+        return None
+    on = on.date() if isinstance(on, datetime) else on
+    return on.year - dob.year - ((on.month, on.day) < (dob.month, dob.day))
+
+
+def render_report(data: dict) -> bytes:
+    order, lines, settings = data["order"], data["lines"], data["settings"]
+    doc = PdfDocument(title=f"Lab report #{order['order_id']}")
+    width, height = 595, 842
+    right = width - _MARGIN
+
+    def header(page):
+        y = height - _MARGIN
+        page.text(_MARGIN, y, settings.get("lab_name") or "MedLAB+", size=16, bold=True)
+        y -= 14
+        contact = " | ".join(
+            v for v in (settings.get("lab_phone"), settings.get("lab_email")) if v
+        )
+        for text in (settings.get("lab_address"), contact, settings.get("report_header")):
+            if text:
+                page.text(_MARGIN, y, fit(text, right - _MARGIN, 8), size=8, gray=0.3)
+                y -= 10
+        if settings.get("lab_license"):
+            page.text(_MARGIN, y, f"License: {settings['lab_license']}", size=8, gray=0.3)
+            y -= 10
+        page.line(_MARGIN, y, right, y, width=1)
+        return y - 16
+
+    def patient_block(page, y):
+        gender = {"M": "Male", "F": "Female", "O": "Other"}.get(order["patient_gender"], "-")
+        age = _age(order["patient_dob"], order["order_date"])
+        left = [
+            ("Patient", order["patient_name"]),
+            ("Age / Gender", f"{age if age is not None else '-'} / {gender}"),
+            ("Referred by", order["doctor_name"] or "Self"),
+        ]
+        right_col = [
+            ("Order #", str(order["order_id"])),
+            ("Accession", order.get("accession_no") or "-"),
+            ("Ordered", _fmt_date(order["order_date"], True)),
+            ("Reported", _fmt_date(order["report_ready_at"], True)),
+        ]
+        for row in zip_longest(left, right_col):
+            if row[0]:
+                page.text(_MARGIN, y, row[0][0], size=9, bold=True)
+                page.text(_MARGIN + 75, y, fit(row[0][1], 180, 9), size=9)
+            if row[1]:
+                page.text(330, y, row[1][0], size=9, bold=True)
+                page.text(400, y, fit(row[1][1], 145, 9), size=9)
+            y -= 13
+        if order["priority"] == "URGENT":
+            page.text(_MARGIN, y, "URGENT", size=9, bold=True)
+            y -= 13
+        if order["status"] != "REPORT_READY":
+            page.text(_MARGIN, y, "PRELIMINARY REPORT - not all results are final",
+                      size=9, bold=True, gray=0.4)
+            y -= 13
+        return y - 6
+
+    def table_header(page, y):
+        page.rect(_MARGIN, y - 4, right - _MARGIN, 16)
+        for title, x, _ in _COLUMNS:
+            page.text(x + 2, y, title, size=9, bold=True)
+        return y - 18
+
+    pages = []
+    page = doc.add_page()
+    pages.append(page)
+    y = table_header(page, patient_block(page, header(page)))
+
+    for line in lines:
+        if y < _MARGIN + 40:
+            page = doc.add_page()
+            pages.append(page)
+            y = table_header(page, header(page))
+        flag = line["result_flag"]
+        abnormal = flag in ("LOW", "HIGH")
+        indent = 10 if line["panel_test_id"] else 0
+        cells = (
+            line["test_name"] or f"Test {line['test_id']}",
+            _fmt_value(line),
+            line["unit"] or "",
+            line["normal_range_text"] or "",
+            {"LOW": "L", "HIGH": "H"}.get(flag, ""),
+        )
+        for (_, x, w), value in zip(_COLUMNS, cells):
+            bold = abnormal and x != _COLUMNS[0][1]
+            xi = x + 2 + (indent if x == _COLUMNS[0][1] else 0)
+            page.text(xi, y, fit(value, w - indent, 9), size=9, bold=bold)
+        y -= 14
+
+    if order["notes"]:
+        y -= 6
+        page.text(_MARGIN, y, fit(f"Notes: {order['notes']}", right - _MARGIN, 9), size=9)
+
+    footer = settings.get("report_footer") or ""
+    for i, p in enumerate(pages, 1):
+        p.line(_MARGIN, _MARGIN + 12, right, _MARGIN + 12, gray=0.5)
+        if footer:
+            p.text(_MARGIN, _MARGIN, fit(footer, 400, 7), size=7, gray=0.4)
+        p.text(right - 50, _MARGIN, f"Page {i} of {len(pages)}", size=7, gray=0.4)
+
+    return doc.to_bytes()
+
+# ============================================================
+# CACHE + POOL
+# ============================================================
+
+
+def cache_path(key: str) -> str:
+    return os.path.join(config.REPORT_CACHE_DIR, key[:2], key + ".pdf")
+
+
+def read_cached(key: str) -> Optional[bytes]:
+    path = cache_path(key)
+    try:
+        with open(path, "rb") as f:
+            pdf = f.read()
+    except FileNotFoundError:
+        return None
+    try:
+        os.utime(path)  # mtime = last use, for prune_cache()
+    except OSError:
+        pass
+    return pdf
+
+
+def write_cached(key: str, pdf: bytes) -> str:
+    path = cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(pdf)
+    # Atomic: concurrent renders of the same key write identical bytes
+    os.replace(tmp, path)
+    return path
+
+
+def prune_cache(max_age_days: Optional[int] = None, max_mb: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Delete cached PDFs not used for `max_age_days`, then the least recently
+    used ones until the cache is under `max_mb`, plus leftover temp files.
+    Returns (files removed, bytes freed).
+    """
+    max_age_days = config.REPORT_CACHE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    max_bytes = (config.REPORT_CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+    cutoff = time.time() - max_age_days * 86400
+    # A temp file this old belongs to a render that died mid-write
+    tmp_cutoff = time.time() - 3600
+
+    entries = []
+    for root, _, files in os.walk(config.REPORT_CACHE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path, name.endswith(".tmp")))
+
+    entries.sort()
+    total = sum(e[1] for e in entries if not e[3])
+    removed = freed = 0
+    for mtime, size, path, is_tmp in entries:
+        if is_tmp:
+            if mtime >= tmp_cutoff:
+                continue
+        elif mtime >= cutoff and total <= max_bytes:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        if not is_tmp:
+            total -= size
+        removed += 1
+        freed += size
+    return removed, freed
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: workers import only this module, not the forked app state
+            _pool = ProcessPoolExecutor(
+                max_workers=config.REPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def get_or_render(data: dict):
+    """(key, pdf bytes, cache_hit) for `data`, rendering in the pool on a miss."""
+    key = report_key(data)
+    pdf = read_cached(key)
+    if pdf is not None:
+        metrics.record_cache_hit("report_pdf")
+        return key, pdf, True
+    metrics.record_cache_miss("report_pdf")
+    pdf = get_pool().submit(render_report, data).result()
+    write_cached(key, pdf)
+    return key, pdf, False
@@ -0,0 +1,229 @@
+"""
+Typed result storage and indexed cohort queries.
+
+Numeric results live in test_order_tests.result_value (DECIMAL) and
+qualitative ones ("Reactive", "Trace") in result_text. The index
+
+    idx_tot_test_entered_value (test_id, result_entered_at, result_value)
+
+lets "all HbA1c > 6.5 in the last month" run as a range scan on
+(test_id, result_entered_at) with the value filter checked inside the
+index, touching orders/patients only for matching rows.
+"""
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+from . import storage
+
+RESULT_INDEX_DDL = """
+    CREATE INDEX idx_tot_test_entered_value
+    ON test_order_tests (test_id, result_entered_at, result_value)
+"""
+
+FLAGS = ("LOW", "NORMAL", "HIGH")
+GENDERS = ("M", "F", "O")
+MAX_COHORT_ROWS = 5000
+
+_NUMERIC_RE = r"^[[:space:]]*-?[0-9]+([.][0-9]+)?[[:space:]]*$"
+
+
+def migrate_result_columns(cur):
+    """
+    Convert a legacy VARCHAR result_value (schema from app/db.py) to
+    DECIMAL, moving non-numeric values into result_text first.
+    Requires result_text to exist.
+    """
+    data_type = storage.get_engine().column_type(cur, "test_order_tests", "result_value")
+    if data_type is None or data_type == "decimal":
+        return False
+
+    cur.execute(f"""
+        UPDATE test_order_tests
+        SET result_text = COALESCE(result_text, result_value), result_value = NULL
+        WHERE result_value IS NOT NULL AND result_value NOT REGEXP '{_NUMERIC_RE}'
+    """)
+    cur.execute("ALTER TABLE test_order_tests MODIFY result_value DECIMAL(10,2) NULL")
+    return True
+
+
+# Flag from the most specific reference range matching the patient's
+# gender and age, falling back to the test's own normal_min/normal_max.
+# Expects aliases tot (line), p (patient), t (test) and x.v (new value).
+_AGE = "TIMESTAMPDIFF(YEAR, p.date_of_birth, CURDATE())"
+RESULT_FLAG_SQL = f"""
+    CASE WHEN x.v IS NULL THEN NULL ELSE COALESCE(
+        (SELECT CASE WHEN x.v < r.normal_min THEN 'LOW'
+                     WHEN x.v > r.normal_max THEN 'HIGH'
+                     ELSE 'NORMAL' END
+         FROM test_reference_ranges r
+         WHERE r.test_id = tot.test_id
+           AND r.gender IN (p.gender, 'ANY')
+           AND (r.age_min IS NULL OR {_AGE} >= r.age_min)
+           AND (r.age_max IS NULL OR {_AGE} <= r.age_max)
+           AND r.normal_min IS NOT NULL AND r.normal_max IS NOT NULL
+         ORDER BY r.gender = 'ANY', r.range_id
+         LIMIT 1),
+        CASE WHEN t.normal_min IS NULL OR t.normal_max IS NULL THEN NULL
+             WHEN x.v < t.normal_min THEN 'LOW'
+             WHEN x.v > t.normal_max THEN 'HIGH'
+             ELSE 'NORMAL' END
+    ) END
+"""
+
+
+def _update_sql(values_sql: str, match_sql: str) -> str:
+    return f"""
+        UPDATE test_order_tests tot
+        JOIN ({values_sql}) x
+        JOIN test_orders o ON o.order_id = tot.order_id
+        JOIN patients p ON p.patient_id = o.patient_id
+        JOIN tests t ON t.test_id = tot.test_id
+        SET
+            tot.result_value = x.v,
+            tot.result_text = x.txt,
+            tot.result_flag = {RESULT_FLAG_SQL},
+            tot.result_entered_at = NOW()
+        WHERE {match_sql}
+    """
+
+
+def record_result(cur, order_id: int, test_id: int, value, text: Optional[str] = None) -> int:
+    """
+    Store one result with its flag in a single statement. Returns the
+    number of lines updated (0 when the test is not part of the order).
+    """
+    cur.execute(
+        _update_sql("SELECT CAST(%s AS DECIMAL(10,2)) AS v, %s AS txt",
+                    "tot.order_id = %s AND tot.test_id = %s"),
+        (value, text, order_id, test_id),
+    )
+    return cur.rowcount
+
+
+def record_results(cur, items: List[Tuple[int, int, Optional[float], Optional[str]]]):
+    """
+    Store many (order_id, test_id, value, text) results with their flags
+    in one statement. A later item for the same line wins. Returns the
+    set of (order_id, test_id) that matched an order line.
+    """
+    latest = {(o, t): (v, txt) for o, t, v, txt in items}
+    if not latest:
+        return set()
+
+    order_ids = sorted({o for o, _ in latest})
+    fmt = ",".join(["%s"] * len(order_ids))
+    cur.execute(
+        f"SELECT order_id, test_id FROM test_order_tests WHERE order_id IN ({fmt})",
+        tuple(order_ids),
+    )
+    # Callers may pass a dictionary cursor
+    found = {
+        (r["order_id"], r["test_id"]) if isinstance(r, dict) else (r[0], r[1])
+        for r in cur.fetchall()
+    }
+    matched = found & latest.keys()
+    if not matched:
+        return matched
+
+    rows = sorted(matched)
+    values_sql = " UNION ALL ".join(
+        ["SELECT %s AS order_id, %s AS test_id, CAST(%s AS DECIMAL(10,2)) AS v, %s AS txt"]
+        + ["SELECT %s, %s, CAST(%s AS DECIMAL(10,2)), %s"] * (len(rows) - 1)
+    )
+    params = []
+    for key in rows:
+        params += [*key, *latest[key]]
+    cur.execute(
+        _update_sql(values_sql, "tot.order_id = x.order_id AND tot.test_id = x.test_id"),
+        tuple(params),
+    )
+    return matched
+
+
+# ============================================================
+# COHORTS
+# ============================================================
+
+
+def _cohort_where(test_id, value_min, value_max, flag, date_from, date_to,
+                  gender, age_min, age_max, today=None):
+    if flag is not None and flag not in FLAGS:
+        raise ValueError(f"flag must be one of: {', '.join(f.lower() for f in FLAGS)}")
+    if gender is not None and gender not in GENDERS:
+        raise ValueError("gender must be one of: male, female, other")
+
+    # Leading index columns first: test_id =, result_entered_at range
+    where = [
+        "tot.test_id = %s",
+        "tot.result_entered_at >= %s",
+        "tot.result_entered_at < %s",
+    ]
+    params = [test_id, date_from, date_to + timedelta(days=1)]
+
+    if value_min is not None:
+        where.append("tot.result_value >= %s")
+        params.append(value_min)
+    if value_max is not None:
+        where.append("tot.result_value <= %s")
+        params.append(value_max)
+    if flag is not None:
+        where.append("tot.result_flag = %s")
+        params.append(flag)
+    if gender is not None:
+        where.append("p.gender = %s")
+        params.append(gender)
+
+    # Age bounds as date_of_birth bounds so no function runs per row
+    today = today or date.today()
+    if age_min is not None:
+        where.append("p.date_of_birth <= %s")
+        params.append(_years_before(today, age_min))
+    if age_max is not None:
+        where.append("p.date_of_birth > %s")
+        params.append(_years_before(today, age_max + 1))
+
+    return " AND ".join(where), params
+
+
+def _years_before(d: date, years: int) -> date:
+    try:
+        return d.replace(year=d.year - years)
+    except ValueError:  # 29 February
+        return d.replace(year=d.year - years, day=28)
+
+
+def query_cohort(cur, test_id: int, *, value_min=None, value_max=None, flag=None,
+                 date_from: date, date_to: date, gender=None, age_min=None, age_max=None,
+                 limit: int = 500):
+    where, params = _cohort_where(
+        test_id, value_min, value_max, flag, date_from, date_to, gender, age_min, age_max,
+    )
+    joins = """
+        FROM test_order_tests tot
+        JOIN test_orders o ON o.order_id = tot.order_id
+        JOIN patients p ON p.patient_id = o.patient_id
+    """
+
+    cur.execute(f"""
+        SELECT COUNT(*) AS matches, COUNT(DISTINCT p.patient_id) AS patients,
+               MIN(tot.result_value) AS min_value, MAX(tot.result_value) AS max_value,
+               AVG(tot.result_value) AS avg_value
+        {joins}
+        WHERE {where}
+    """, params)
+    cols = [c[0] for c in cur.description]
+    summary = dict(zip(cols, cur.fetchone()))
+
+    cur.execute(f"""
+        SELECT tot.order_id, p.patient_id, p.full_name AS patient_name, p.gender,
+               {_AGE} AS age, tot.result_value, tot.result_text,
+               LOWER(tot.result_flag) AS result_flag, tot.result_entered_at
+        {joins}
+        WHERE {where}
+        ORDER BY tot.result_entered_at DESC
+        LIMIT %s
+    """, (*params, max(1, min(limit, MAX_COHORT_ROWS))))
+    cols = [c[0] for c in cur.description]
+    rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+
+    return summary, rows
@@ -0,0 +1,213 @@
+"""
+Revenue analytics backed by incrementally maintained daily aggregates.
+
+Two small tables are kept in step with test_orders inside the writing
+transaction:
+
+  revenue_daily_orders  day × doctor × priority             (order totals)
+  revenue_daily_lines   day × category × doctor × priority  (line prices)
+
+Order-level questions read the first table, so an order touching several
+categories is still counted once; category breakdowns read the second.
+A year of data is at most a few hundred thousand aggregate rows, so
+/api/analytics/revenue answers from an index range scan instead of
+scanning orders.
+
+Full rebuild (e.g. after bulk imports):
+
+    cd backend
+    python -m app.revenue rebuild
+"""
+import argparse
+import time
+from datetime import date, timedelta
+from typing import List, Optional
+
+from . import archive
+
+REVENUE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS revenue_daily_orders (
+        day DATE NOT NULL,
+        doctor_id INT NOT NULL DEFAULT 0,
+        priority ENUM('NORMAL','URGENT') NOT NULL,
+        order_count INT NOT NULL DEFAULT 0,
+        revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, doctor_id, priority)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS revenue_daily_lines (
+        day DATE NOT NULL,
+        category_id INT NOT NULL DEFAULT 0,
+        doctor_id INT NOT NULL DEFAULT 0,
+        priority ENUM('NORMAL','URGENT') NOT NULL,
+        order_count INT NOT NULL DEFAULT 0,
+        line_count INT NOT NULL DEFAULT 0,
+        revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, category_id, doctor_id, priority)
+    )
+    """,
+]
+
+PERIODS = {
+    "day": "a.day",
+    "week": "DATE_SUB(a.day, INTERVAL WEEKDAY(a.day) DAY)",
+    "month": "DATE_FORMAT(a.day, '%Y-%m-01')",
+}
+DIMENSIONS = ("category", "doctor", "priority")
+
+# Revenue attributed to one order line: the price snapshotted at order time
+_LINE_PRICE = "COALESCE(tot.price, t.price)"
+
+# ============================================================
+# INCREMENTAL MAINTENANCE
+# ============================================================
+
+
+def apply_order(cur, order_id: int, sign: int = 1):
+    """
+    Add (sign=1) or remove (sign=-1) one order's contribution to the
+    aggregates. Call in the same transaction as the order write, as late as
+    possible to keep the aggregate row locks short.
+    """
+    cur.execute("""
+        INSERT INTO revenue_daily_orders (day, doctor_id, priority, order_count, revenue)
+        SELECT DATE(o.order_date), COALESCE(o.doctor_id, 0), o.priority, %s, %s * o.total_amount
+        FROM test_orders o
+        WHERE o.order_id = %s
+        ON DUPLICATE KEY UPDATE
+            order_count = order_count + VALUES(order_count),
+            revenue = revenue + VALUES(revenue)
+    """, (sign, sign, order_id))
+
+    cur.execute(f"""
+        INSERT INTO revenue_daily_lines
+            (day, category_id, doctor_id, priority, order_count, line_count, revenue)
+        SELECT DATE(o.order_date), COALESCE(t.category_id, 0), COALESCE(o.doctor_id, 0),
+               o.priority, %s, %s * COUNT(*), %s * SUM({_LINE_PRICE})
+        FROM test_orders o
+        JOIN test_order_tests tot ON tot.order_id = o.order_id
+        JOIN tests t ON t.test_id = tot.test_id
+        WHERE o.order_id = %s
+        GROUP BY DATE(o.order_date), COALESCE(t.category_id, 0), COALESCE(o.doctor_id, 0), o.priority
+        ON DUPLICATE KEY UPDATE
+            order_count = order_count + VALUES(order_count),
+            line_count = line_count + VALUES(line_count),
+            revenue = revenue + VALUES(revenue)
+    """, (sign, sign, sign, order_id))
+
+
+def rebuild(conn):
+    """
+    Recompute both aggregate tables in one transaction. Days up to the
+    newest archived order keep their buckets, since archived orders are
+    no longer in test_orders to be re-counted.
+    """
+    cur = conn.cursor()
+    newest = archive.horizon(cur)
+    start = newest + timedelta(days=1) if newest else date.min
+    cur.execute("DELETE FROM revenue_daily_orders WHERE day >= %s", (start,))
+    cur.execute("DELETE FROM revenue_daily_lines WHERE day >= %s", (start,))
+    cur.execute("""
+        INSERT INTO revenue_daily_orders (day, doctor_id, priority, order_count, revenue)
+        SELECT DATE(o.order_date), COALESCE(o.doctor_id, 0), o.priority, COUNT(*), SUM(o.total_amount)
+        FROM test_orders o
+        WHERE o.order_date >= %s
+        GROUP BY DATE(o.order_date), COALESCE(o.doctor_id, 0), o.priority
+    """, (start,))
+    cur.execute(f"""
+        INSERT INTO revenue_daily_lines
+            (day, category_id, doctor_id, priority, order_count, line_count, revenue)
+        SELECT DATE(o.order_date), COALESCE(t.category_id, 0), COALESCE(o.doctor_id, 0), o.priority,
+               COUNT(DISTINCT o.order_id), COUNT(*), SUM({_LINE_PRICE})
+        FROM test_orders o
+        JOIN test_order_tests tot ON tot.order_id = o.order_id
+        JOIN tests t ON t.test_id = tot.test_id
+        WHERE o.order_date >= %s
+        GROUP BY DATE(o.order_date), COALESCE(t.category_id, 0), COALESCE(o.doctor_id, 0), o.priority
+    """, (start,))
+    conn.commit()
+    cur.close()
+
+# ============================================================
+# QUERY
+# ============================================================
+
+
+def parse_dimensions(group_by: Optional[str]) -> List[str]:
+    dims = [d.strip().lower() for d in (group_by or "").split(",") if d.strip()]
+    unknown = [d for d in dims if d not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown groupBy dimension(s): {', '.join(unknown)}")
+    return list(dict.fromkeys(dims))
+
+
+def query(cur, period: str, dims: List[str], date_from: date, date_to: date):
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of: {', '.join(PERIODS)}")
+
+    table = "revenue_daily_lines" if "category" in dims else "revenue_daily_orders"
+    select = [f"{PERIODS[period]} AS period"]
+    group = ["period"]
+    joins = []
+
+    if "category" in dims:
+        select.append("a.category_id, c.category_name")
+        joins.append("LEFT JOIN test_categories c ON c.category_id = a.category_id")
+        group += ["a.category_id", "c.category_name"]
+    if "doctor" in dims:
+        select.append("a.doctor_id, d.full_name AS doctor_name")
+        joins.append("LEFT JOIN doctors d ON d.doctor_id = a.doctor_id")
+        group += ["a.doctor_id", "d.full_name"]
+    if "priority" in dims:
+        select.append("LOWER(a.priority) AS priority")
+        group.append("a.priority")
+
+    select.append("SUM(a.order_count) AS orders")
+    if table == "revenue_daily_lines":
+        select.append("SUM(a.line_count) AS tests")
+    select.append("SUM(a.revenue) AS revenue")
+
+    cur.execute(f"""
+        SELECT {', '.join(select)}
+        FROM {table} a
+        {' '.join(joins)}
+        WHERE a.day BETWEEN %s AND %s
+        GROUP BY {', '.join(group)}
+        ORDER BY {', '.join(group)}
+    """, (date_from, date_to))
+
+    cols = [c[0] for c in cur.description]
+    rows = []
+    for r in cur.fetchall():
+        row = dict(zip(cols, r))
+        # 0 is the "no category / no doctor" bucket in the aggregates
+        if row.get("category_id") == 0:
+            row["category_id"] = None
+        if row.get("doctor_id") == 0:
+            row["doctor_id"] = None
+        rows.append(row)
+    return rows
+
+# ============================================================
+# CLI
+# ============================================================
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Revenue aggregate maintenance")
+    ap.add_argument("command", choices=["rebuild"])
+    ap.parse_args()
+
+    from .db import get_db_connection
+
+    conn = get_db_connection()
+    t0 = time.perf_counter()
+    rebuild(conn)
+    conn.close()
+    print(f"✓ Revenue aggregates rebuilt in {time.perf_counter() - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
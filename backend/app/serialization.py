@@ -0,0 +1,58 @@
+"""
+Fast JSON serialization path for list endpoints.
+
+Handlers that return FastJSONResponse directly bypass FastAPI's
+jsonable_encoder walk; orjson serializes datetime/date natively and the
+`_default` hook below covers the few MySQL types it does not know
+(Decimal, bytes, timedelta) with the same output jsonable_encoder gives.
+"""
+import datetime
+import decimal
+
+import orjson
+from fastapi.responses import JSONResponse
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(obj):
+    if isinstance(obj, decimal.Decimal):
+        # Same rule as fastapi.encoders.decimal_encoder
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.decode("utf-8", errors="replace")
+    if isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default, option=_OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def fetch_dicts(cur) -> list:
+    """
+    Fetch all rows from a plain (tuple) cursor as dicts keyed by column name.
+    Cheaper than cursor(dictionary=True), which builds each dict row-by-row
+    inside the connector.
+    """
+    cols = [c[0] for c in cur.description]
+    return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+
+def sql_case(column: str, mapping: dict, default: str) -> str:
+    """
+    Build a `CASE column WHEN 'K' THEN 'v' ... ELSE 'default' END` expression
+    from a DB → API lookup table so enum mapping happens inside MySQL.
+    """
+    whens = " ".join(f"WHEN '{k}' THEN '{v}'" for k, v in mapping.items() if v != default)
+    return f"(CASE {column} {whens} ELSE '{default}' END)"
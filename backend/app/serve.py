@@ -0,0 +1,46 @@
+"""
+Multi-process serving entry point.
+
+    cd backend
+    python -m app.serve --workers 4
+
+uvicorn pre-forks the given number of worker processes sharing one
+listening socket. Each worker keeps its own in-process caches, kept
+consistent through app.invalidation (version table polled every
+INVALIDATION_POLL_MS), so no external broker is needed.
+
+Keep-alive defaults to 75 s, longer than the idle timeout of common
+reverse proxies / load balancers (60 s), so pooled upstream connections
+are closed by the proxy rather than raced by the app.
+"""
+import argparse
+import os
+
+import uvicorn
+
+from . import config
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run the MedLAB+ backend with multiple workers.")
+    ap.add_argument("--host", default=config.WEB_HOST)
+    ap.add_argument("--port", type=int, default=config.WEB_PORT)
+    ap.add_argument("--workers", type=int, default=config.WEB_WORKERS or os.cpu_count() or 1)
+    ap.add_argument("--keep-alive", type=int, default=config.KEEP_ALIVE_TIMEOUT,
+                    help="seconds to hold idle HTTP keep-alive connections")
+    ap.add_argument("--backlog", type=int, default=2048)
+    args = ap.parse_args()
+
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_keep_alive=args.keep_alive,
+        backlog=args.backlog,
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
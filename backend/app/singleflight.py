@@ -0,0 +1,133 @@
+"""
+Single-flight coalescing for identical concurrent GET requests.
+
+When several clients request the same resource at once (shift start:
+Dashboard, NewOrder's test and doctor lists), only the first request
+(the leader) runs the handler; identical requests arriving while it is in
+flight wait for it and receive a copy of its serialized response bytes.
+
+Requests are identical when route, normalized query string, negotiated
+Accept-Encoding and Origin match. Requests carrying a read-your-writes
+consistency token are never coalesced. With SINGLEFLIGHT_TTL_MS > 0 a
+successful response is also replayed for that many milliseconds after
+the leader finishes.
+"""
+import asyncio
+from urllib.parse import parse_qsl, urlencode
+
+from . import config
+from .metrics import Counter, record_cache_hit, record_cache_miss, register
+from .routing import TOKEN_COOKIE
+
+SINGLEFLIGHT_REQUESTS = register(Counter(
+    "medlab_singleflight_requests_total",
+    "Coalescable GET requests, by outcome (leader/shared/ttl).",
+    ("route", "outcome"),
+))
+
+_TOKEN_COOKIE_BYTES = TOKEN_COOKIE.encode() + b"="
+
+
+def normalize_query(query_string: bytes) -> str:
+    pairs = parse_qsl(query_string.decode("latin-1"), keep_blank_values=True)
+    return urlencode(sorted(pairs))
+
+
+class _Flight:
+    __slots__ = ("future", "expires")
+
+    def __init__(self, future):
+        self.future = future
+        self.expires = None
+
+
+class SingleFlightMiddleware:
+    def __init__(self, app, paths=None, ttl_ms=None):
+        self.app = app
+        self.paths = set(config.SINGLEFLIGHT_PATHS if paths is None else paths)
+        ttl_ms = config.SINGLEFLIGHT_TTL_MS if ttl_ms is None else ttl_ms
+        self.ttl = ttl_ms / 1000.0
+        self._flights = {}
+
+    def _key(self, scope):
+        accept, origin = b"", b""
+        for name, value in scope["headers"]:
+            if name == b"x-consistency-token":
+                return None
+            if name == b"cookie" and _TOKEN_COOKIE_BYTES in value:
+                return None
+            if name == b"accept-encoding":
+                accept = value
+            elif name == b"origin":
+                origin = value
+        return (scope["path"], normalize_query(scope.get("query_string", b"")), accept, origin)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        key = self._key(scope)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        loop = asyncio.get_running_loop()
+        flight = self._flights.get(key)
+        if flight is not None:
+            if not flight.future.done():
+                result = await asyncio.shield(flight.future)
+                if result is not None:
+                    SINGLEFLIGHT_REQUESTS.inc(path, "shared")
+                    record_cache_hit("singleflight")
+                    await self._replay(send, result)
+                    return
+            elif flight.expires is not None and flight.expires > loop.time():
+                SINGLEFLIGHT_REQUESTS.inc(path, "ttl")
+                record_cache_hit("singleflight")
+                await self._replay(send, flight.future.result())
+                return
+            else:
+                self._expire(key, flight)
+
+        await self._lead(scope, receive, send, key, path, loop)
+
+    async def _lead(self, scope, receive, send, key, path, loop):
+        SINGLEFLIGHT_REQUESTS.inc(path, "leader")
+        record_cache_miss("singleflight")
+        flight = _Flight(loop.create_future())
+        self._flights[key] = flight
+
+        start = None
+        chunks = []
+
+        async def capture(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        result = None
+        try:
+            await self.app(scope, receive, capture)
+            if start is not None:
+                result = (start, b"".join(chunks))
+        finally:
+            # Followers of a failed leader (result None) run the handler themselves.
+            flight.future.set_result(result)
+            if result is not None and self.ttl > 0 and result[0]["status"] == 200:
+                flight.expires = loop.time() + self.ttl
+                loop.call_later(self.ttl, self._expire, key, flight)
+            else:
+                self._expire(key, flight)
+
+    def _expire(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _replay(self, send, result):
+        start, body = result
+        await send(start)
+        await send({"type": "http.response.body", "body": body})
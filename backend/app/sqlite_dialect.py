@@ -0,0 +1,1036 @@
+"""
+MySQL-dialect SQL on an embedded SQLite database.
+
+Queries and schema in this backend are written once, for MySQL. To run
+them on SQLite (app.storage.SQLiteEngine) every statement is translated
+on first use (the result is cached per SQL string) and executed through
+a small adapter that behaves like mysql-connector where the code relies
+on it: cursor(dictionary=True), rowcount/lastrowid, conn.autocommit,
+and errors carrying MySQL error numbers.
+
+What is translated is what the tree uses:
+
+  %s placeholders                   ?N (numbered, so clauses can move)
+  AUTO_INCREMENT, ENUM(...)         INTEGER PRIMARY KEY AUTOINCREMENT, TEXT
+  inline INDEX / UNIQUE KEY         CREATE [UNIQUE] INDEX IF NOT EXISTS
+  DEFAULT CURRENT_TIMESTAMP(6)      DEFAULT (strftime(... 'localtime'))
+  ON UPDATE CURRENT_TIMESTAMP(6)    an AFTER UPDATE trigger
+  INSERT IGNORE                     INSERT OR IGNORE
+  ON DUPLICATE KEY UPDATE           ON CONFLICT DO UPDATE, VALUES(c) -> excluded.c
+  UPDATE a JOIN b ON ... SET a.c    UPDATE a SET c ... FROM b WHERE ...
+  UPDATE t SET x = .., y = f(x)     later assignments see earlier ones, as
+                                    MySQL evaluates single-table SETs
+  UPDATE / DELETE ... LIMIT n       ... WHERE rowid IN (SELECT ... LIMIT n)
+  x +/- INTERVAL n UNIT, DATE_SUB   MYSQL_INTERVAL(x, n, 'UNIT')
+  IF(), TRIM(TRAILING s FROM x)     IIF(), MYSQL_TRIM_TRAILING(x, s)
+  FOR UPDATE / FOR SHARE / SKIP LOCKED / FORCE INDEX
+                                    dropped; FOR UPDATE opens the transaction
+                                    with BEGIN IMMEDIATE (the write lock)
+  EXPLAIN                           EXPLAIN QUERY PLAN
+
+NOW(), CURDATE(), TIMESTAMPDIFF(), HOUR(), WEEKDAY(), DATE_FORMAT(),
+CONCAT(), FIELD(), LAST_INSERT_ID() and REGEXP are registered as functions.
+
+Values come back as the types mysql-connector returns: Decimal for
+DECIMAL columns and date / datetime for DATE, DATETIME and TIMESTAMP
+columns (by declared type), and for select list items that are a
+DATE(), CURDATE(), NOW() or date arithmetic call. Other text, dates
+stored in VARCHAR columns included, stays str.
+"""
+import functools
+import re
+import sqlite3
+from calendar import monthrange
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import List, Optional, Tuple
+
+# ============================================================
+# ERRORS
+# ============================================================
+
+
+class Error(Exception):
+    """Database error; `errno` is the matching MySQL error number or None."""
+
+    def __init__(self, errno: Optional[int], msg: str):
+        super().__init__(msg)
+        self.errno = errno
+        self.msg = msg
+
+
+class IntegrityError(Error):
+    pass
+
+
+class OperationalError(Error):
+    pass
+
+
+_ERRNOS = (
+    (re.compile(r"duplicate column name", re.I), 1060),
+    (re.compile(r"index \S+ already exists", re.I), 1061),
+    (re.compile(r"table \S+ already exists", re.I), 1050),
+    (re.compile(r"no such table", re.I), 1146),
+    (re.compile(r"no such column", re.I), 1054),
+    (re.compile(r"database( table)? is locked", re.I), 1205),
+)
+
+
+def _error(e: sqlite3.Error) -> Error:
+    msg = str(e)
+    if isinstance(e, sqlite3.IntegrityError):
+        if "FOREIGN KEY" in msg:
+            errno = 1452
+        elif "UNIQUE" in msg or "PRIMARY KEY" in msg:
+            errno = 1062
+        elif "NOT NULL" in msg:
+            errno = 1048
+        else:
+            errno = None
+        return IntegrityError(errno, msg)
+    for pattern, errno in _ERRNOS:
+        if pattern.search(msg):
+            return OperationalError(errno, msg)
+    return OperationalError(None, msg)
+
+# ============================================================
+# TOKENS
+# ============================================================
+
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<str>'(?:[^'\\]|\\.|'')*')
+  | (?P<dstr>"(?:[^"\\]|\\.|"")*")
+  | (?P<qid>`[^`]*`)
+  | (?P<param>%s)
+  | (?P<num>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<op><=|>=|<>|!=|\|\||.)
+""", re.X | re.S)
+
+
+class Tok:
+    __slots__ = ("kind", "text")
+
+    def __init__(self, kind: str, text: str):
+        self.kind = kind
+        self.text = text
+
+    def is_(self, *words: str) -> bool:
+        return self.kind == "word" and self.text.upper() in words
+
+    def __eq__(self, other):
+        return isinstance(other, str) and self.kind == "op" and self.text == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return self.text
+
+
+def _w(text):
+    return Tok("word", text)
+
+
+def _o(text):
+    return Tok("op", text)
+
+
+def _s(text):
+    return Tok("str", "'" + text.replace("'", "''") + "'")
+
+
+def _tokenize(sql: str) -> List[Tok]:
+    toks, n = [], 0
+    for m in _TOKEN_RE.finditer(sql):
+        kind, text = m.lastgroup, m.group()
+        if kind in ("ws", "comment"):
+            continue
+        if kind == "param":
+            n += 1
+            toks.append(Tok("param", f"?{n}"))
+        elif kind == "qid":
+            toks.append(Tok("word", '"' + text[1:-1] + '"'))
+        elif kind == "dstr":
+            toks.append(_s(_unescape(text[1:-1].replace('""', '"'))))
+        elif kind == "str":
+            toks.append(_s(_unescape(text[1:-1].replace("''", "'"))) if "\\" in text else Tok("str", text))
+        else:
+            toks.append(Tok(kind, text))
+    while toks and toks[-1] == ";":
+        toks.pop()
+    return toks
+
+
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "0": "\0", "\\": "\\", "'": "'", '"': '"'}
+
+
+def _unescape(s: str) -> str:
+    return re.sub(r"\\(.)", lambda m: _ESCAPES.get(m.group(1), m.group(1)), s)
+
+
+def _render(toks: List[Tok]) -> str:
+    out = []
+    prev = None
+    for t in toks:
+        if out and not (t in (")", ",", ".") or prev in ("(", ".")):
+            out.append(" ")
+        out.append(t.text)
+        prev = t
+    return "".join(out)
+
+
+def _match(toks: List[Tok], i: int) -> int:
+    """Index of the parenthesis closing the one at toks[i]."""
+    depth = 0
+    for j in range(i, len(toks)):
+        if toks[j] == "(":
+            depth += 1
+        elif toks[j] == ")":
+            depth -= 1
+            if depth == 0:
+                return j
+    raise OperationalError(None, "unbalanced parentheses")
+
+
+def _match_back(toks: List[Tok], i: int) -> int:
+    depth = 0
+    for j in range(i, -1, -1):
+        if toks[j] == ")":
+            depth += 1
+        elif toks[j] == "(":
+            depth -= 1
+            if depth == 0:
+                return j
+    raise OperationalError(None, "unbalanced parentheses")
+
+
+def _top(toks: List[Tok]):
+    """Yield (index, token) for tokens outside any parentheses."""
+    depth = 0
+    for i, t in enumerate(toks):
+        if t == "(":
+            depth += 1
+        elif t == ")":
+            depth -= 1
+        elif depth == 0:
+            yield i, t
+
+
+def _find(toks: List[Tok], *words: str, start: int = 0) -> int:
+    for i, t in _top(toks):
+        if i >= start and t.is_(*words):
+            return i
+    return -1
+
+
+def _split(toks: List[Tok], sep: str = ",") -> List[List[Tok]]:
+    parts, last = [], 0
+    for i, t in _top(toks):
+        if t == sep:
+            parts.append(toks[last:i])
+            last = i + 1
+    parts.append(toks[last:])
+    return [p for p in parts if p]
+
+
+def _join(parts: List[List[Tok]], sep: str = ",") -> List[Tok]:
+    out: List[Tok] = []
+    for k, p in enumerate(parts):
+        if k:
+            out.append(_o(sep) if sep == "," else _w(sep))
+        out.extend(p)
+    return out
+
+# ============================================================
+# TRANSLATION
+# ============================================================
+
+_UNITS = ("MICROSECOND", "SECOND", "MINUTE", "HOUR", "DAY", "WEEK", "MONTH", "QUARTER", "YEAR")
+
+# Column defaults and ON UPDATE stamps use built-ins only, so the file can
+# still be written by tools that don't register our functions. Datetimes
+# are always stored with six fractional digits (see _DATETIME_FORMAT).
+_NOW_SQL = {
+    False: "strftime('%Y-%m-%d %H:%M:%S.000000', 'now', 'localtime')",
+    True: "strftime('%Y-%m-%d %H:%M:%f000', 'now', 'localtime')",
+}
+
+
+@dataclass(frozen=True)
+class Plan:
+    statements: Tuple[str, ...]
+    lock: bool = False                              # take the write lock first
+    add_column: Optional[Tuple[str, str]] = None    # (table, column) must not exist yet
+    temporal: Tuple[Tuple[int, str], ...] = ()      # (result column, kind) of date expressions
+
+
+def _strip_locking(toks: List[Tok]) -> bool:
+    lock = False
+    i = 0
+    while i < len(toks):
+        t = toks[i]
+        nxt = toks[i + 1] if i + 1 < len(toks) else None
+        if t.is_("FOR") and nxt is not None and nxt.is_("UPDATE", "SHARE"):
+            lock = lock or nxt.is_("UPDATE")
+            end = i + 2
+            while end < len(toks) and toks[end].is_("SKIP", "LOCKED", "NOWAIT"):
+                end += 1
+            del toks[i:end]
+            continue
+        if t.is_("LOCK") and [x.text.upper() for x in toks[i + 1:i + 4]] == ["IN", "SHARE", "MODE"]:
+            del toks[i:i + 4]
+            continue
+        if t.is_("FORCE", "USE", "IGNORE") and nxt is not None and nxt.is_("INDEX", "KEY") \
+                and i + 2 < len(toks) and toks[i + 2] == "(":
+            del toks[i:_match(toks, i + 2) + 1]
+            continue
+        i += 1
+    return lock
+
+
+def _interval_args(n: List[Tok], unit: Tok, negative: bool) -> List[Tok]:
+    amount = [_o("-"), _o("("), *n, _o(")")] if negative else [_o("("), *n, _o(")")]
+    return [*amount, _o(","), _s(unit.text.upper())]
+
+
+def _rewrite_expressions(toks: List[Tok]) -> List[Tok]:
+    i = 0
+    while i < len(toks):
+        t = toks[i]
+        nxt = toks[i + 1] if i + 1 < len(toks) else None
+        if t.kind != "word":
+            i += 1
+            continue
+        up = t.text.upper()
+        call = nxt == "("
+
+        if up == "IF" and call:
+            toks[i] = _w("IIF")
+        elif up == "TIMESTAMPDIFF" and call and toks[i + 2].is_(*_UNITS):
+            toks[i + 2] = _s(toks[i + 2].text.upper())
+        elif up in ("DATE_SUB", "DATE_ADD") and call:
+            close = _match(toks, i + 1)
+            expr, interval = _split(toks[i + 2:close])
+            new = [_w("MYSQL_INTERVAL"), _o("("), *expr, _o(","),
+                   *_interval_args(interval[1:-1], interval[-1], up == "DATE_SUB"), _o(")")]
+            toks[i:close + 1] = new
+            continue
+        elif up == "INTERVAL" and i >= 2 and toks[i - 1] in ("+", "-"):
+            k = next(j for j in range(i + 1, len(toks)) if toks[j].is_(*_UNITS))
+            j = i - 2
+            if toks[j] == ")":
+                start = _match_back(toks, j)
+                if start > 0 and toks[start - 1].kind == "word":
+                    start -= 1
+            else:
+                start = j
+                while start >= 2 and toks[start - 1] == "." and toks[start - 2].kind == "word":
+                    start -= 2
+            new = [_w("MYSQL_INTERVAL"), _o("("), *toks[start:j + 1], _o(","),
+                   *_interval_args(toks[i + 1:k], toks[k], toks[i - 1] == "-"), _o(")")]
+            toks[start:k + 1] = new
+            i = start
+            continue
+        elif up == "TRIM" and call and toks[i + 2].is_("TRAILING"):
+            close = _match(toks, i + 1)
+            chars, expr = toks[i + 3], toks[i + 5:close]
+            toks[i:close + 1] = [_w("MYSQL_TRIM_TRAILING"), _o("("), *expr, _o(","), chars, _o(")")]
+            continue
+        elif up == "CURRENT_TIMESTAMP":
+            toks[i] = _w("NOW")
+            if not call:
+                toks[i + 1:i + 1] = [_o("("), _o(")")]
+        elif up == "CURRENT_DATE" and not call:
+            toks[i:i + 1] = [_w("CURDATE"), _o("("), _o(")")]
+        i += 1
+    return toks
+
+
+# Result types of the date functions in a select list; columns are typed
+# by their declaration instead (PARSE_DECLTYPES, see VALUES)
+_TEMPORAL_CALLS = {"DATE": "date", "CURDATE": "date", "NOW": "datetime", "MYSQL_INTERVAL": "interval"}
+
+
+def _temporal_columns(toks: List[Tok]) -> Tuple[Tuple[int, str], ...]:
+    """(index, kind) of the select list items that are a date function call."""
+    start = 1
+    if start < len(toks) and toks[start].is_("DISTINCT", "ALL"):
+        start += 1
+    end = _find(toks, "FROM", "UNION", "ORDER", "LIMIT", start=start)
+    items = _split(toks[start:end if end >= 0 else len(toks)])
+    out = []
+    for n, item in enumerate(items):
+        if len(item) >= 2 and item[-2].is_("AS"):
+            item = item[:-2]
+        elif len(item) >= 2 and item[-1].kind == "word" and item[-2] == ")":
+            item = item[:-1]
+        kind = _TEMPORAL_CALLS.get(item[0].text.upper()) if item[0].kind == "word" else None
+        if kind and len(item) > 2 and item[1] == "(" and _match(item, 1) == len(item) - 1:
+            out.append((n, kind))
+    return tuple(out)
+
+
+def _now_call(toks: List[Tok], i: int) -> Optional[int]:
+    """End index of a NOW(...) call at toks[i], or None."""
+    if i < len(toks) and toks[i].is_("NOW") and i + 1 < len(toks) and toks[i + 1] == "(":
+        return _match(toks, i + 1)
+    return None
+
+
+_TYPE_END = ("NOT", "NULL", "DEFAULT", "PRIMARY", "UNIQUE", "REFERENCES", "CHECK", "AUTO_INCREMENT",
+             "ON", "COMMENT", "COLLATE", "CHARACTER", "CHARSET", "GENERATED", "AS", "CONSTRAINT")
+
+
+def _column_def(table: str, item: List[Tok]):
+    """
+    Translate one column definition. Returns (tokens, autoincrement,
+    on-update trigger or None, default expression or None).
+    """
+    col = item[0].text
+    k = 1
+    while k < len(item) and not item[k].is_(*_TYPE_END):
+        k += 1 if item[k] != "(" else _match(item, k) - k + 1
+    col_type = item[1:k]
+    if col_type and col_type[0].is_("ENUM", "SET"):
+        col_type = [_w("TEXT")]
+    col_type = [t for t in col_type if not t.is_("UNSIGNED", "ZEROFILL", "SIGNED")]
+
+    out: List[Tok] = []
+    auto = False
+    trigger = None
+    default = None
+    rest = item[k:]
+    j = 0
+    while j < len(rest):
+        t = rest[j]
+        if t.is_("AUTO_INCREMENT"):
+            auto = True
+            j += 1
+        elif t.is_("COMMENT"):
+            j += 2
+        elif t.is_("COLLATE", "CHARSET"):
+            j += 2
+        elif t.is_("CHARACTER"):
+            j += 3
+        elif t.is_("ON") and j + 1 < len(rest) and rest[j + 1].is_("UPDATE") \
+                and _now_call(rest, j + 2) is not None:
+            end = _now_call(rest, j + 2)
+            precise = end - (j + 2) > 2
+            trigger = (
+                f"CREATE TRIGGER IF NOT EXISTS trg_{table}_{col}_on_update AFTER UPDATE ON {table} "
+                f"FOR EACH ROW WHEN NEW.{col} IS OLD.{col} BEGIN "
+                f"UPDATE {table} SET {col} = {_NOW_SQL[precise]} WHERE rowid = NEW.rowid; END"
+            )
+            j = end + 1
+        elif t.is_("DEFAULT") and _now_call(rest, j + 1) is not None:
+            end = _now_call(rest, j + 1)
+            default = _NOW_SQL[end - (j + 1) > 2]
+            out += [t, _o("("), _w(default), _o(")")]
+            j = end + 1
+        else:
+            out.append(t)
+            j += 1
+
+    if auto:
+        col_type = [_w("INTEGER")]
+        if any(t.is_("PRIMARY") for t in out):
+            out = [t for t in out if not t.is_("NOT", "NULL")]
+            out.append(_w("AUTOINCREMENT"))
+    return [item[0], *col_type, *out], auto, trigger, default
+
+
+def _index_columns(toks: List[Tok]) -> List[Tok]:
+    """(col(10), col2) without MySQL prefix lengths or USING clauses."""
+    close = _match(toks, 0)
+    cols = []
+    for part in _split(toks[1:close]):
+        cols.append([part[0]] + [t for t in part[1:] if t.is_("ASC", "DESC")])
+    return [_o("("), *_join(cols), _o(")")]
+
+
+def _create_table(toks: List[Tok]) -> Tuple[str, ...]:
+    p = next(i for i, t in enumerate(toks) if t == "(")
+    table = toks[p - 1].text
+    close = _match(toks, p)
+    items, extra, triggers = [], [], []
+    auto_col = None
+    for item in _split(toks[p + 1:close]):
+        first = item[0]
+        second = item[1] if len(item) > 1 else None
+        if first.is_("INDEX", "KEY") or (first.is_("UNIQUE", "FULLTEXT", "SPATIAL")
+                                         and second is not None and second.is_("INDEX", "KEY")):
+            unique = first.is_("UNIQUE")
+            rest = item[1:] if first.is_("INDEX", "KEY") else item[2:]
+            if rest[0] == "(":
+                name = f"idx_{table}_{len(extra) + 1}"
+            else:
+                name, rest = rest[0].text, rest[1:]
+            extra.append(
+                f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} "
+                f"ON {table} {_render(_index_columns(rest))}"
+            )
+        elif first.is_("PRIMARY") and auto_col is not None \
+                and [t.text for t in item[3:-1]] == [auto_col]:
+            continue    # already declared on the AUTO_INCREMENT column
+        elif first.is_("PRIMARY", "FOREIGN", "CONSTRAINT", "CHECK", "UNIQUE"):
+            items.append([t for t in item if not t.is_("USING", "BTREE", "HASH")])
+        else:
+            col, auto, trigger, _ = _column_def(table, item)
+            if auto and not any(t.is_("PRIMARY") for t in col):
+                col += [_w("PRIMARY"), _w("KEY"), _w("AUTOINCREMENT")]
+                auto_col = item[0].text
+            items.append(col)
+            if trigger:
+                triggers.append(trigger)
+    head = _render(toks[:p])
+    return (f"{head} ({_render(_join(items))})", *extra, *triggers)
+
+
+def _alter_table(toks: List[Tok]) -> Plan:
+    table = toks[2].text
+    if len(toks) > 4 and toks[3].is_("ADD"):
+        item = toks[5:] if toks[4].is_("COLUMN") else toks[4:]
+        if not item[0].is_("INDEX", "KEY", "UNIQUE", "CONSTRAINT", "PRIMARY", "FOREIGN"):
+            col, _, trigger, default = _column_def(table, item)
+            statements = []
+            if default is not None:
+                # SQLite can't add a column with a non-constant default:
+                # add it nullable, then backfill existing rows
+                drop = ("NOT", "DEFAULT")
+                kept, j = [], 0
+                while j < len(col):
+                    if col[j].is_(*drop):
+                        j += 2 if col[j].is_("NOT") else 4
+                        continue
+                    kept.append(col[j])
+                    j += 1
+                statements.append(f"ALTER TABLE {table} ADD COLUMN {_render(kept)}")
+                statements.append(f"UPDATE {table} SET {item[0].text} = {default}")
+            else:
+                statements.append(f"ALTER TABLE {table} ADD COLUMN {_render(col)}")
+            if trigger:
+                statements.append(trigger)
+            return Plan(tuple(statements), add_column=(table, item[0].text.strip('"')))
+    return Plan((_render(toks),))
+
+
+def _create_index(toks: List[Tok]) -> str:
+    on = _find(toks, "ON")
+    p = on + 2
+    return _render(toks[:p]) + " " + _render(_index_columns(toks[p:]))
+
+
+def _insert(toks: List[Tok]) -> str:
+    if len(toks) > 1 and toks[1].is_("IGNORE"):
+        toks[1:2] = [_w("OR"), _w("IGNORE")]
+    dup = next((i for i, t in _top(toks) if t.is_("ON") and i + 1 < len(toks) and toks[i + 1].is_("DUPLICATE")), -1)
+    if dup >= 0:
+        head, tail = toks[:dup], toks[dup + 4:]
+        sel = _find(head, "SELECT")
+        if sel >= 0 and _find(head, "WHERE", start=sel) < 0:
+            # keeps ON from parsing as a join constraint
+            at = _find(head, "GROUP", "HAVING", "ORDER", "LIMIT", start=sel)
+            at = len(head) if at < 0 else at
+            head[at:at] = [_w("WHERE"), _w("TRUE")]
+        out = []
+        j = 0
+        while j < len(tail):
+            if tail[j].is_("VALUES") and j + 3 < len(tail) and tail[j + 1] == "(" and tail[j + 3] == ")":
+                out += [_w("excluded"), _o("."), tail[j + 2]]
+                j += 4
+            else:
+                out.append(tail[j])
+                j += 1
+        toks = head + [_w("ON"), _w("CONFLICT"), _w("DO"), _w("UPDATE"), _w("SET")] + out
+    return _render(toks)
+
+
+def _sequential(assignments: List[List[Tok]]) -> List[List[Tok]]:
+    """Make later SET expressions see earlier assignments, as MySQL does."""
+    seen = {}
+    out = []
+    for a in assignments:
+        eq = next(i for i, t in _top(a) if t == "=")
+        lhs, rhs = a[:eq], a[eq + 1:]
+        if seen:
+            new = []
+            for j, t in enumerate(rhs):
+                prev = rhs[j - 1] if j else None
+                nxt = rhs[j + 1] if j + 1 < len(rhs) else None
+                if t.kind == "word" and t.text.lower() in seen and prev != "." and nxt not in ("(", "."):
+                    new += [_o("("), *seen[t.text.lower()], _o(")")]
+                else:
+                    new.append(t)
+            rhs = new
+        seen[lhs[-1].text.lower()] = rhs
+        out.append(lhs + [_o("=")] + rhs)
+    return out
+
+
+def _limited(verb: List[Tok], table: str, where: List[Tok], tail: List[Tok]) -> List[Tok]:
+    """`<verb> WHERE rowid IN (SELECT rowid FROM table WHERE ... LIMIT n)`"""
+    sub = [_w("SELECT"), _w("rowid"), _w("FROM"), _w(table), *where, *tail]
+    return [*verb, _w("WHERE"), _w("rowid"), _w("IN"), _o("("), *sub, _o(")")]
+
+
+def _update(toks: List[Tok]) -> str:
+    s = _find(toks, "SET")
+    w = _find(toks, "WHERE", start=s)
+    tail_at = _find(toks, "ORDER", "LIMIT", start=s)
+    end = w if w >= 0 else (tail_at if tail_at >= 0 else len(toks))
+    target = [t for t in toks[1:s] if not t.is_("LOW_PRIORITY", "IGNORE")]
+    assignments = _split(toks[s + 1:end])
+    where = toks[w:tail_at if tail_at >= 0 else len(toks)] if w >= 0 else []
+    tail = toks[tail_at:] if tail_at >= 0 else []
+
+    joined = any(t.is_("JOIN") or t == "," for _, t in _top(target))
+    if not joined:
+        table = target[0].text
+        verb = [_w("UPDATE"), *target, _w("SET"), *_join(_sequential(assignments))]
+        if tail:
+            return _render(_limited(verb, table, where, tail))
+        return _render(verb + where)
+
+    # UPDATE a [alias] JOIN b [alias] ON c ... SET a.x = ... WHERE w
+    #   -> UPDATE a AS alias SET x = ... FROM b alias, ... WHERE c AND ... AND (w)
+    first_join = next(i for i, t in _top(target) if t.is_("JOIN", "INNER", "CROSS") or t == ",")
+    base = [t for t in target[:first_join] if not t.is_("AS")]
+    froms, conds = [], []
+    rest = target[first_join:]
+    i = 0
+    while i < len(rest):
+        if rest[i].is_("INNER", "CROSS") or rest[i] == ",":
+            i += 1
+            continue
+        if rest[i].is_("LEFT", "RIGHT", "STRAIGHT_JOIN"):
+            raise OperationalError(None, "only inner joins are supported in multi-table UPDATE")
+        if rest[i].is_("JOIN"):
+            i += 1
+        j = i
+        while j < len(rest) and not (rest[j].is_("ON", "JOIN", "INNER", "CROSS") or rest[j] == ","):
+            j += 1 if rest[j] != "(" else _match(rest, j) - j + 1
+        froms.append(rest[i:j])
+        i = j
+        if i < len(rest) and rest[i].is_("ON"):
+            k = i + 1
+            while k < len(rest) and not (rest[k].is_("JOIN", "INNER", "CROSS") or rest[k] == ","):
+                k += 1 if rest[k] != "(" else _match(rest, k) - k + 1
+            conds.append([_o("("), *rest[i + 1:k], _o(")")])
+            i = k
+    sets = []
+    for a in assignments:
+        eq = next(k for k, t in _top(a) if t == "=")
+        sets.append([a[eq - 1], *a[eq:]])
+    if where:
+        conds.append([_o("("), *where[1:], _o(")")])
+    out = [_w("UPDATE"), base[0]]
+    if len(base) > 1:
+        out += [_w("AS"), base[1]]
+    out += [_w("SET"), *_join(sets), _w("FROM"), *_join(froms)]
+    if conds:
+        out += [_w("WHERE"), *_join(conds, "AND")]
+    return _render(out + tail)
+
+
+def _delete(toks: List[Tok]) -> str:
+    f = _find(toks, "FROM")
+    w = _find(toks, "WHERE", start=f)
+    tail_at = _find(toks, "ORDER", "LIMIT", start=f)
+    if tail_at < 0:
+        return _render(toks)
+    where = toks[w:tail_at] if w >= 0 else []
+    return _render(_limited(toks[:f + 2], toks[f + 1].text, where, toks[tail_at:]))
+
+
+@functools.lru_cache(maxsize=4096)
+def translate(sql: str) -> Plan:
+    stripped = sql.lstrip()
+    if stripped[:8].upper() == "EXPLAIN ":
+        inner = translate(stripped[8:])
+        return Plan(tuple("EXPLAIN QUERY PLAN " + s for s in inner.statements[-1:]))
+
+    toks = _tokenize(sql)
+    if not toks:
+        return Plan(())
+    lock = _strip_locking(toks)
+    toks = _rewrite_expressions(toks)
+    head = [t.text.upper() for t in toks[:3]]
+
+    if head[0] == "CREATE" and "TABLE" in head:
+        return Plan(_create_table(toks))
+    if head[0] == "CREATE" and "INDEX" in head:
+        return Plan((_create_index(toks),))
+    if head[0] == "CREATE" and head[1] in ("DATABASE", "SCHEMA"):
+        return Plan(())
+    if head[0] == "ALTER" and head[1] == "TABLE":
+        return _alter_table(toks)
+    if head[0] in ("INSERT", "REPLACE"):
+        return Plan((_insert(toks),), lock)
+    if head[0] == "UPDATE":
+        return Plan((_update(toks),), lock)
+    if head[0] == "DELETE":
+        return Plan((_delete(toks),), lock)
+    temporal = _temporal_columns(toks) if head[0] == "SELECT" else ()
+    return Plan((_render(toks),), lock, temporal=temporal)
+
+# ============================================================
+# FUNCTIONS
+# ============================================================
+
+# One fixed text form, so stored values, parameters and function results
+# compare (and sort) correctly as strings
+_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+_TEMPORAL_RE = re.compile(r"^\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}:\d{2}(?:\.\d{1,6})?)?$")
+
+
+def _temporal(v):
+    """(datetime, was a plain date) for a DATE/DATETIME value, or (None, False)."""
+    if isinstance(v, datetime):
+        return v, False
+    if isinstance(v, date):
+        return datetime(v.year, v.month, v.day), True
+    if isinstance(v, bytes):
+        v = v.decode()
+    if isinstance(v, str) and _TEMPORAL_RE.match(v):
+        return datetime.fromisoformat(v), len(v) == 10
+    return None, False
+
+
+def _fmt(d: datetime, as_date: bool = False) -> str:
+    return d.strftime("%Y-%m-%d" if as_date else _DATETIME_FORMAT)
+
+
+def _now(fsp=0):
+    d = datetime.now()
+    return _fmt(d if fsp else d.replace(microsecond=0))
+
+
+def _curdate():
+    return date.today().isoformat()
+
+
+def _add_months(d: datetime, months: int) -> datetime:
+    y, m = divmod(d.month - 1 + months, 12)
+    year, month = d.year + y, m + 1
+    return d.replace(year=year, month=month, day=min(d.day, monthrange(year, month)[1]))
+
+
+_SECONDS = {"MICROSECOND": 1e-6, "SECOND": 1, "MINUTE": 60, "HOUR": 3600, "DAY": 86400, "WEEK": 604800}
+_MONTHS = {"MONTH": 1, "QUARTER": 3, "YEAR": 12}
+
+
+def _interval(v, n, unit):
+    d, as_date = _temporal(v)
+    if d is None or n is None:
+        return None
+    n = float(n)
+    if unit in _MONTHS:
+        d = _add_months(d, int(n) * _MONTHS[unit])
+    else:
+        d = d + timedelta(seconds=n * _SECONDS[unit])
+    return _fmt(d, as_date and unit in ("DAY", "WEEK", "MONTH", "QUARTER", "YEAR"))
+
+
+def _months_between(a: datetime, b: datetime) -> int:
+    months = (b.year - a.year) * 12 + b.month - a.month
+    # Not a full month yet if the day/time of b is before that of a
+    if (b.day, b.time()) < (a.day, a.time()):
+        months -= 1
+    return months
+
+
+def _timestampdiff(unit, a, b):
+    a, _ = _temporal(a)
+    b, _ = _temporal(b)
+    if a is None or b is None:
+        return None
+    if b < a:
+        r = _timestampdiff(unit, b, a)
+        return -r if r is not None else None
+    if unit in _MONTHS:
+        return _months_between(a, b) // _MONTHS[unit]
+    if unit == "MICROSECOND":
+        return (b - a) // timedelta(microseconds=1)
+    return int((b - a).total_seconds() // _SECONDS[unit])
+
+
+def _hour(v):
+    d, _ = _temporal(v)
+    return d.hour if d is not None else None
+
+
+def _weekday(v):
+    d, _ = _temporal(v)
+    return d.weekday() if d is not None else None
+
+
+_DATE_FORMAT = {
+    "Y": "%Y", "y": "%y", "m": "%m", "d": "%d", "H": "%H", "i": "%M", "s": "%S", "S": "%S",
+    "M": "%B", "b": "%b", "W": "%A", "a": "%a", "j": "%j", "p": "%p", "f": "%f", "%": "%%",
+}
+
+
+def _date_format(v, fmt):
+    d, _ = _temporal(v)
+    if d is None or fmt is None:
+        return None
+    return d.strftime(re.sub(r"%(.)", lambda m: _DATE_FORMAT.get(m.group(1), m.group(1)), fmt))
+
+
+def _concat(*args):
+    if any(a is None for a in args):
+        return None
+    return "".join(_text(a) for a in args)
+
+
+def _text(v) -> str:
+    if isinstance(v, float):
+        return format(Decimal(repr(v)), "f")
+    return str(v)
+
+
+def _trim_trailing(v, s):
+    if v is None or s is None:
+        return None
+    if isinstance(v, (int, float)):
+        # A DECIMAL column stored as a number: trim as MySQL would trim
+        # its text form, which always has a fractional part
+        v = _text(v)
+        if "." not in v:
+            v += ".0"
+    v = str(v)
+    while s and v.endswith(s):
+        v = v[:-len(s)]
+    return v
+
+
+def _field(value, *candidates):
+    if value is None:
+        return 0
+    for i, c in enumerate(candidates, 1):
+        if c == value:
+            return i
+    return 0
+
+
+def _regexp(pattern, value):
+    if pattern is None or value is None:
+        return None
+    return re.search(pattern, str(value)) is not None
+
+
+_FUNCTIONS = (
+    ("NOW", -1, _now, False),
+    ("CURDATE", 0, _curdate, False),
+    ("MYSQL_INTERVAL", 3, _interval, True),
+    ("TIMESTAMPDIFF", 3, _timestampdiff, True),
+    ("HOUR", 1, _hour, True),
+    ("WEEKDAY", 1, _weekday, True),
+    ("DATE_FORMAT", 2, _date_format, True),
+    ("CONCAT", -1, _concat, True),
+    ("FIELD", -1, _field, True),
+    ("MYSQL_TRIM_TRAILING", 2, _trim_trailing, True),
+    ("REGEXP", 2, _regexp, True),
+)
+
+# ============================================================
+# VALUES
+# ============================================================
+
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda v: v.strftime(_DATETIME_FORMAT))
+sqlite3.register_converter("DECIMAL", lambda b: Decimal(b.decode()))
+
+
+def _to_date(v: str) -> date:
+    return datetime.fromisoformat(v).date()
+
+
+def _to_interval(v: str):
+    # MYSQL_INTERVAL() keeps the type of its argument: DATE in, DATE out
+    return _to_date(v) if len(v) == 10 else datetime.fromisoformat(v)
+
+
+# Declared column types (PARSE_DECLTYPES, first word of the type)
+sqlite3.register_converter("DATE", lambda b: _to_date(b.decode()))
+sqlite3.register_converter("DATETIME", lambda b: datetime.fromisoformat(b.decode()))
+sqlite3.register_converter("TIMESTAMP", lambda b: datetime.fromisoformat(b.decode()))
+
+# Select list expressions (Plan.temporal)
+_CONVERT = {"date": _to_date, "datetime": datetime.fromisoformat, "interval": _to_interval}
+
+
+def _row(r: tuple, temporal: Tuple[Tuple[int, str], ...]) -> tuple:
+    r = list(r)
+    for i, kind in temporal:
+        if isinstance(r[i], str):
+            r[i] = _CONVERT[kind](r[i])
+    return tuple(r)
+
+# ============================================================
+# CONNECTION
+# ============================================================
+
+
+class Cursor:
+    def __init__(self, conn: "Connection", dictionary: bool = False):
+        self._conn = conn
+        self._cur = conn._raw.cursor()
+        self._dictionary = dictionary
+        self._columns: Optional[List[str]] = None
+        self._temporal: Tuple[Tuple[int, str], ...] = ()
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def _run(self, operation: str, params, many: bool = False):
+        plan = translate(operation)
+        try:
+            self._conn._begin(plan)
+            if plan.add_column is not None:
+                self._check_new_column(*plan.add_column)
+            rowcount = 0
+            for stmt in plan.statements:
+                if many:
+                    self._cur.executemany(stmt, [tuple(p) for p in params])
+                else:
+                    self._cur.execute(stmt, tuple(params or ()) if "?" in stmt else ())
+                rowcount += max(self._cur.rowcount, 0)
+        except sqlite3.Error as e:
+            raise _error(e) from e
+        self.description = self._cur.description
+        self._columns = [d[0] for d in self.description] if self.description else None
+        self._temporal = plan.temporal
+        self.rowcount = -1 if self.description else rowcount
+        self.lastrowid = self._cur.lastrowid
+
+    def _check_new_column(self, table: str, column: str):
+        self._cur.execute(f"PRAGMA table_info({table})")
+        if any(r[1].lower() == column.lower() for r in self._cur.fetchall()):
+            raise OperationalError(1060, f"Duplicate column name '{column}'")
+
+    def execute(self, operation: str, params=None, multi: bool = False):
+        self._run(operation, params)
+
+    def executemany(self, operation: str, seq_params):
+        seq_params = list(seq_params)
+        if seq_params:
+            self._run(operation, seq_params, many=True)
+
+    def _out(self, rows):
+        if self._temporal:
+            rows = [_row(r, self._temporal) for r in rows]
+        if self._dictionary:
+            return [dict(zip(self._columns, r)) for r in rows]
+        return rows
+
+    def fetchone(self):
+        try:
+            r = self._cur.fetchone()
+        except sqlite3.Error as e:
+            raise _error(e) from e
+        return None if r is None else self._out([r])[0]
+
+    def fetchmany(self, size: int = 1):
+        try:
+            return self._out(self._cur.fetchmany(size))
+        except sqlite3.Error as e:
+            raise _error(e) from e
+
+    def fetchall(self):
+        try:
+            return self._out(self._cur.fetchall())
+        except sqlite3.Error as e:
+            raise _error(e) from e
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self._cur.close()
+
+
+class Connection:
+    """mysql-connector-like wrapper over a sqlite3 connection."""
+
+    def __init__(self, raw: sqlite3.Connection):
+        self._raw = raw
+
+    @property
+    def autocommit(self) -> bool:
+        return self._raw.isolation_level is None
+
+    @autocommit.setter
+    def autocommit(self, value: bool):
+        if value and self._raw.in_transaction:
+            self._raw.commit()
+        self._raw.isolation_level = None if value else ""
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._raw.in_transaction
+
+    def _begin(self, plan: Plan):
+        if plan.lock and not self._raw.in_transaction and self._raw.isolation_level is not None:
+            self._raw.execute("BEGIN IMMEDIATE")
+
+    def cursor(self, dictionary: bool = False, **kwargs) -> Cursor:
+        return Cursor(self, dictionary)
+
+    def start_transaction(self):
+        self._raw.execute("BEGIN")
+
+    def commit(self):
+        try:
+            self._raw.commit()
+        except sqlite3.Error as e:
+            raise _error(e) from e
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def is_connected(self) -> bool:
+        return True
+
+    def close(self):
+        # Uncommitted work is discarded, as when a MySQL session ends; an
+        # open transaction would otherwise keep the database write-locked
+        # for as long as the connection object lives
+        try:
+            if self._raw.in_transaction:
+                self._raw.rollback()
+        except sqlite3.ProgrammingError:  # already closed
+            return
+        self._raw.close()
+
+
+def connect(database: str, uri: bool = False, timeout: float = 5.0) -> Connection:
+    try:
+        raw = sqlite3.connect(
+            database, uri=uri, timeout=timeout, isolation_level="",
+            detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False,
+        )
+    except sqlite3.Error as e:
+        raise _error(e) from e
+    raw.execute("PRAGMA foreign_keys = ON")
+    raw.execute("PRAGMA synchronous = NORMAL")
+    for name, nargs, fn, deterministic in _FUNCTIONS:
+        raw.create_function(name, nargs, fn, deterministic=deterministic)
+
+    # LAST_INSERT_ID(expr) sets the value later read by LAST_INSERT_ID(),
+    # per connection as in MySQL
+    last = [0]
+
+    def last_insert_id(*args):
+        if args:
+            last[0] = args[0]
+        return last[0]
+
+    raw.create_function("LAST_INSERT_ID", -1, last_insert_id)
+    return Connection(raw)
@@ -0,0 +1,173 @@
+"""
+Storage engines: MySQL (the default) or an embedded SQLite database.
+
+Schema and queries are written once, in the MySQL dialect, and run
+unchanged on either engine; the engine only supplies connections.
+
+  DB_ENGINE=mysql    mysql-connector against DB_HOST / DB_NAME
+  DB_ENGINE=sqlite   SQLITE_PATH, a single file in WAL mode (one writer,
+                     concurrent readers), or ":memory:" for a private
+                     in-process database shared by every connection of
+                     the engine (tests and benchmarks, see app.testing)
+
+SQLite statements go through app.sqlite_dialect, which translates them
+on first use and raises errors carrying the same MySQL error numbers
+(1060 duplicate column, 1061 duplicate key name, 1062 duplicate entry,
+...) the schema and handlers check for. Catch storage.Error /
+storage.IntegrityError to handle both drivers.
+
+Read replicas (REPLICA_DSNS) and the SHOW/EXPLAIN diagnostics are
+MySQL-only.
+"""
+import threading
+import uuid
+from typing import Optional
+
+from . import config, sqlite_dialect
+
+try:
+    import mysql.connector
+except ImportError:  # optional dependency
+    mysql = None
+
+Error = (sqlite_dialect.Error,) + ((mysql.connector.Error,) if mysql else ())
+IntegrityError = (sqlite_dialect.IntegrityError,) + ((mysql.connector.IntegrityError,) if mysql else ())
+
+
+class Engine:
+    name = ""
+
+    def connect(self, include_db: bool = True):
+        """New connection, autocommit off."""
+        raise NotImplementedError
+
+    def create_database(self):
+        """Create the database itself if the engine needs it."""
+
+    def column_type(self, cur, table: str, column: str) -> Optional[str]:
+        """Declared type of `table.column` (lower case, no length), or None."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+# ============================================================
+# MYSQL
+# ============================================================
+
+
+class MySQLEngine(Engine):
+    name = "mysql"
+
+    def __init__(self, host: str = None, port: int = None, user: str = None,
+                 password: str = None, database: str = None):
+        if mysql is None:
+            raise RuntimeError("DB_ENGINE=mysql requires mysql-connector-python")
+        self.host = host or config.DB_HOST
+        self.port = port or config.DB_PORT
+        self.user = user or config.DB_USER
+        self.password = config.DB_PASSWORD if password is None else password
+        self.database = database or config.DB_NAME
+
+    def connect(self, include_db: bool = True):
+        cfg = {
+            "host": self.host,
+            "port": self.port,
+            "user": self.user,
+            "password": self.password,
+            "autocommit": False,
+        }
+        if include_db:
+            cfg["database"] = self.database
+        return mysql.connector.connect(**cfg)
+
+    def create_database(self):
+        conn = self.connect(include_db=False)
+        c = conn.cursor()
+        c.execute(f"CREATE DATABASE IF NOT EXISTS `{self.database}`")
+        conn.commit()
+        c.close()
+        conn.close()
+
+    def column_type(self, cur, table: str, column: str) -> Optional[str]:
+        cur.execute("""
+            SELECT DATA_TYPE FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        """, (table, column))
+        row = cur.fetchone()
+        return row[0].lower() if row else None
+
+# ============================================================
+# SQLITE
+# ============================================================
+
+
+class SQLiteEngine(Engine):
+    name = "sqlite"
+
+    def __init__(self, path: str = None, busy_timeout_ms: int = None):
+        path = path or config.SQLITE_PATH
+        self.busy_timeout = (busy_timeout_ms or config.SQLITE_BUSY_TIMEOUT_MS) / 1000.0
+        self._anchor = None
+        if path == ":memory:":
+            # Named in-memory database (memdb VFS): visible to every
+            # connection of this engine and gone once the last one closes,
+            # so one connection is kept open for the engine's lifetime
+            self.path = f"file:/medlab-{uuid.uuid4().hex}?vfs=memdb"
+            self.uri = True
+            self._anchor = self.connect()
+            self._anchor._raw.execute("PRAGMA journal_mode = MEMORY")
+        else:
+            self.path = path
+            self.uri = False
+            conn = self.connect()
+            conn._raw.execute("PRAGMA journal_mode = WAL")
+            conn.close()
+
+    def connect(self, include_db: bool = True):
+        return sqlite_dialect.connect(self.path, uri=self.uri, timeout=self.busy_timeout)
+
+    def column_type(self, cur, table: str, column: str) -> Optional[str]:
+        cur.execute(f"PRAGMA table_info({table})")
+        for row in cur.fetchall():
+            if row[1].lower() == column.lower():
+                return row[2].split("(")[0].strip().lower()
+        return None
+
+    def close(self):
+        if self._anchor is not None:
+            self._anchor.close()
+            self._anchor = None
+
+# ============================================================
+# CURRENT ENGINE
+# ============================================================
+
+_engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
+
+
+def create_engine(name: str = None, **kwargs) -> Engine:
+    name = (name or config.DB_ENGINE).lower()
+    if name == "mysql":
+        return MySQLEngine(**kwargs)
+    if name == "sqlite":
+        return SQLiteEngine(**kwargs)
+    raise ValueError(f"Unknown DB_ENGINE {name!r} (expected mysql or sqlite)")
+
+
+def get_engine() -> Engine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine()
+    return _engine
+
+
+def set_engine(engine: Optional[Engine]) -> Optional[Engine]:
+    """Use `engine` from now on; returns the previous one."""
+    global _engine
+    with _engine_lock:
+        previous, _engine = _engine, engine
+    return previous
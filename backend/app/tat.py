@@ -0,0 +1,165 @@
+"""
+Turnaround time (TAT) tracking.
+
+test_orders carries one timestamp per status transition, stamped by the
+write handlers the first time the order reaches that status:
+
+  sample_collected_at  SAMPLE_COLLECTED
+  results_entered_at   RESULTS_ENTERED (or straight to REPORT_READY)
+  report_ready_at      REPORT_READY
+
+/api/analytics/tat scans orders by report_ready_at through
+idx_orders_tat and computes p50/p90/p99 collection-to-report and
+order-to-report times, grouped by any of priority, category and hour of
+day (hour the sample was collected, or the order placed).
+"""
+from datetime import date, timedelta
+from typing import List, Optional
+
+import numpy as np
+
+from . import config
+from .qc import group_stats
+
+TAT_COLUMNS = (
+    "sample_collected_at DATETIME NULL",
+    "results_entered_at DATETIME NULL",
+    "report_ready_at DATETIME NULL",
+)
+
+TAT_INDEX_DDL = """
+    CREATE INDEX idx_orders_tat
+    ON test_orders (report_ready_at, priority, sample_collected_at, order_date)
+"""
+
+# Append after `status=%s` in an UPDATE test_orders SET list: MySQL applies
+# single-table assignments left to right, so `status` is the new value here.
+STAMP_SQL = """
+    sample_collected_at = IF(status = 'SAMPLE_COLLECTED',
+                             COALESCE(sample_collected_at, NOW()), sample_collected_at),
+    results_entered_at = IF(status IN ('RESULTS_ENTERED', 'REPORT_READY'),
+                            COALESCE(results_entered_at, NOW()), results_entered_at),
+    report_ready_at = IF(status = 'REPORT_READY',
+                         COALESCE(report_ready_at, NOW()), report_ready_at)
+"""
+
+DIMENSIONS = ("priority", "category", "hour")
+PERCENTILES = (50, 90, 99)
+PRIORITIES = ("NORMAL", "URGENT")
+
+
+def parse_dimensions(group_by: Optional[str]) -> List[str]:
+    dims = [d.strip().lower() for d in (group_by or "priority").split(",") if d.strip()]
+    unknown = [d for d in dims if d not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown groupBy dimension(s): {', '.join(unknown)}")
+    return [d for d in DIMENSIONS if d in dims]
+
+
+def _fetch(cur, date_from: date, date_to: date, by_category: bool):
+    start = "COALESCE(o.sample_collected_at, o.order_date)"
+    select = f"""
+        o.priority = 'URGENT',
+        HOUR({start}),
+        TIMESTAMPDIFF(SECOND, o.sample_collected_at, o.report_ready_at),
+        TIMESTAMPDIFF(SECOND, o.order_date, o.report_ready_at)
+    """
+    if by_category:
+        # An order counts once in every category it contains.
+        cur.execute(f"""
+            SELECT {select}, c.category_id
+            FROM test_orders o
+            JOIN (
+                SELECT DISTINCT tot.order_id, COALESCE(t.category_id, 0) AS category_id
+                FROM test_orders o2
+                JOIN test_order_tests tot ON tot.order_id = o2.order_id
+                JOIN tests t ON t.test_id = tot.test_id
+                WHERE o2.report_ready_at >= %s AND o2.report_ready_at < %s
+            ) c ON c.order_id = o.order_id
+        """, (date_from, date_to + timedelta(days=1)))
+    else:
+        cur.execute(f"""
+            SELECT {select}, 0
+            FROM test_orders o
+            WHERE o.report_ready_at >= %s AND o.report_ready_at < %s
+        """, (date_from, date_to + timedelta(days=1)))
+    rows = cur.fetchall()
+    if not rows:
+        return np.empty((0, 5))
+    # NULL collection time -> NaN
+    return np.array(rows, dtype=np.float64)
+
+
+def _summaries(keys, secs, urgent, n_groups):
+    """Percentiles (minutes) and SLA breach rate of the non-NaN `secs`."""
+    ok = ~np.isnan(secs)
+    out = {"count": np.bincount(keys[ok], minlength=n_groups)}
+    if not ok.any():
+        return out, {}
+    s = group_stats(keys[ok], secs[ok] / 60.0, np.zeros(ok.sum()), n_groups,
+                    bins=1, percentiles=PERCENTILES)
+    sla = np.where(urgent[ok] > 0, config.TAT_SLA_URGENT_MINUTES, config.TAT_SLA_NORMAL_MINUTES)
+    breached = np.bincount(keys[ok], weights=(secs[ok] / 60.0) > sla, minlength=n_groups)
+    out["breach_rate"] = breached / np.maximum(out["count"], 1)
+    return out, s["percentiles"]
+
+
+def _num(x):
+    x = float(x)
+    return None if np.isnan(x) else round(x, 1)
+
+
+def query(cur, date_from: date, date_to: date, dims: List[str]):
+    data = _fetch(cur, date_from, date_to, "category" in dims)
+    if not len(data):
+        return []
+
+    urgent, hour, collect, total, category = data.T
+    columns = []
+    if "priority" in dims:
+        columns.append(urgent.astype(np.int64))
+    if "category" in dims:
+        columns.append(category.astype(np.int64))
+    if "hour" in dims:
+        columns.append(hour.astype(np.int64))
+    if columns:
+        combos, keys = np.unique(np.column_stack(columns), axis=0, return_inverse=True)
+        keys = keys.ravel()
+    else:
+        combos, keys = np.zeros((1, 0), dtype=np.int64), np.zeros(len(data), dtype=np.int64)
+    n_groups = len(combos)
+    orders = np.bincount(keys, minlength=n_groups)
+
+    names = {}
+    if "category" in dims:
+        cur.execute("SELECT category_id, category_name FROM test_categories")
+        names = dict(cur.fetchall())
+
+    metrics = {
+        "collect_to_report": _summaries(keys, collect, urgent, n_groups),
+        "order_to_report": _summaries(keys, total, urgent, n_groups),
+    }
+
+    rows = []
+    for g, combo in enumerate(combos):
+        row, i = {}, 0
+        if "priority" in dims:
+            row["priority"] = PRIORITIES[combo[i]].lower()
+            i += 1
+        if "category" in dims:
+            row["category_id"] = int(combo[i]) or None
+            row["category_name"] = names.get(row["category_id"])
+            i += 1
+        if "hour" in dims:
+            row["hour"] = int(combo[i])
+        row["orders"] = int(orders[g])
+        for name, (summary, pct) in metrics.items():
+            entry = {"count": int(summary["count"][g])}
+            for q in PERCENTILES:
+                entry[f"p{q}_minutes"] = _num(pct[q][g]) if pct and entry["count"] else None
+            entry["sla_breach_rate"] = (
+                round(float(summary["breach_rate"][g]), 4) if entry["count"] else None
+            )
+            row[name] = entry
+        rows.append(row)
+    return rows
@@ -0,0 +1,89 @@
+"""
+Helpers for tests: an in-process database, and guards against
+query-count regressions (N+1 loops).
+
+    from app.testing import assert_max_queries, assert_endpoint_queries, memory_client
+
+    @pytest.fixture
+    def client():
+        with memory_client() as c:      # fresh in-memory SQLite, seeded
+            yield c
+
+    def test_tests_catalogue_is_not_n_plus_one(client):
+        assert_endpoint_queries(client, "GET", "/api/tests", max_queries=3)
+
+    def test_create_order_budget(client):
+        with assert_max_queries(8):
+            client.post("/api/orders", json=payload)
+"""
+from contextlib import contextmanager
+
+from . import accession, cache, storage
+from .tracing import capture_queries
+
+
+@contextmanager
+def memory_database(seed: bool = False):
+    """
+    Run the block against a fresh in-memory SQLite database with the full
+    schema (and the mock data set when `seed` is true). Yields the engine;
+    the previous engine is restored afterwards.
+    """
+    from . import main, mock_data
+
+    engine = storage.SQLiteEngine(":memory:")
+    previous = storage.set_engine(engine)
+    cache.invalidate_all()
+    accession.reset()
+    try:
+        main.init_database_and_tables()
+        main._tables_ready = True
+        accession.init(main.get_raw_connection)
+        if seed:
+            conn = engine.connect()
+            mock_data.populate(conn, clear_existing=False)
+            conn.close()
+        yield engine
+    finally:
+        storage.set_engine(previous)
+        cache.invalidate_all()
+        accession.reset()
+        main._tables_ready = False
+        engine.close()
+
+
+@contextmanager
+def memory_client(seed: bool = True):
+    """TestClient for the app (startup and shutdown included) on memory_database()."""
+    from fastapi.testclient import TestClient
+
+    from .main import app
+
+    with memory_database(seed=seed):
+        with TestClient(app) as client:
+            yield client
+
+
+@contextmanager
+def assert_max_queries(max_queries: int, label: str = ""):
+    """
+    Fail with the full statement listing if the block executes more than
+    `max_queries` SQL statements.
+    """
+    with capture_queries() as trace:
+        yield trace
+    if trace.count > max_queries:
+        where = f" in {label}" if label else ""
+        raise AssertionError(
+            f"Expected at most {max_queries} queries{where}, got {trace.count}:\n{trace.summary()}"
+        )
+
+
+def assert_endpoint_queries(client, method: str, url: str, max_queries: int, **kwargs):
+    """
+    Issue one request through a Starlette/FastAPI TestClient and assert its
+    query budget. Returns the response for further assertions.
+    """
+    with assert_max_queries(max_queries, label=f"{method.upper()} {url}"):
+        response = client.request(method, url, **kwargs)
+    return response
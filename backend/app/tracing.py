@@ -0,0 +1,345 @@
+"""
+Per-request SQL tracing and slow-query logging.
+
+TracedCursor extends the metrics cursor so that, when a trace is active,
+every statement is recorded with its normalized text, parameter count,
+row count and duration. Statements slower than SLOW_QUERY_MS are written to
+the `medlab.slow_query` logger together with their EXPLAIN plan, which is
+captured on a separate connection by a background thread so the request
+never waits for it.
+
+In DEBUG mode QueryTraceMiddleware traces every request and reports the
+totals in `Server-Timing` / `X-Query-Count` response headers.
+"""
+import logging
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, List, Optional
+
+from . import config
+from .metrics import InstrumentedCursor
+
+logger = logging.getLogger("medlab.slow_query")
+
+# ============================================================
+# SQL NORMALIZATION
+# ============================================================
+
+_RE_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_RE_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_RE_PLACEHOLDER = re.compile(r"%s|%\(\w+\)s")
+_RE_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_RE_SPACE = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Collapse whitespace and replace literals/placeholders with `?` so that
+    statements differing only in their values group together.
+    """
+    s = _RE_STRING.sub("?", sql)
+    s = _RE_PLACEHOLDER.sub("?", s)
+    s = _RE_NUMBER.sub("?", s)
+    s = _RE_IN_LIST.sub("IN (...)", s)
+    return _RE_SPACE.sub(" ", s).strip()
+
+
+def _param_count(params) -> int:
+    if params is None:
+        return 0
+    try:
+        return len(params)
+    except TypeError:
+        return 1
+
+# ============================================================
+# TRACE RECORDS
+# ============================================================
+
+
+class QueryRecord:
+    __slots__ = ("sql", "params", "rows", "duration")
+
+    def __init__(self, sql: str, params: int, rows: int, duration: float):
+        self.sql = sql
+        self.params = params
+        self.rows = rows
+        self.duration = duration
+
+    @property
+    def statement(self) -> str:
+        return normalize_sql(self.sql)
+
+    def as_dict(self):
+        return {
+            "statement": self.statement,
+            "params": self.params,
+            "rows": self.rows,
+            "durationMs": round(self.duration * 1000, 3),
+        }
+
+
+class RequestTrace:
+    def __init__(self):
+        self.queries: List[QueryRecord] = []
+        self._lock = threading.Lock()
+
+    def add(self, record: QueryRecord):
+        with self._lock:
+            self.queries.append(record)
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def total_time(self) -> float:
+        return sum(q.duration for q in self.queries)
+
+    def summary(self) -> str:
+        lines = [f"{self.count} queries, {self.total_time * 1000:.2f} ms total"]
+        for q in self.queries:
+            lines.append(
+                f"  {q.duration * 1000:8.2f} ms  rows={q.rows:<6} params={q.params:<3} {q.statement}"
+            )
+        return "\n".join(lines)
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("medlab_request_trace", default=None)
+
+# Traces registered from outside the request context (e.g. a test driving the
+# app through TestClient, whose event loop runs in another thread).
+_global_traces: List[RequestTrace] = []
+_global_lock = threading.Lock()
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def capture_queries():
+    """
+    Record every statement executed in this process while the block runs,
+    regardless of which thread or request context executes it.
+    """
+    trace = RequestTrace()
+    with _global_lock:
+        _global_traces.append(trace)
+    try:
+        yield trace
+    finally:
+        with _global_lock:
+            _global_traces.remove(trace)
+
+# ============================================================
+# SLOW QUERY LOG + EXPLAIN
+# ============================================================
+
+_EXPLAINABLE = ("SELECT", "UPDATE", "DELETE", "INSERT", "REPLACE", "WITH")
+_EXPLAIN_INTERVAL = 600.0
+_EXPLAIN_SEEN_MAX = 1000  # statements remembered for the interval, oldest dropped first
+
+_explain_connect: Optional[Callable] = None
+_explain_queue: "queue.Queue" = queue.Queue(maxsize=100)
+_explain_seen = {}
+_explain_seen_lock = threading.Lock()
+_explain_thread: Optional[threading.Thread] = None
+_explain_lock = threading.Lock()
+
+
+def configure(connect: Callable):
+    """
+    Register a zero-argument factory returning a raw DB connection; used to
+    run EXPLAIN for slow statements outside the request's own connection.
+    """
+    global _explain_connect
+    _explain_connect = connect
+
+
+def _ensure_explain_worker():
+    global _explain_thread
+    with _explain_lock:
+        if _explain_thread is None or not _explain_thread.is_alive():
+            _explain_thread = threading.Thread(
+                target=_explain_worker, name="medlab-explain", daemon=True
+            )
+            _explain_thread.start()
+
+
+def _explain_worker():
+    while True:
+        sql, params, statement, duration = _explain_queue.get()
+        plan = None
+        try:
+            conn = _explain_connect()
+            try:
+                cur = conn.cursor()
+                cur.execute("EXPLAIN " + sql, params)
+                cols = [c[0] for c in cur.description]
+                plan = [dict(zip(cols, row)) for row in cur.fetchall()]
+                cur.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            plan = f"<explain failed: {e}>"
+        logger.warning("slow query %.1f ms: %s\nEXPLAIN: %s", duration * 1000, statement, plan)
+
+
+def _warn_slow(statement: str, duration: float, rows: Optional[int]):
+    if rows is None:
+        logger.warning("slow query %.1f ms: %s", duration * 1000, statement)
+    else:
+        logger.warning("slow query %.1f ms rows=%s: %s", duration * 1000, rows, statement)
+
+
+def _log_slow(sql: str, params, duration: float, rows: Optional[int]):
+    """`rows` is None for result sets, which are not fetched yet when this runs."""
+    statement = normalize_sql(sql)
+    verb = statement.split(" ", 1)[0].upper()
+    if not (config.SLOW_QUERY_EXPLAIN and _explain_connect and verb in _EXPLAINABLE):
+        _warn_slow(statement, duration, rows)
+        return
+
+    now = time.monotonic()
+    with _explain_seen_lock:
+        last = _explain_seen.pop(statement, None)
+        if last is not None and now - last < _EXPLAIN_INTERVAL:
+            _explain_seen[statement] = last
+            recent = True
+        else:
+            _explain_seen[statement] = now
+            recent = False
+        while len(_explain_seen) > _EXPLAIN_SEEN_MAX:
+            del _explain_seen[next(iter(_explain_seen))]
+    if recent:
+        _warn_slow(statement, duration, rows)
+        return
+
+    try:
+        _explain_queue.put_nowait((sql, params, statement, duration))
+        _ensure_explain_worker()
+    except queue.Full:
+        _warn_slow(statement, duration, rows)
+
+# ============================================================
+# TRACED CURSOR
+# ============================================================
+
+
+class TracedCursor(InstrumentedCursor):
+    """
+    InstrumentedCursor that also feeds the active RequestTrace(s) and the
+    slow-query log. Rows for SELECTs are counted as they are fetched.
+    """
+
+    __slots__ = ("_last",)
+
+    def __init__(self, cursor):
+        super().__init__(cursor)
+        self._last = None
+
+    def _trace(self, sql, params, elapsed):
+        trace = _current_trace.get()
+        targets = _global_traces
+        if trace is None and not targets and elapsed * 1000 < config.SLOW_QUERY_MS:
+            self._last = None
+            return
+
+        # Result sets are counted as they are fetched; DML reports rowcount.
+        has_result = bool(getattr(self._cursor, "description", None))
+        if has_result:
+            rows = 0
+        else:
+            rows = max(getattr(self._cursor, "rowcount", 0) or 0, 0)
+        record = QueryRecord(sql, _param_count(params), rows, elapsed)
+        self._last = record
+        if trace is not None:
+            trace.add(record)
+        if targets:
+            with _global_lock:
+                for t in targets:
+                    if t is not trace:
+                        t.add(record)
+        if elapsed * 1000 >= config.SLOW_QUERY_MS:
+            _log_slow(sql, params, elapsed, None if has_result else record.rows)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - t0
+            self._record(operation, elapsed)
+            self._trace(operation, params, elapsed)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - t0
+            self._record(operation, elapsed)
+            self._trace(operation, None, elapsed)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if self._last is not None and row is not None:
+            self._last.rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        if self._last is not None:
+            self._last.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        if self._last is not None:
+            self._last.rows += len(rows)
+        return rows
+
+# ============================================================
+# DEBUG MIDDLEWARE
+# ============================================================
+
+
+class QueryTraceMiddleware:
+    """
+    In DEBUG mode, trace every request and expose the query count and DB time
+    as `Server-Timing: db;dur=<ms>;desc="<n> queries"` and `X-Query-Count`.
+    """
+
+    def __init__(self, app, enabled: Optional[bool] = None):
+        self.app = app
+        self.enabled = config.DEBUG if enabled is None else enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = _current_trace.set(trace)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                db_ms = trace.total_time * 1000
+                headers.append((
+                    b"server-timing",
+                    f'db;dur={db_ms:.2f};desc="{trace.count} queries"'.encode("latin-1"),
+                ))
+                headers.append((b"x-query-count", str(trace.count).encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
@@ -0,0 +1,61 @@
+"""
+Benchmark: API requests/sec in-process, on an in-memory SQLite database.
+
+Builds a fresh database (schema + mock data) through app.testing, reports
+how long that took, then times the read endpoints and order entry through
+the ASGI app with a TestClient. No MySQL server or network is involved, so
+the numbers compare handler and query changes, not database tuning.
+
+    cd backend
+    python -m benchmarks.bench_api --requests 200
+"""
+import argparse
+import contextlib
+import io
+import time
+
+READS = ("/api/patients", "/api/tests", "/api/orders", "/api/dashboard", "/api/reports",
+         "/api/orders/1", "/api/changes?limit=100")
+
+
+def bench(fn, n):
+    t0 = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return n / (time.perf_counter() - t0)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    from app.testing import memory_client
+    t1 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # mock data progress
+        client_cm = memory_client(seed=True)
+        client = client_cm.__enter__()
+    t2 = time.perf_counter()
+    print(f"import {t1 - t0:.3f}s, database + startup {t2 - t1:.3f}s")
+
+    try:
+        test_ids = [t["test_id"] for t in client.get("/api/tests").json()[:3]]
+        patient_id = client.get("/api/patients").json()[0]["patient_id"]
+
+        print(f"{'endpoint':<28}{'req/s':>10}")
+        for url in READS:
+            client.get(url).raise_for_status()
+            rate = bench(lambda i: client.get(url), args.requests)
+            print(f"{'GET ' + url:<28}{rate:>10,.0f}")
+
+        order = {"patientId": patient_id, "priority": "normal", "testIds": test_ids}
+        rate = bench(lambda i: client.post("/api/orders", json=order).raise_for_status(), args.requests)
+        print(f"{'POST /api/orders':<28}{rate:>10,.0f}")
+    finally:
+        with contextlib.redirect_stdout(io.StringIO()):
+            client_cm.__exit__(None, None, None)
+
+
+if __name__ == "__main__":
+    main()
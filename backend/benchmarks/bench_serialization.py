@@ -0,0 +1,115 @@
+"""
+Micro-benchmark: rows/sec serialized for /api/orders and /api/patients.
+
+Compares the legacy path (dictionary cursor rows, Python enum mapping,
+jsonable_encoder + json.dumps) with the fast path (tuple cursor rows with
+enums mapped in SQL, orjson via FastJSONResponse). Rows are synthesized in
+the shape the endpoints' SELECTs return, so no database is needed.
+
+    cd backend
+    python -m benchmarks.bench_serialization --rows 50000
+"""
+import argparse
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+from app.main import map_priority_from_db, map_status_from_db
+from app.serialization import FastJSONResponse, fetch_dicts
+
+ORDER_COLS = ("order_id", "patient_name", "order_date", "priority", "status", "tests_count")
+PATIENT_COLS = ("patient_id", "full_name", "date_of_birth", "gender", "phone", "email",
+                "address", "created_at")
+
+
+class FakeCursor:
+    def __init__(self, cols, rows):
+        self.description = [(c,) for c in cols]
+        self._rows = rows
+
+    def fetchall(self):
+        return self._rows
+
+
+def make_order_rows(n, mapped_in_sql):
+    now = datetime(2025, 1, 1, 9, 30)
+    api_priority = {"URGENT": "urgent", "NORMAL": "normal"}
+    api_status = {"PENDING": "pending", "SAMPLE_COLLECTED": "in-progress",
+                  "RESULTS_ENTERED": "in-progress", "REPORT_READY": "completed"}
+    rows = []
+    for i in range(n):
+        priority = random.choice(("NORMAL", "URGENT"))
+        status = random.choice(tuple(api_status))
+        if mapped_in_sql:
+            priority, status = api_priority[priority], api_status[status]
+        rows.append((i + 1, f"Patient {i % 997}", now - timedelta(minutes=i),
+                     priority, status, random.randint(1, 5)))
+    return rows
+
+
+def make_patient_rows(n):
+    now = datetime(2025, 1, 1, 9, 30)
+    return [
+        (i + 1, f"Patient {i}", date(1970 + i % 40, 1 + i % 12, 1 + i % 28),
+         random.choice("MF"), "+91-9000000000", f"p{i}@email.com",
+         f"{i}, Jayanagar, Mysuru, Karnataka", now - timedelta(minutes=i))
+        for i in range(n)
+    ]
+
+
+def legacy_orders(rows):
+    dict_rows = [dict(zip(ORDER_COLS, r)) for r in rows]  # dictionary=True cursor
+    for r in dict_rows:
+        r["priority"] = map_priority_from_db(r["priority"])
+        r["status"] = map_status_from_db(r["status"])
+    return JSONResponse(jsonable_encoder(dict_rows)).body
+
+
+def fast_orders(rows):
+    return FastJSONResponse(fetch_dicts(FakeCursor(ORDER_COLS, rows))).body
+
+
+def legacy_patients(rows):
+    dict_rows = [dict(zip(PATIENT_COLS, r)) for r in rows]
+    return JSONResponse(jsonable_encoder(dict_rows)).body
+
+
+def fast_patients(rows):
+    return FastJSONResponse(fetch_dicts(FakeCursor(PATIENT_COLS, rows))).body
+
+
+def bench(fn, rows, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - t0)
+    return len(rows) / best
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--rows", type=int, default=50000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    random.seed(42)
+    cases = [
+        ("/api/orders", legacy_orders, make_order_rows(args.rows, False),
+         fast_orders, make_order_rows(args.rows, True)),
+        ("/api/patients", legacy_patients, make_patient_rows(args.rows),
+         fast_patients, make_patient_rows(args.rows)),
+    ]
+
+    print(f"{'endpoint':<16}{'legacy rows/s':>16}{'fast rows/s':>16}{'speedup':>10}")
+    for name, legacy_fn, legacy_rows, fast_fn, fast_rows in cases:
+        legacy = bench(legacy_fn, legacy_rows, args.repeat)
+        fast = bench(fast_fn, fast_rows, args.repeat)
+        print(f"{name:<16}{legacy:>16,.0f}{fast:>16,.0f}{fast / legacy:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
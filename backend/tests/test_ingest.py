@@ -0,0 +1,90 @@
+"""Analyzer result ingestion over MLLP (app.ingest) against the embedded database."""
+import asyncio
+
+import pytest
+
+from app import ingest, storage
+from app.testing import memory_database
+
+
+@pytest.fixture(scope="module")
+def db():
+    with memory_database(seed=True):
+        conn = storage.get_engine().connect()
+        yield conn
+        conn.close()
+
+
+def stored(conn, order_id, test_id):
+    cur = conn.cursor()
+    cur.execute("SELECT result_value FROM test_order_tests WHERE order_id = %s AND test_id = %s",
+                (order_id, test_id))
+    (value,), = cur.fetchall()
+    cur.close()
+    conn.commit()
+    return value
+
+
+async def with_server(run):
+    writer = ingest.ResultWriter(storage.get_engine().connect)
+    server = ingest.IngestServer(writer.apply)
+    sockets = (await server.start("127.0.0.1", 0)).sockets
+    try:
+        return await run(sockets[0].getsockname()[1])
+    finally:
+        await server.close()
+        writer.close()
+
+
+async def send_raw(port, message):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(ingest.frame(message))
+    await writer.drain()
+    ack = (await reader.readuntil(ingest.FRAME_END)).decode()
+    writer.close()
+    return ack
+
+
+def test_results_are_stored_and_acked(db):
+    orders = ingest._pending_lines(6)
+    assert orders
+    stats = asyncio.run(with_server(lambda port: ingest.simulate("127.0.0.1", port, orders, 2, 4)))
+
+    assert (stats["AA"], stats["AE"], stats["AR"]) == (len(orders), 0, 0)
+    for order_id, tests in orders.items():
+        for test_id, _, value, _ in tests:
+            assert float(stored(db, order_id, test_id)) == pytest.approx(value)
+
+
+def test_unknown_test_is_ae_and_garbage_is_ar(db):
+    (order_id, tests), = ingest._pending_lines(1).items()
+    test_id, name, _, unit = tests[0]
+    message = ingest.build_oru("CTRL1", order_id, [(test_id, name, 4.5, unit), (999999, "Nope", 1.0, None)])
+
+    async def run(port):
+        return await send_raw(port, message), await send_raw(port, "not hl7\r")
+
+    ae, ar = asyncio.run(with_server(run))
+    assert "MSA|AE|CTRL1|no matching order line for OBX 2" in ae
+    assert "MSA|AR|" in ar
+    assert float(stored(db, order_id, test_id)) == 4.5
+
+
+def test_close_finishes_open_connections(db):
+    async def run(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(ingest.VT + b"MSH|partial")  # frame never completed
+        await writer.drain()
+        await asyncio.sleep(0.05)
+        return reader, writer
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        errors = []
+        loop.set_exception_handler(lambda _, ctx: errors.append(ctx))
+        reader, writer = await asyncio.wait_for(with_server(run), 5)
+        writer.close()
+        assert [t for t in asyncio.all_tasks() if t is not asyncio.current_task()] == []
+        return errors
+
+    assert asyncio.run(main()) == []
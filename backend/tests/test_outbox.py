@@ -0,0 +1,79 @@
+"""Outbox delivery end to end: a write through the API reaches a local webhook."""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import orjson
+import pytest
+
+from app import config, outbox, storage
+from app.testing import memory_client
+
+
+@pytest.fixture
+def receiver():
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = orjson.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+            received.extend(body["events"])
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/events", received
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(receiver, monkeypatch):
+    url, _ = receiver
+    monkeypatch.setattr(config, "OUTBOX_WEBHOOK_URLS", [url])
+    monkeypatch.setattr(config, "OUTBOX_SPOOL_DIR", "")
+    monkeypatch.setattr(config, "OUTBOX_POLL_MS", 50)
+    # The dispatcher (and its sinks) is created at startup, once per process
+    monkeypatch.setattr(outbox, "_dispatcher", None)
+    with memory_client(seed=True) as c:
+        yield c
+
+
+def wait_for(check, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = check()
+        if result:
+            return result
+        time.sleep(0.02)
+    raise AssertionError("timed out")
+
+
+def test_order_event_is_delivered_to_webhook(client, receiver):
+    _, received = receiver
+    test_ids = [t["test_id"] for t in client.get("/api/tests").json()[:2]]
+    patient_id = client.get("/api/patients").json()[0]["patient_id"]
+    r = client.post("/api/orders", json={"patientId": patient_id, "priority": "normal", "testIds": test_ids})
+    assert r.status_code == 200, r.text
+    order_id = r.json()["order_id"]
+
+    event = wait_for(lambda: next((e for e in received if e["type"] == "order.created"), None))
+    assert event["entity_id"] == order_id
+    assert event["data"]["test_ids"] == test_ids
+    assert event["attempt"] == 1
+
+    def status():
+        conn = storage.get_engine().connect()
+        cur = conn.cursor()
+        cur.execute("SELECT status, delivered_at FROM event_outbox WHERE event_id = %s", (event["id"],))
+        row = cur.fetchone()
+        conn.close()
+        return row if row[0] == "DELIVERED" else None
+
+    _, delivered_at = wait_for(status)
+    assert delivered_at is not None
@@ -0,0 +1,115 @@
+"""Query-count guards (app.testing) and the slow-query log (app.tracing)."""
+import logging
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import cache, config, tracing
+from app.testing import assert_endpoint_queries, assert_max_queries, memory_client
+
+
+class FakeCursor:
+    """Stands in for a driver cursor: SELECTs return two rows."""
+
+    def __init__(self):
+        self.description = None
+        self.rowcount = -1
+        self._rows = []
+
+    def execute(self, operation, params=None):
+        if operation.lstrip().upper().startswith("SELECT"):
+            self.description = [("id",)]
+            self._rows = [(1,), (2,)]
+            self.rowcount = -1
+        else:
+            self.description = None
+            self._rows = []
+            self.rowcount = 3
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+
+def run(*statements):
+    cur = tracing.TracedCursor(FakeCursor())
+    for sql in statements:
+        cur.execute(sql, (1,))
+        if cur.description:
+            cur.fetchall()
+
+
+def test_within_budget_counts_statements_and_rows():
+    with assert_max_queries(2) as trace:
+        run("SELECT id FROM patients WHERE patient_id = %s", "UPDATE patients SET phone = NULL WHERE patient_id = %s")
+    assert trace.count == 2
+    assert [q.rows for q in trace.queries] == [2, 3]
+
+
+def test_over_budget_lists_statements():
+    with pytest.raises(AssertionError) as e:
+        with assert_max_queries(1, label="loop"):
+            run(*["SELECT id FROM tests WHERE test_id = %s"] * 3)
+    message = str(e.value)
+    assert "Expected at most 1 queries in loop, got 3" in message
+    assert message.count("SELECT id FROM tests WHERE test_id = ?") == 3
+
+
+def test_endpoint_budget():
+    app = FastAPI()
+
+    @app.get("/n-plus-one")
+    def n_plus_one():
+        run(*["SELECT id FROM tests WHERE test_id = %s"] * 4)
+        return {"ok": True}
+
+    client = TestClient(app)
+    assert assert_endpoint_queries(client, "GET", "/n-plus-one", max_queries=4).status_code == 200
+    with pytest.raises(AssertionError):
+        assert_endpoint_queries(client, "GET", "/n-plus-one", max_queries=3)
+
+
+@pytest.fixture(scope="module")
+def client():
+    with memory_client(seed=True) as c:
+        yield c
+
+
+def test_tests_catalogue_is_not_n_plus_one(client):
+    # Tests, reference ranges and panel components: one query each
+    cache.invalidate_all()
+    assert_endpoint_queries(client, "GET", "/api/tests", max_queries=3)
+    assert_endpoint_queries(client, "GET", "/api/tests", max_queries=0)
+
+
+@pytest.mark.parametrize("n_tests", [1, 8])
+def test_create_order_budget_does_not_grow_with_tests(client, n_tests):
+    test_ids = [t["test_id"] for t in client.get("/api/tests").json()[:n_tests]]
+    patient_id = client.get("/api/patients").json()[0]["patient_id"]
+    with assert_max_queries(8, label="POST /api/orders"):
+        r = client.post("/api/orders", json={"patientId": patient_id, "priority": "normal", "testIds": test_ids})
+    assert r.status_code == 200, r.text
+
+
+def test_slow_select_is_logged_without_rows(monkeypatch, caplog):
+    monkeypatch.setattr(config, "SLOW_QUERY_MS", 0)
+    monkeypatch.setattr(config, "SLOW_QUERY_EXPLAIN", False)
+    with caplog.at_level(logging.WARNING, logger="medlab.slow_query"):
+        run("SELECT id FROM patients WHERE patient_id = %s", "DELETE FROM patients WHERE patient_id = %s")
+    select, delete = [r.getMessage() for r in caplog.records]
+    assert "rows=" not in select
+    assert "rows=3" in delete
+
+
+def test_explain_memory_is_bounded(monkeypatch):
+    monkeypatch.setattr(tracing, "_explain_connect", lambda: None)
+    monkeypatch.setattr(tracing, "_ensure_explain_worker", lambda: None)
+    monkeypatch.setattr(tracing, "_explain_queue", tracing.queue.Queue())
+    monkeypatch.setattr(tracing, "_explain_seen", {})
+    monkeypatch.setattr(tracing, "_EXPLAIN_SEEN_MAX", 10)
+    monkeypatch.setattr(config, "SLOW_QUERY_EXPLAIN", True)
+    for i in range(50):
+        tracing._log_slow(f"SELECT * FROM t{i}", None, 1.0, None)
+    assert len(tracing._explain_seen) == 10
+    assert "SELECT * FROM t49" in tracing._explain_seen
@@ -0,0 +1,46 @@
+"""On-disk PDF report cache (app.reports)."""
+import os
+import time
+
+import pytest
+
+from app import config, reports
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "REPORT_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def put(key, age_days, size=10):
+    path = reports.write_cached(key, b"x" * size)
+    then = time.time() - age_days * 86400
+    os.utime(path, (then, then))
+    return path
+
+
+def cached(cache_dir):
+    return sorted(name for _, _, files in os.walk(cache_dir) for name in files)
+
+
+def test_prune_drops_unused_reports_and_stale_temp_files(cache_dir):
+    put("aa01", age_days=40)
+    put("bb01", age_days=2)
+    tmp = cache_dir / "bb" / "render.tmp"
+    tmp.write_bytes(b"partial")
+    os.utime(tmp, (time.time() - 7200,) * 2)
+
+    assert reports.prune_cache(max_age_days=30, max_mb=10) == (2, 17)
+    assert cached(cache_dir) == ["bb01.pdf"]
+
+
+def test_prune_evicts_least_recently_used_over_size(cache_dir):
+    put("aa01", age_days=3, size=600_000)
+    put("bb01", age_days=2, size=600_000)
+    put("cc01", age_days=1, size=10)
+    assert reports.read_cached("aa01") is not None  # a hit counts as a use
+
+    removed, _ = reports.prune_cache(max_age_days=30, max_mb=1)
+    assert removed == 1
+    assert cached(cache_dir) == ["aa01.pdf", "cc01.pdf"]
@@ -0,0 +1,249 @@
+"""The app on the embedded SQLite engine (app.storage, app.sqlite_dialect)."""
+import os
+import subprocess
+import sys
+import time
+from datetime import date, datetime
+
+import pytest
+
+from app import accession, archive, config, outbox, results, storage, tat
+from app.testing import memory_client
+
+
+@pytest.fixture(scope="module")
+def client():
+    # Short busy timeout: a leaked write lock fails fast instead of after 5s
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(config, "SQLITE_BUSY_TIMEOUT_MS", 500)
+        with memory_client(seed=True) as c:
+            yield c
+
+
+@pytest.fixture
+def db(client):
+    conn = storage.get_engine().connect()
+    yield conn
+    conn.close()
+
+
+def query(conn, sql, params=()):
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+
+def new_patient(client, name="Lock Test"):
+    r = client.post("/api/patients", json={"fullName": name, "gender": "female"})
+    assert r.status_code == 200, r.text
+    return r.json()["patient_id"]
+
+
+def new_order(client):
+    test_ids = [t["test_id"] for t in client.get("/api/tests").json()[:2]]
+    r = client.post("/api/orders", json={
+        "patientId": new_patient(client, "Order Test"), "priority": "normal", "testIds": test_ids,
+    })
+    assert r.status_code == 200, r.text
+    return r.json()["order_id"], test_ids
+
+# ============================================================
+# WITHOUT MYSQL
+# ============================================================
+
+
+def test_app_imports_without_mysql_connector():
+    code = "import sys; sys.modules['mysql'] = None; import app.main"
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", code], cwd=backend, check=True,
+                   env=dict(os.environ, DB_ENGINE="sqlite", SQLITE_PATH=":memory:"))
+
+# ============================================================
+# WRITE LOCK
+# ============================================================
+
+
+def test_failed_write_releases_the_write_lock(client):
+    test_id = client.get("/api/tests").json()[0]["test_id"]
+    r = client.post("/api/orders", json={"patientId": 999999, "priority": "normal", "testIds": [test_id]})
+    assert r.status_code == 400
+
+    t0 = time.perf_counter()
+    new_patient(client)
+    assert time.perf_counter() - t0 < config.SQLITE_BUSY_TIMEOUT_MS / 1000
+
+
+def test_close_discards_uncommitted_work(client, db):
+    conn = storage.get_engine().connect()
+    cur = conn.cursor()
+    cur.execute("INSERT INTO doctors (full_name) VALUES ('Uncommitted')")
+    conn.close()
+
+    cur = db.cursor()
+    cur.execute("INSERT INTO doctors (full_name) VALUES ('Committed')")
+    db.commit()
+    names = [r[0] for r in query(db, "SELECT full_name FROM doctors WHERE full_name LIKE '%committed'")]
+    assert names == ["Committed"]
+
+# ============================================================
+# ORDERS
+# ============================================================
+
+
+def test_update_missing_order_writes_nothing(client, db):
+    (before,), = query(db, "SELECT COUNT(*) FROM activity_log")
+    r = client.put("/api/orders/999999", json={"notes": "x"})
+    assert r.status_code == 404
+    assert query(db, "SELECT COUNT(*) FROM activity_log") == [(before,)]
+    assert query(db, "SELECT COUNT(*) FROM event_outbox WHERE entity_id = 999999") == [(0,)]
+
+
+def test_update_archived_order_is_rejected(client, db):
+    order_id, _ = new_order(client)
+    cur = db.cursor()
+    cur.execute("UPDATE test_orders SET status = 'REPORT_READY', order_date = %s WHERE order_id = %s",
+                (datetime(1990, 1, 1), order_id))
+    db.commit()
+    cur.close()
+    assert archive.archive_batch(db, datetime(1990, 1, 2), 1) == 1
+
+    r = client.put(f"/api/orders/{order_id}", json={"notes": "x"})
+    assert r.status_code == 409
+
+# ============================================================
+# RESULTS
+# ============================================================
+
+
+def test_update_results_stores_values(client):
+    order_id, (first, second) = new_order(client)
+    r = client.put(f"/api/orders/{order_id}/results", json={
+        "results": [{"testId": first, "value": 12.5}, {"testId": second, "text": "trace"}],
+        "markCompleted": False,
+    })
+    assert r.status_code == 200, r.text
+
+    tests = {t["test_id"]: t for t in client.get(f"/api/orders/{order_id}").json()["tests"]}
+    assert tests[first]["result_value"] == 12.5
+    assert tests[second]["result_text"] == "trace"
+
+
+@pytest.mark.parametrize("dictionary", [False, True])
+def test_record_results_with_any_cursor(client, db, dictionary):
+    order_id, (test_id, _) = new_order(client)
+    cur = db.cursor(dictionary=dictionary)
+    matched = results.record_results(cur, [(order_id, test_id, 3.25, None), (order_id, 999999, 1.0, None)])
+    db.commit()
+    cur.close()
+    assert matched == {(order_id, test_id)}
+    rows = query(db, "SELECT result_value FROM test_order_tests WHERE order_id = %s AND test_id = %s",
+                 (order_id, test_id))
+    assert float(rows[0][0]) == 3.25
+
+# ============================================================
+# ACCESSION BLOCKS (LAST_INSERT_ID)
+# ============================================================
+
+
+def test_accession_blocks_never_overlap(client):
+    connect = storage.get_engine().connect
+    day = date(2001, 2, 3)
+    a = accession.BlockAllocator(connect, 5)
+    b = accession.BlockAllocator(connect, 5)
+    assert a.reserve("77", day, 5) == (1, 6)
+    assert b.reserve("77", day, 5) == (6, 11)
+    assert a.reserve("77", day, 3) == (11, 14)
+
+    numbers = [a.next("78", day) for _ in range(3)] + [b.next("78", day) for _ in range(2)]
+    assert numbers == [accession.format_accession("78", day, seq) for seq in (1, 2, 3, 6, 7)]
+
+# ============================================================
+# SEQUENTIAL SET EVALUATION
+# ============================================================
+
+
+def test_tat_stamps_see_the_new_status(client, db):
+    order_id, _ = new_order(client)
+    cur = db.cursor()
+    cur.execute(f"UPDATE test_orders SET status = 'REPORT_READY', {tat.STAMP_SQL} WHERE order_id = %s",
+                (order_id,))
+    db.commit()
+    cur.close()
+    (collected, entered, ready), = query(db, """
+        SELECT sample_collected_at, results_entered_at, report_ready_at
+        FROM test_orders WHERE order_id = %s
+    """, (order_id,))
+    assert collected is None
+    assert isinstance(entered, datetime) and isinstance(ready, datetime)
+
+
+def test_outbox_settle_counts_the_failed_attempt(client, db):
+    cur = db.cursor()
+    ids = []
+    for attempts in (0, config.OUTBOX_MAX_ATTEMPTS - 1):
+        cur.execute("""
+            INSERT INTO event_outbox (event_type, entity_type, entity_id, payload, attempts)
+            VALUES ('test.event', 'test', 1, '{}', %s)
+        """, (attempts,))
+        ids.append((cur.lastrowid, attempts))
+    db.commit()
+    cur.close()
+
+    dispatcher = outbox.Dispatcher(storage.get_engine().connect, [], 10, 1.0)
+    events = [{"id": event_id, "attempts": attempts} for event_id, attempts in ids]
+    failed = {event_id: ["webhook:test"] for event_id, _ in ids}
+    errors = {event_id: "webhook:test: down" for event_id, _ in ids}
+    dispatcher.settle(db, events, failed, errors)
+
+    rows = query(db, "SELECT attempts, status, pending_sinks FROM event_outbox WHERE event_id IN (%s, %s) "
+                     "ORDER BY event_id", tuple(event_id for event_id, _ in ids))
+    assert rows == [
+        (1, "PENDING", '["webhook:test"]'),
+        (config.OUTBOX_MAX_ATTEMPTS, "DEAD", '["webhook:test"]'),
+    ]
+
+# ============================================================
+# ON UPDATE CURRENT_TIMESTAMP
+# ============================================================
+
+
+def test_updated_at_is_stamped_unless_set(client, db):
+    order_id, _ = new_order(client)
+    cur = db.cursor()
+    old = datetime(2000, 1, 1)
+    cur.execute("UPDATE test_orders SET updated_at = %s WHERE order_id = %s", (old, order_id))
+    db.commit()
+    assert query(db, "SELECT updated_at FROM test_orders WHERE order_id = %s", (order_id,)) == [(old,)]
+
+    cur.execute("UPDATE test_orders SET notes = 'stamped' WHERE order_id = %s", (order_id,))
+    db.commit()
+    cur.close()
+    (updated_at,), = query(db, "SELECT updated_at FROM test_orders WHERE order_id = %s", (order_id,))
+    assert updated_at > old
+
+# ============================================================
+# VALUES
+# ============================================================
+
+
+def test_only_temporal_columns_become_dates(client, db):
+    order_id, (test_id, _) = new_order(client)
+    cur = db.cursor()
+    cur.execute("UPDATE test_order_tests SET result_text = '2024-05-01' WHERE order_id = %s AND test_id = %s",
+                (order_id, test_id))
+    cur.execute("UPDATE test_orders SET order_date = '2024-05-01 08:30:00' WHERE order_id = %s", (order_id,))
+    db.commit()
+    cur.close()
+
+    (text,), = query(db, "SELECT result_text FROM test_order_tests WHERE order_id = %s AND test_id = %s",
+                     (order_id, test_id))
+    assert text == "2024-05-01"
+    (ordered, day, later), = query(db, """
+        SELECT order_date, DATE(order_date) AS day, order_date + INTERVAL 1 DAY
+        FROM test_orders WHERE order_id = %s
+    """, (order_id,))
+    assert ordered == datetime(2024, 5, 1, 8, 30)
+    assert day == date(2024, 5, 1)
+    assert later == datetime(2024, 5, 2, 8, 30)